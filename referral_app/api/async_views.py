@@ -0,0 +1,104 @@
+import json
+
+from asgiref.sync import sync_to_async
+from django.contrib.auth import get_user_model
+from django.http import JsonResponse
+from rest_framework.exceptions import Throttled
+
+from users.utils import db_sync_to_async
+
+from .authentication import get_user_token
+from .serializers import CustomAuthTokenSerializer, UserCreateSerializer
+from .throttling import get_throttle_wait
+from .utils import send_verification_code
+
+User = get_user_model()
+
+
+def parse_body(request):
+    """Читает данные запроса в формате JSON или формы."""
+    if request.content_type == 'application/json':
+        try:
+            data = json.loads(request.body or b'{}')
+        except ValueError:
+            return None
+        return data if isinstance(data, dict) else None
+    return request.POST
+
+
+def method_not_allowed(request):
+    return JsonResponse(
+        {'detail': f'Метод "{request.method}" не разрешен.'},
+        status=405,
+    )
+
+
+def too_many_requests(wait):
+    exception = Throttled(wait)
+    response = JsonResponse(
+        {'detail': str(exception.detail)},
+        status=exception.status_code,
+        json_dumps_params={'ensure_ascii': False},
+    )
+    response['Retry-After'] = str(exception.wait)
+    return response
+
+
+def bad_request(errors):
+    return JsonResponse(errors, status=400, json_dumps_params={
+        'ensure_ascii': False})
+
+
+async def register(request):
+    """Асинхронная версия эндпойнта регистрации. Ответы совпадают
+    с UserCreateView. Обращения к БД выполняются в пуле потоков,
+    поэтому регистрации из разных запросов идут параллельно."""
+    if request.method != 'POST':
+        return method_not_allowed(request)
+    data = parse_body(request)
+    if data is None:
+        return bad_request({'detail': 'Некорректное тело запроса.'})
+    request.data = data
+    wait = await sync_to_async(get_throttle_wait)(request)
+    if wait is not None:
+        return too_many_requests(wait)
+    serializer = UserCreateSerializer(data=data)
+    if not serializer.is_valid():
+        return bad_request(serializer.errors)
+    phone = serializer.validated_data['phone']
+    user = await User.objects.aregister(phone)
+    if user is None:
+        return bad_request({'detail': 'Не удалось создать пользователя'})
+    await sync_to_async(send_verification_code,
+                        thread_sensitive=False)(phone)
+    return JsonResponse({'id': user.id, 'phone': user.phone}, status=201)
+
+
+async def verify(request):
+    """Асинхронная версия эндпойнта верификации: проверяет код
+    и возвращает токен авторизации."""
+    if request.method != 'POST':
+        return method_not_allowed(request)
+    data = parse_body(request)
+    if data is None:
+        return bad_request({'detail': 'Некорректное тело запроса.'})
+    serializer = CustomAuthTokenSerializer(
+        data=data, context={'request': request})
+    if not await db_sync_to_async(serializer.is_valid)():
+        return bad_request(serializer.errors)
+    token = await db_sync_to_async(issue_token)(
+        serializer.validated_data['user'])
+    return JsonResponse({'token': token.key})
+
+
+def issue_token(user):
+    """Возвращает токен пользователя и выдает ему инвайт-код."""
+    token = get_user_token(user)
+    user.create_invite_code()
+    return token
+
+
+# Декоратор csrf_exempt в Django 4.2 превращает корутину в обычную
+# функцию, поэтому отметка ставится напрямую.
+register.csrf_exempt = True
+verify.csrf_exempt = True
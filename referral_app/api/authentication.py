@@ -0,0 +1,179 @@
+import copy
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import caches
+from django.db import DEFAULT_DB_ALIAS, router
+from django.utils.translation import gettext_lazy as _
+from rest_framework import exceptions
+from rest_framework.authentication import TokenAuthentication
+from rest_framework.authtoken.models import Token
+
+from users.routers import primary_for
+from users.sharding import get_user_shard_aliases
+
+User = get_user_model()
+
+
+class TokenCache:
+    """LRU-кэш токенов авторизации в памяти процесса с ограничением
+    времени жизни записей. Считает попадания и промахи."""
+
+    def __init__(self, maxsize, ttl):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.shared_hits = 0
+
+    def get(self, key):
+        with self._lock:
+            item = self._data.get(key)
+            if item is not None:
+                expires, token = item
+                if expires > time.monotonic():
+                    self._data.move_to_end(key)
+                    self.hits += 1
+                    return token
+                del self._data[key]
+            self.misses += 1
+            return None
+
+    def set(self, key, token):
+        with self._lock:
+            self._data[key] = (time.monotonic() + self.ttl, token)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def delete_user(self, user_id):
+        with self._lock:
+            keys = [key for key, (_, token) in self._data.items()
+                    if token.user_id == user_id]
+            for key in keys:
+                del self._data[key]
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self.hits = self.misses = self.shared_hits = 0
+
+    def stats(self):
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'shared_hits': self.shared_hits,
+                'misses': self.misses,
+                'size': len(self._data),
+            }
+
+
+token_cache = TokenCache(settings.TOKEN_CACHE_SIZE, settings.TOKEN_CACHE_TTL)
+
+
+def get_shared_cache():
+    if settings.TOKEN_CACHE_ALIAS is None:
+        return None
+    return caches[settings.TOKEN_CACHE_ALIAS]
+
+
+def shared_cache_key(key):
+    return f'auth-token:{key}'
+
+
+def invalidate_token(key):
+    """Удаляет токен из локального и общего кэша."""
+    token_cache.delete(key)
+    shared_cache = get_shared_cache()
+    if shared_cache is not None:
+        shared_cache.delete(shared_cache_key(key))
+
+
+def invalidate_user_tokens(user_id, using=DEFAULT_DB_ALIAS):
+    """Удаляет из кэшей все токены пользователя из БД using."""
+    token_cache.delete_user(user_id)
+    shared_cache = get_shared_cache()
+    if shared_cache is not None:
+        keys = (Token.objects.using(primary_for(using))
+                .filter(user_id=user_id).values_list('key', flat=True))
+        shared_cache.delete_many([shared_cache_key(key) for key in keys])
+
+
+def get_user_token(user):
+    """Токен пользователя, созданный при необходимости. Токен хранится
+    в БД пользователя (см. settings.USER_SHARDS): id пользователей
+    уникальны только в пределах одной БД."""
+    db = router.db_for_write(Token, instance=user)
+    token, created = Token.objects.using(db).get_or_create(user=user)
+    return token
+
+
+def find_token(key):
+    """Токен с пользователем по ключу или None. Ключ не говорит, в какой
+    БД пользователей лежит токен, поэтому БД проверяются по очереди;
+    найденный токен дальше берется из кэша."""
+    for alias in get_user_shard_aliases():
+        token = (Token.objects.using(alias).select_related('user')
+                 .filter(key=key).first())
+        if token is not None:
+            return token
+    return None
+
+
+class CachedTokenAuthentication(TokenAuthentication):
+    """Авторизация по токену с кэшированием связки токен - пользователь.
+    Сначала токен ищется в LRU-кэше процесса, затем в общем кэше
+    (если задан TOKEN_CACHE_ALIAS) и только потом во всех БД
+    пользователей. В общем кэше хранятся только БД и id пользователя,
+    сам пользователь при попадании в общий кэш загружается из БД.
+
+    Удаление токена и деактивация пользователя сбрасывают записи через
+    сигналы. Локальные кэши других процессов об этом не узнают, поэтому
+    в них запись живет не дольше TOKEN_CACHE_TTL секунд."""
+
+    def authenticate_credentials(self, key):
+        token = token_cache.get(key)
+        if token is None:
+            token = self.get_shared_token(key)
+        if token is None:
+            token = find_token(key)
+            if token is None:
+                raise exceptions.AuthenticationFailed(_('Invalid token.'))
+            token_cache.set(key, token)
+            shared_cache = get_shared_cache()
+            if shared_cache is not None:
+                shared_cache.set(shared_cache_key(key),
+                                 (token._state.db, token.user_id),
+                                 settings.TOKEN_CACHE_TTL)
+        # Пользователь из кэша общий для потоков и запросов, поэтому
+        # каждый запрос получает свою копию.
+        user = copy.copy(token.user)
+        if not user.is_active:
+            raise exceptions.AuthenticationFailed(
+                _('User inactive or deleted.'))
+        return (user, token)
+
+    def get_shared_token(self, key):
+        shared_cache = get_shared_cache()
+        if shared_cache is None:
+            return None
+        cached = shared_cache.get(shared_cache_key(key))
+        if cached is None:
+            return None
+        db, user_id = cached
+        user = User.objects.using(db).filter(pk=user_id).first()
+        if user is None:
+            return None
+        token = Token(key=key, user=user)
+        token_cache.shared_hits += 1
+        token_cache.set(key, token)
+        return token
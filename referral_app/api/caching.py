@@ -0,0 +1,70 @@
+import hashlib
+import json
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.serializers.json import DjangoJSONEncoder
+
+
+def get_response_cache():
+    return caches[settings.USER_DETAIL_CACHE_ALIAS]
+
+
+def user_detail_generation_key(user_id):
+    return f'user-detail-generation:{user_id}'
+
+
+def new_generation():
+    # Поколение начинается со времени, а не с нуля: если счетчик
+    # вытеснен из кэша, старые записи не станут снова актуальными.
+    return time.time_ns()
+
+
+def user_detail_cache_key(user_id):
+    """Ключ кэша данных пользователя в текущем поколении. Ключ
+    берется до чтения из БД: если данные изменятся, пока строится
+    ответ, инвалидация сменит поколение, и устаревший ответ
+    запишется под ключ, который больше никто не читает."""
+    cache = get_response_cache()
+    generation_key = user_detail_generation_key(user_id)
+    generation = cache.get(generation_key)
+    if generation is None:
+        generation = new_generation()
+        if not cache.add(generation_key, generation, None):
+            generation = cache.get(generation_key)
+    return f'user-detail:{user_id}:{generation}'
+
+
+def make_etag(data):
+    """ETag ответа - хэш от его данных."""
+    content = json.dumps(data, sort_keys=True, cls=DjangoJSONEncoder)
+    return '"{}"'.format(hashlib.md5(content.encode()).hexdigest())
+
+
+def get_user_detail(key):
+    """Возвращает пару (данные, ETag) из кэша по ключу
+    user_detail_cache_key или None."""
+    return get_response_cache().get(key)
+
+
+def set_user_detail(key, data):
+    """Кэширует данные пользователя и возвращает их ETag."""
+    etag = make_etag(data)
+    get_response_cache().set(key, (data, etag),
+                             settings.USER_DETAIL_CACHE_TTL)
+    return etag
+
+
+def invalidate_user_detail(*user_ids):
+    """Сбрасывает кэш данных пользователей с указанными id: их
+    поколение увеличивается, прежние записи истекают по TTL."""
+    cache = get_response_cache()
+    for user_id in user_ids:
+        if user_id is None:
+            continue
+        generation_key = user_detail_generation_key(user_id)
+        try:
+            cache.incr(generation_key)
+        except ValueError:
+            cache.add(generation_key, new_generation(), None)
@@ -0,0 +1,219 @@
+import contextvars
+import functools
+import threading
+import time
+from bisect import bisect_left
+
+from django.db import connections
+from django.db.backends.signals import connection_created
+from rest_framework import serializers
+
+from users.sms import queue_metrics
+from users.tasks import delivery_metrics
+
+from .authentication import token_cache
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+QUERY_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+
+REQUEST_HISTOGRAMS = (
+    ('request_duration_seconds', 'duration', LATENCY_BUCKETS,
+     'Время обработки запроса'),
+    ('request_db_queries', 'queries', QUERY_BUCKETS,
+     'Количество запросов к БД на запрос'),
+    ('request_db_duration_seconds', 'db_time', LATENCY_BUCKETS,
+     'Время запросов к БД на запрос'),
+    ('request_serializer_duration_seconds', 'serializer_time',
+     LATENCY_BUCKETS, 'Время сериализации на запрос'),
+)
+SMS_METRICS = (
+    ('batches', 'counter', 'Количество пакетов sms'),
+    ('messages', 'counter', 'Количество sms в пакетах'),
+    ('avg_batch_size', 'gauge', 'Средний размер пакета sms'),
+    ('max_batch_size', 'gauge', 'Максимальный размер пакета sms'),
+    ('avg_queue_latency', 'gauge',
+     'Среднее время ожидания sms в очереди, сек'),
+    ('max_queue_latency', 'gauge',
+     'Максимальное время ожидания sms в очереди, сек'),
+)
+# queue - буфер процесса приложения, delivery - отправка провайдеру.
+SMS_STAGES = (('queue', queue_metrics), ('delivery', delivery_metrics))
+METRICS_PREFIX = 'referral_app_'
+
+# Замер текущего запроса или None, если запрос не попал в выборку.
+current_sample = contextvars.ContextVar('request_sample', default=None)
+
+
+class RequestSample:
+    """Замер одного запроса: запросы к БД и время сериализации.
+    Запросы к БД могут выполняться из нескольких потоков
+    (sync_to_async), поэтому запись идет под блокировкой."""
+
+    def __init__(self):
+        self.queries = []
+        self.db_time = 0.0
+        self.serializer_time = 0.0
+        self.serializing = False
+        self._lock = threading.Lock()
+
+    def add_query(self, sql, duration):
+        with self._lock:
+            self.db_time += duration
+            self.queries.append((sql, duration))
+
+
+def record_query(execute, sql, params, many, context):
+    """Обертка execute_wrapper, которая стоит на всех соединениях.
+    Запрос записывается в замер из current_sample: contextvar
+    копируется в потоки sync_to_async, поэтому учитываются запросы
+    из любого потока, выполняемые в рамках замеряемого запроса."""
+    sample = current_sample.get()
+    if sample is None:
+        return execute(sql, params, many, context)
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        sample.add_query(sql, time.perf_counter() - started)
+
+
+def add_query_recording(connection, **kwargs):
+    # Обертка ставится в начало списка: execute_wrapper() снимает
+    # последнюю добавленную обертку.
+    if record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.insert(0, record_query)
+
+
+def install_query_recording():
+    """Ставит record_query на соединения текущего потока и на все
+    соединения, открытые позже в любом потоке."""
+    connection_created.connect(add_query_recording,
+                               dispatch_uid='api.metrics.record_query')
+    for connection in connections.all(initialized_only=True):
+        add_query_recording(connection)
+
+
+class Histogram:
+    """Гистограмма с фиксированными границами корзин, как в Prometheus:
+    counts[i] - количество значений не больше buckets[i]."""
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def cumulative(self):
+        total = 0
+        for bound, count in zip(self.buckets + ('+Inf',), self.counts):
+            total += count
+            yield bound, total
+
+
+class RequestMetrics:
+    """Гистограммы по представлениям, собранные в памяти процесса."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self._histograms = {}
+
+    def observe(self, view, duration, sample):
+        values = {
+            'duration': duration,
+            'queries': len(sample.queries),
+            'db_time': sample.db_time,
+            'serializer_time': sample.serializer_time,
+        }
+        with self._lock:
+            for name, key, buckets, _ in REQUEST_HISTOGRAMS:
+                histogram = self._histograms.get((name, view))
+                if histogram is None:
+                    histogram = self._histograms[(name, view)] = (
+                        Histogram(buckets))
+                histogram.observe(values[key])
+
+    def render(self):
+        """Метрики в текстовом формате Prometheus."""
+        lines = []
+        with self._lock:
+            for name, _, _, help_text in REQUEST_HISTOGRAMS:
+                metric = METRICS_PREFIX + name
+                lines.append(f'# HELP {metric} {help_text}')
+                lines.append(f'# TYPE {metric} histogram')
+                for (hist_name, view), histogram in sorted(
+                        self._histograms.items()):
+                    if hist_name != name:
+                        continue
+                    label = f'view="{escape_label(view)}"'
+                    for bound, count in histogram.cumulative():
+                        lines.append(
+                            f'{metric}_bucket{{{label},le="{bound}"}} '
+                            f'{count}')
+                    lines.append(f'{metric}_sum{{{label}}} {histogram.sum}')
+                    lines.append(
+                        f'{metric}_count{{{label}}} {histogram.count}')
+        for key, value in token_cache.stats().items():
+            metric = f'{METRICS_PREFIX}token_cache_{key}'
+            lines.append(f'# TYPE {metric} '
+                         f'{"gauge" if key == "size" else "counter"}')
+            lines.append(f'{metric} {value}')
+        lines.extend(render_sms_metrics())
+        return '\n'.join(lines) + '\n'
+
+
+def render_sms_metrics():
+    """Размер пакетов и время ожидания sms в очереди по этапам."""
+    stats = [(stage, metrics.stats()) for stage, metrics in SMS_STAGES]
+    for key, metric_type, help_text in SMS_METRICS:
+        metric = f'{METRICS_PREFIX}sms_{key}'
+        yield f'# HELP {metric} {help_text}'
+        yield f'# TYPE {metric} {metric_type}'
+        for stage, values in stats:
+            yield f'{metric}{{stage="{stage}"}} {values[key]}'
+
+
+def escape_label(value):
+    return (value.replace('\\', '\\\\').replace('"', '\\"')
+            .replace('\n', '\\n'))
+
+
+request_metrics = RequestMetrics()
+
+
+def timed_data(fget):
+    """Обертка свойства data сериализатора: в запросах из выборки
+    добавляет время сериализации к замеру. Вложенные сериализаторы
+    учитываются в составе внешнего."""
+    @functools.wraps(fget)
+    def data(self):
+        sample = current_sample.get()
+        if sample is None or sample.serializing:
+            return fget(self)
+        sample.serializing = True
+        started = time.perf_counter()
+        try:
+            return fget(self)
+        finally:
+            sample.serializing = False
+            sample.serializer_time += time.perf_counter() - started
+    data.timed = True
+    return data
+
+
+def install_serializer_timing():
+    """Подменяет свойство data у сериализаторов DRF на замеряющее
+    время. Вне выборки обертка стоит одной проверки contextvar."""
+    for serializer_class in (serializers.Serializer,
+                             serializers.ListSerializer):
+        fget = serializer_class.data.fget
+        if not getattr(fget, 'timed', False):
+            serializer_class.data = property(timed_data(fget))
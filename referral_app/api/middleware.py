@@ -0,0 +1,154 @@
+import logging
+import random
+import time
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from rest_framework.permissions import SAFE_METHODS
+
+from users.routers import replica_reads
+
+from .metrics import (RequestSample, current_sample,
+                      install_query_recording, install_serializer_timing,
+                      request_metrics)
+
+logger = logging.getLogger(__name__)
+
+PRIMARY_UNTIL_HEADER = 'X-Primary-Until'
+
+
+class RequestMetricsMiddleware:
+    """Собирает по представлениям количество и время запросов к БД,
+    время сериализации и общее время обработки запроса. Включается
+    настройкой REQUEST_METRICS_ENABLED. Замеряется доля запросов
+    REQUEST_METRICS_SAMPLE_RATE, остальные проходят без накладных
+    расходов. Замеренные запросы дольше SLOW_REQUEST_THRESHOLD секунд
+    пишутся в лог вместе со списком запросов к БД.
+
+    Работает и в синхронном (WSGI), и в асинхронном (ASGI) режиме.
+    Запросы к БД учитываются во всех потоках, в том числе из
+    sync_to_async, через обертку на каждом соединении
+    (install_query_recording)."""
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if not settings.REQUEST_METRICS_ENABLED:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+        install_serializer_timing()
+        install_query_recording()
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        if random.random() >= settings.REQUEST_METRICS_SAMPLE_RATE:
+            return self.get_response(request)
+        sample = RequestSample()
+        token = current_sample.set(sample)
+        started = time.perf_counter()
+        try:
+            response = self.get_response(request)
+        finally:
+            current_sample.reset(token)
+        self.observe(request, time.perf_counter() - started, sample)
+        return response
+
+    async def __acall__(self, request):
+        if random.random() >= settings.REQUEST_METRICS_SAMPLE_RATE:
+            return await self.get_response(request)
+        sample = RequestSample()
+        token = current_sample.set(sample)
+        started = time.perf_counter()
+        try:
+            response = await self.get_response(request)
+        finally:
+            current_sample.reset(token)
+        self.observe(request, time.perf_counter() - started, sample)
+        return response
+
+    def observe(self, request, duration, sample):
+        match = request.resolver_match
+        view = match.view_name if match else 'unresolved'
+        request_metrics.observe(view, duration, sample)
+        if duration >= settings.SLOW_REQUEST_THRESHOLD:
+            self.log_slow_request(request, view, duration, sample)
+
+    def log_slow_request(self, request, view, duration, sample):
+        queries = '\n'.join(f'  {query_time * 1000:.1f} мс: {sql}'
+                            for sql, query_time in sample.queries)
+        logger.warning(
+            'Медленный запрос %s %s (%s): %.0f мс, запросов к БД: %d '
+            '(%.0f мс), сериализация: %.0f мс\n%s',
+            request.method, request.path, view, duration * 1000,
+            len(sample.queries), sample.db_time * 1000,
+            sample.serializer_time * 1000, queries,
+        )
+
+
+class ReplicaReadMiddleware:
+    """Направляет чтение в безопасных запросах (GET, HEAD, OPTIONS)
+    на реплики из DATABASE_REPLICAS. После успешного изменяющего
+    запроса клиент REPLICA_STICKY_TIME секунд читает из основной БД,
+    чтобы видеть свои изменения: ответ содержит cookie
+    REPLICA_STICKY_COOKIE и заголовок X-Primary-Until с моментом
+    окончания этого окна. Клиенты без поддержки cookie передают
+    заголовок в следующих запросах.
+
+    Работает и в синхронном (WSGI), и в асинхронном (ASGI) режиме:
+    флаг чтения с реплик хранится в contextvar и передается в потоки
+    sync_to_async."""
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if not any(settings.DATABASE_REPLICAS.values()):
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        if self.reads_from_replica(request):
+            with replica_reads():
+                return self.get_response(request)
+        return self.process_write(request, self.get_response(request))
+
+    async def __acall__(self, request):
+        if self.reads_from_replica(request):
+            with replica_reads():
+                return await self.get_response(request)
+        return self.process_write(request, await self.get_response(request))
+
+    def reads_from_replica(self, request):
+        return (request.method in SAFE_METHODS
+                and not self.is_sticky(request))
+
+    def process_write(self, request, response):
+        if request.method not in SAFE_METHODS and response.status_code < 400:
+            self.stick(response)
+        return response
+
+    def is_sticky(self, request):
+        value = (request.COOKIES.get(settings.REPLICA_STICKY_COOKIE)
+                 or request.headers.get(PRIMARY_UNTIL_HEADER))
+        try:
+            return float(value) > time.time()
+        except (TypeError, ValueError):
+            return False
+
+    def stick(self, response):
+        until = f'{time.time() + settings.REPLICA_STICKY_TIME:.3f}'
+        response.set_cookie(settings.REPLICA_STICKY_COOKIE, until,
+                            max_age=settings.REPLICA_STICKY_TIME,
+                            httponly=True, samesite='Lax')
+        response[PRIMARY_UNTIL_HEADER] = until
@@ -0,0 +1,20 @@
+from rest_framework.pagination import CursorPagination
+
+
+class UserCursorPagination(CursorPagination):
+    """Курсорная пагинация по id. В отличие от пагинации по номеру
+    страницы не использует OFFSET, поэтому глубокие страницы
+    отдаются так же быстро, как первая."""
+
+    ordering = '-id'
+    page_size = 100
+    page_size_query_param = 'limit'
+    max_page_size = 1000
+
+
+class ApplicantCursorPagination(UserCursorPagination):
+    """Курсорная пагинация списка пользователей, которые ввели
+    инвайт-код пользователя. Порядок совпадает с индексом
+    (inviter, phone)."""
+
+    ordering = 'phone'
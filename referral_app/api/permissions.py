@@ -1,5 +1,15 @@
 from rest_framework import permissions
 
+from users.routers import primary_for
+
+
+def is_same_user(obj, user):
+    """Совпадают ли пользователи. Кроме id сравнивается БД: id
+    уникальны только в пределах одной БД пользователей
+    (settings.USER_SHARDS)."""
+    return (obj == user
+            and primary_for(obj._state.db) == primary_for(user._state.db))
+
 
 class IsOwnerOrReadOnly(permissions.IsAuthenticatedOrReadOnly):
     """Верификация для изменения данных о пользователе.Проверяем
@@ -8,4 +18,12 @@ class IsOwnerOrReadOnly(permissions.IsAuthenticatedOrReadOnly):
 
     def has_object_permission(self, request, view, obj):
         return (request.method in permissions.SAFE_METHODS
-                or obj == request.user)
+                or is_same_user(obj, request.user))
+
+
+class IsOwnerOrAdmin(permissions.IsAuthenticated):
+    """Доступ к данным пользователя только для него самого
+    и персонала."""
+
+    def has_object_permission(self, request, view, obj):
+        return is_same_user(obj, request.user) or request.user.is_staff
@@ -1,8 +1,10 @@
+from django.conf import settings
 from django.contrib.auth import authenticate, get_user_model
-from django.db import IntegrityError, transaction
+from django.db import transaction
 from django.utils.translation import gettext_lazy as _
 from rest_framework import serializers
-from rest_framework.utils import model_meta
+
+from users.signals import invite_code_applied
 
 User = get_user_model()
 
@@ -29,9 +31,7 @@ class UserSerializer(serializers.ModelSerializer):
 
         if granted_code is None:
             return data
-        request = self.context.get('request')
-        user_id = request.parser_context.get('kwargs').get('pk')
-        user = User.objects.get(id=user_id)
+        user = self.instance
         if user.granted_code:
             raise serializers.ValidationError(
                 'Повторный ввод кода недопустим'
@@ -40,13 +40,40 @@ class UserSerializer(serializers.ModelSerializer):
             raise serializers.ValidationError(
                 'Нельзя вводить собственный инвайт-код'
             )
-        invite_codes = User.objects.filter(invite_code=granted_code)
-        if not invite_codes:
+        inviter_id = (User.objects
+                      .filter(invite_code=granted_code)
+                      .values_list('id', flat=True)
+                      .first())
+        if inviter_id is None:
             raise serializers.ValidationError(
                 'Введенный инвайт-код не существует'
             )
+        data['inviter_id'] = inviter_id
         return data
 
+    def update(self, instance, validated_data):
+        inviter_id = validated_data.pop('inviter_id', None)
+        if inviter_id is None:
+            return super().update(instance, validated_data)
+        # Код записывается одним условным UPDATE вместе с остальными
+        # полями: если пользователь успел ввести код в параллельном
+        # запросе, строка не обновится.
+        with transaction.atomic():
+            updated = (User.objects
+                       .filter(pk=instance.pk, granted_code='')
+                       .update(inviter_id=inviter_id, **validated_data))
+            if not updated:
+                raise serializers.ValidationError(
+                    'Повторный ввод кода недопустим'
+                )
+            User.objects.increment_applicants_count(inviter_id)
+        invite_code_applied.send(
+            sender=User, user_id=instance.pk, inviter_id=inviter_id)
+        for attr, value in validated_data.items():
+            setattr(instance, attr, value)
+        instance.inviter_id = inviter_id
+        return instance
+
 
 class UserBriefSerializer(serializers.ModelSerializer):
     """Класс для сериализации модели пользователя - при запросах
@@ -60,14 +87,32 @@ class UserBriefSerializer(serializers.ModelSerializer):
         read_only_fields = ('phone',)
 
 
+class LeaderboardSerializer(serializers.ModelSerializer):
+    """Класс для сериализации модели пользователя - при выводе
+    рейтинга пригласивших."""
+
+    class Meta:
+        model = User
+        fields = (
+            'id',
+            'phone',
+            'invite_code',
+            'applicants_count',
+        )
+        read_only_fields = fields
+
+
 class UserRetrieveSerializer(serializers.ModelSerializer):
     code_applicants = serializers.SerializerMethodField()
 
     def get_code_applicants(self, obj):
-        queryset = (User.objects.values('phone')
-                    .filter(granted_code=obj.invite_code)
-                    .order_by('phone'))
-        return UserBriefSerializer(queryset, read_only=True, many=True).data
+        applicants = getattr(obj, 'first_applicants', None)
+        if applicants is None:
+            applicants = (obj.applicants
+                          .only('phone', 'inviter_id')
+                          .order_by('phone')
+                          [:settings.CODE_APPLICANTS_LIMIT])
+        return UserBriefSerializer(applicants, read_only=True, many=True).data
 
     class Meta:
         model = User
@@ -100,37 +145,11 @@ class UserCreateSerializer(serializers.Serializer):
         'cannot_create_user': 'Не удалось создать пользователя'}
 
     def create(self, validated_data):
-        try:
-            with transaction.atomic():
-                user = User.objects.create_user(**validated_data)
-
-        except IntegrityError:
-            users = User.objects.filter(phone=validated_data.get('phone'))
-            if not users:
-                self.fail('cannot_create_user')
-            user = users.first()
-            return self.update(user, validated_data)
-
+        user = User.objects.register(validated_data.get('phone'))
+        if user is None:
+            self.fail('cannot_create_user')
         return user
 
-    def update(self, instance, validated_data):
-        info = model_meta.get_field_info(instance)
-
-        m2m_fields = []
-        for attr, value in validated_data.items():
-            if attr in info.relations and info.relations[attr].to_many:
-                m2m_fields.append((attr, value))
-            else:
-                setattr(instance, attr, value)
-
-        instance.save()
-
-        for attr, value in m2m_fields:
-            field = getattr(instance, attr)
-            field.set(value)
-
-        return instance
-
 
 class CustomAuthTokenSerializer(serializers.Serializer):
     """Класс для сериализации модели токена."""
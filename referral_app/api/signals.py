@@ -0,0 +1,60 @@
+from django.contrib.auth import get_user_model
+from django.db import DEFAULT_DB_ALIAS
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from rest_framework.authtoken.models import Token
+
+from users.signals import invite_code_applied, users_bulk_updated
+
+from .authentication import invalidate_token, invalidate_user_tokens
+from .caching import invalidate_user_detail
+
+User = get_user_model()
+
+
+@receiver(post_delete, sender=Token)
+def drop_deleted_token(sender, instance, **kwargs):
+    """Удаленный токен убирается из кэша авторизации."""
+    invalidate_token(instance.key)
+
+
+@receiver(post_save, sender=User)
+def drop_inactive_user_tokens(sender, instance, **kwargs):
+    """Токены деактивированного пользователя убираются из кэша
+    авторизации."""
+    if not instance.is_active:
+        invalidate_user_tokens(instance.id, instance._state.db)
+
+
+@receiver(post_save, sender=User)
+def drop_saved_user_detail(sender, instance, created, **kwargs):
+    """Измененные данные пользователя убираются из кэша ответов.
+    Новый пользователь с полученным инвайт-кодом меняет список
+    приглашенных у пригласившего."""
+    if created:
+        invalidate_user_detail(instance.inviter_id)
+    else:
+        invalidate_user_detail(instance.id)
+
+
+@receiver(post_delete, sender=User)
+def drop_deleted_user_detail(sender, instance, **kwargs):
+    invalidate_user_detail(instance.id, instance.inviter_id)
+
+
+@receiver(invite_code_applied)
+def drop_applied_code_user_detail(sender, user_id, inviter_id, **kwargs):
+    """После ввода инвайт-кода меняются данные и того, кто ввел код,
+    и того, чей код введен."""
+    invalidate_user_detail(user_id, inviter_id)
+
+
+@receiver(users_bulk_updated)
+def drop_bulk_updated_users(sender, user_ids, fields,
+                            using=DEFAULT_DB_ALIAS, **kwargs):
+    """После массового изменения пользователей сбрасываются кэш ответов
+    и, если менялась активность, токены в кэше авторизации."""
+    invalidate_user_detail(*user_ids)
+    if 'is_active' in fields:
+        for user_id in user_ids:
+            invalidate_user_tokens(user_id, using)
@@ -0,0 +1,117 @@
+import json
+from unittest import mock
+
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.test import (AsyncRequestFactory, TransactionTestCase,
+                         override_settings)
+from django.urls import path
+from rest_framework.authtoken.models import Token
+
+from api import async_views
+from api.throttling import PhoneRateThrottle
+from users.verification import get_code_store
+
+User = get_user_model()
+
+urlpatterns = [
+    path('api/auth/registration/', async_views.register),
+    path('api/auth/verification/', async_views.verify),
+]
+
+
+@mock.patch('api.utils.get_sms_batcher')
+class AsyncViewsTests(TransactionTestCase):
+    # Запросы к БД идут из потоков пула со своими соединениями, им
+    # не видны данные из незавершенной транзакции TestCase.
+
+    def setUp(self):
+        cache.clear()
+        self.factory = AsyncRequestFactory()
+        self.user = User.objects.create_user(phone=79998887760)
+
+    def post(self, view, data):
+        request = self.factory.post('/', data=json.dumps(data),
+                                    content_type='application/json')
+        return view(request)
+
+    async def test_register_creates_user_and_queues_sms(self, get_batcher):
+        """Асинхронная регистрация создает пользователя и ставит sms
+        в буфер отправки."""
+        response = await self.post(async_views.register,
+                                   {'phone': 79998887765})
+        self.assertEqual(response.status_code, 201)
+        user = await User.objects.aget(phone=79998887765)
+        self.assertEqual(json.loads(response.content),
+                         {'id': user.id, 'phone': user.phone})
+        get_batcher.return_value.add.assert_called_once()
+
+    async def test_register_returns_existing_user(self, get_batcher):
+        """Повторная регистрация возвращает существующего пользователя."""
+        response = await self.post(async_views.register,
+                                   {'phone': self.user.phone})
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(json.loads(response.content)['id'], self.user.id)
+        self.assertEqual(await User.objects.acount(), 1)
+
+    @override_settings(ROOT_URLCONF='api.tests.test_async_views')
+    async def test_views_work_through_asgi_handler(self, get_batcher):
+        """Асинхронные эндпойнты обрабатываются ASGI-обработчиком
+        со всеми middleware."""
+        response = await self.async_client.post(
+            '/api/auth/registration/', data={'phone': 79998887766},
+            content_type='application/json')
+        self.assertEqual(response.status_code, 201)
+        code = get_batcher.return_value.add.call_args.kwargs['text'][-4:]
+        response = await self.async_client.post(
+            '/api/auth/verification/',
+            data={'phone': 79998887766, 'verification_code': code},
+            content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('token', response.json())
+
+    async def test_register_rejects_invalid_data(self, get_batcher):
+        """Некорректные данные и методы отклоняются."""
+        for data in [{'phone': 'text'}, {'phone': -79998887766}, {}]:
+            with self.subTest(data=str(data)):
+                response = await self.post(async_views.register, data)
+                self.assertEqual(response.status_code, 400)
+        response = await async_views.register(self.factory.get('/'))
+        self.assertEqual(response.status_code, 405)
+        get_batcher.return_value.add.assert_not_called()
+
+    async def test_register_is_throttled_by_phone(self, get_batcher):
+        """Асинхронная регистрация ограничивает частоту запросов кода
+        на один номер телефона."""
+        rates = {'registration_phone': '1/min', 'registration_ip': None}
+        with mock.patch.dict(PhoneRateThrottle.THROTTLE_RATES, rates):
+            first = await self.post(async_views.register,
+                                    {'phone': 79998887765})
+            second = await self.post(async_views.register,
+                                     {'phone': 79998887765})
+        self.assertEqual(first.status_code, 201)
+        self.assertEqual(second.status_code, 429)
+        self.assertIn('Retry-After', second)
+
+    async def test_verify_returns_token(self, get_batcher):
+        """Асинхронная верификация возвращает токен и выдает
+        инвайт-код."""
+        code = get_code_store().issue(self.user.phone)
+        response = await self.post(
+            async_views.verify,
+            {'phone': self.user.phone, 'verification_code': code})
+        self.assertEqual(response.status_code, 200)
+        token = await Token.objects.aget(user_id=self.user.id)
+        self.assertEqual(json.loads(response.content), {'token': token.key})
+        user = await User.objects.aget(id=self.user.id)
+        self.assertTrue(user.invite_code)
+
+    async def test_verify_rejects_wrong_code(self, get_batcher):
+        """Неверный код не приводит к авторизации."""
+        get_code_store().issue(self.user.phone, code='1111')
+        response = await self.post(
+            async_views.verify,
+            {'phone': self.user.phone, 'verification_code': '2222'})
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(
+            await Token.objects.filter(user_id=self.user.id).aexists())
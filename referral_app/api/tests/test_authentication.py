@@ -0,0 +1,86 @@
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.test import override_settings
+from django.urls import reverse
+from rest_framework import status
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient, APITestCase
+
+from api.authentication import (CachedTokenAuthentication,
+                                shared_cache_key, token_cache)
+
+User = get_user_model()
+
+
+class CachedTokenAuthenticationTests(APITestCase):
+
+    def setUp(self):
+        token_cache.clear()
+        cache.clear()
+        self.user = User.objects.create_user(
+            phone=79998887760,
+            invite_code='AAa111',
+        )
+        self.token = Token.objects.create(user=self.user)
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {self.token.key}')
+        self.url = reverse('api-user-detail', args=[self.user.id])
+
+    def patch_user(self, first_name='John'):
+        return self.client.patch(self.url, data={'first_name': first_name},
+                                 format='json')
+
+    def test_repeat_requests_skip_token_query(self):
+        """Повторный запрос с тем же токеном не обращается к таблице
+        токенов."""
+        self.assertEqual(self.patch_user().status_code, status.HTTP_200_OK)
+        # Загрузка пользователя и сохранение изменений.
+        with self.assertNumQueries(2):
+            response = self.patch_user('Jane')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(token_cache.stats()['hits'], 1)
+        self.assertEqual(token_cache.stats()['misses'], 1)
+
+    def test_deleted_token_is_rejected(self):
+        """Удаленный токен сбрасывается из кэша и перестает работать."""
+        self.patch_user()
+        self.token.delete()
+        response = self.patch_user()
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_deactivated_user_is_rejected(self):
+        """Токены деактивированного пользователя сбрасываются из кэша."""
+        self.patch_user()
+        self.user.is_active = False
+        self.user.save()
+        response = self.patch_user()
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+    @override_settings(TOKEN_CACHE_ALIAS='default')
+    def test_shared_cache_is_used_after_local_miss(self):
+        """При промахе локального кэша токен берется из общего кэша."""
+        self.patch_user()
+        self.assertEqual(cache.get(shared_cache_key(self.token.key)),
+                         ('default', self.user.id))
+        token_cache.clear()
+        # Загрузка пользователя по id из общего кэша, загрузка
+        # пользователя представлением и сохранение изменений.
+        with self.assertNumQueries(3):
+            self.patch_user('Jane')
+        self.assertEqual(token_cache.stats()['shared_hits'], 1)
+
+    def test_cache_hit_returns_user_copy(self):
+        """Каждый запрос получает свою копию пользователя из кэша."""
+        authentication = CachedTokenAuthentication()
+        first, _ = authentication.authenticate_credentials(self.token.key)
+        second, _ = authentication.authenticate_credentials(self.token.key)
+        self.assertIsNot(first, second)
+        first.first_name = 'Jane'
+        self.assertEqual(second.first_name, '')
+
+    def test_cache_hit_checks_is_active(self):
+        """При попадании в кэш проверяется активность пользователя."""
+        self.patch_user()
+        token_cache.get(self.token.key).user.is_active = False
+        response = self.patch_user('Jane')
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
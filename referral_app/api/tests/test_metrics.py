@@ -0,0 +1,141 @@
+from asgiref.sync import iscoroutinefunction, sync_to_async
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.http import HttpResponse
+from django.test import (AsyncRequestFactory, TestCase, TransactionTestCase,
+                         override_settings)
+from django.urls import reverse
+from rest_framework.test import APIClient
+
+from api.metrics import Histogram, request_metrics
+from api.middleware import RequestMetricsMiddleware
+from users.sms import queue_metrics
+from users.tasks import delivery_metrics
+from users.utils import db_sync_to_async
+
+User = get_user_model()
+
+
+@override_settings(REQUEST_METRICS_ENABLED=True,
+                   REQUEST_METRICS_SAMPLE_RATE=1.0,
+                   SLOW_REQUEST_THRESHOLD=60.0,
+                   METRICS_TOKEN='secret')
+class RequestMetricsTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        request_metrics.reset()
+        self.user = User.objects.create_user(phone=79998887760,
+                                             invite_code='AAa111')
+        User.objects.create_user(phone=79998887761, granted_code='AAa111')
+        self.client = APIClient()
+
+    def metrics(self, **headers):
+        headers.setdefault('HTTP_AUTHORIZATION', 'Bearer secret')
+        return self.client.get(reverse('metrics'), **headers)
+
+    def test_histogram_counts_values_by_bucket(self):
+        """Гистограмма считает значения в корзинах накопительно."""
+        histogram = Histogram((1, 5))
+        for value in (0, 1, 3, 7):
+            histogram.observe(value)
+        self.assertEqual(list(histogram.cumulative()),
+                         [(1, 2), (5, 3), ('+Inf', 4)])
+        self.assertEqual((histogram.sum, histogram.count), (11, 4))
+
+    def test_middleware_records_queries_per_view(self):
+        """Middleware записывает количество запросов к БД, время
+        сериализации и общее время по имени представления."""
+        self.client.get(reverse('api-user-detail', args=[self.user.id]))
+        text = self.metrics().content.decode()
+        view = 'view="api-user-detail"'
+        self.assertIn(
+            f'referral_app_request_db_queries_bucket{{{view},le="2"}} 1',
+            text)
+        self.assertIn(
+            f'referral_app_request_db_queries_bucket{{{view},le="1"}} 0',
+            text)
+        self.assertIn(
+            f'referral_app_request_serializer_duration_seconds_count'
+            f'{{{view}}} 1', text)
+        self.assertIn(
+            f'referral_app_request_duration_seconds_count{{{view}}} 1',
+            text)
+        self.assertIn('referral_app_token_cache_hits', text)
+
+    @override_settings(REQUEST_METRICS_SAMPLE_RATE=0.0)
+    def test_unsampled_requests_are_not_recorded(self):
+        """Запросы вне выборки не замеряются."""
+        self.client.get(reverse('api-user-detail', args=[self.user.id]))
+        self.assertNotIn('api-user-detail', self.metrics().content.decode())
+
+    @override_settings(SLOW_REQUEST_THRESHOLD=0.0)
+    def test_slow_request_is_logged_with_queries(self):
+        """Медленный запрос пишется в лог со списком запросов к БД."""
+        with self.assertLogs('api.middleware', 'WARNING') as logs:
+            self.client.get(reverse('api-user-detail', args=[self.user.id]))
+        self.assertIn('api-user-detail', logs.output[0])
+        self.assertIn('SELECT', logs.output[0])
+
+    def test_sms_batch_metrics_are_exported(self):
+        """Размер пакетов и время ожидания sms отдаются по этапам."""
+        self.addCleanup(queue_metrics.reset)
+        self.addCleanup(delivery_metrics.reset)
+        queue_metrics.reset()
+        delivery_metrics.reset()
+        queue_metrics.observe_batch(
+            [{'queued_at': 10.0}, {'queued_at': 11.0}], sent_at=12.0)
+        text = self.metrics().content.decode()
+        self.assertIn('referral_app_sms_max_batch_size{stage="queue"} 2',
+                      text)
+        self.assertIn(
+            'referral_app_sms_avg_queue_latency{stage="queue"} 1.5', text)
+        self.assertIn('referral_app_sms_batches{stage="delivery"} 0', text)
+
+    def test_metrics_endpoint_requires_token(self):
+        """Метрики отдаются только с токеном METRICS_TOKEN."""
+        self.assertEqual(self.metrics().status_code, 200)
+        for header in ('', 'Bearer wrong'):
+            with self.subTest(header=header):
+                response = self.metrics(HTTP_AUTHORIZATION=header)
+                self.assertEqual(response.status_code, 403)
+
+    @override_settings(METRICS_TOKEN='')
+    def test_metrics_endpoint_is_hidden_without_token(self):
+        """Без METRICS_TOKEN эндпойнт метрик недоступен."""
+        self.assertEqual(self.metrics().status_code, 404)
+
+    @override_settings(REQUEST_METRICS_ENABLED=False)
+    def test_metrics_endpoint_is_disabled_by_default(self):
+        """Без REQUEST_METRICS_ENABLED эндпойнт метрик недоступен."""
+        self.assertEqual(self.metrics().status_code, 404)
+
+
+@override_settings(REQUEST_METRICS_ENABLED=True,
+                   REQUEST_METRICS_SAMPLE_RATE=1.0,
+                   SLOW_REQUEST_THRESHOLD=60.0)
+class AsyncRequestMetricsTests(TransactionTestCase):
+    # Запросы к БД идут из потоков пула со своими соединениями.
+
+    def setUp(self):
+        request_metrics.reset()
+
+    async def test_async_middleware_records_queries_from_threads(self):
+        """В асинхронном режиме middleware учитывает запросы к БД
+        из потоков sync_to_async, в том числе из пула потоков."""
+        async def get_response(request):
+            await db_sync_to_async(User.objects.count)()
+            await sync_to_async(User.objects.count)()
+            return HttpResponse()
+
+        middleware = RequestMetricsMiddleware(get_response)
+        self.assertTrue(iscoroutinefunction(middleware))
+        await middleware(AsyncRequestFactory().get('/'))
+        text = request_metrics.render()
+        view = 'view="unresolved"'
+        self.assertIn(
+            f'referral_app_request_db_queries_bucket{{{view},le="1"}} 0',
+            text)
+        self.assertIn(
+            f'referral_app_request_db_queries_bucket{{{view},le="2"}} 1',
+            text)
@@ -0,0 +1,138 @@
+import time
+from unittest import skipUnless
+
+from asgiref.sync import iscoroutinefunction, sync_to_async
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.exceptions import MiddlewareNotUsed
+from django.http import HttpResponse
+from django.test import (AsyncRequestFactory, SimpleTestCase, TestCase,
+                         override_settings)
+from django.urls import reverse
+from rest_framework.test import APIClient
+
+from api.middleware import ReplicaReadMiddleware
+from users.routers import replica_for, replica_reads
+
+User = get_user_model()
+
+REPLICA = 'replica_1'
+# Реплика есть только в настройках referral_app.settings_replicas.
+REPLICATED = REPLICA in settings.DATABASES
+
+
+class ReplicaMiddlewareSettingsTests(SimpleTestCase):
+
+    @override_settings(DATABASE_REPLICAS={'default': []})
+    def test_middleware_unused_without_replicas(self):
+        """Без реплик middleware не подключается."""
+        with self.assertRaises(MiddlewareNotUsed):
+            ReplicaReadMiddleware(lambda request: None)
+
+    @override_settings(DATABASE_REPLICAS={'default': [REPLICA]})
+    async def test_async_middleware_routes_reads(self):
+        """В асинхронном режиме GET-запрос читает с реплики, в том
+        числе из потоков sync_to_async, а изменяющий запрос - из
+        основной БД и закрепляет клиента за ней."""
+        async def get_response(request):
+            response = HttpResponse()
+            response.db = await sync_to_async(replica_for)('default')
+            return response
+
+        middleware = ReplicaReadMiddleware(get_response)
+        self.assertTrue(iscoroutinefunction(middleware))
+        factory = AsyncRequestFactory()
+        response = await middleware(factory.get('/'))
+        self.assertEqual(response.db, REPLICA)
+        response = await middleware(factory.post('/'))
+        self.assertEqual(response.db, 'default')
+        self.assertIn('X-Primary-Until', response.headers)
+
+
+@skipUnless(REPLICATED, 'нужны настройки referral_app.settings_replicas')
+@override_settings(DATABASE_REPLICAS={'default': [REPLICA]})
+class ReplicaReadTests(TestCase):
+    databases = {'default', REPLICA} if REPLICATED else {'default'}
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(phone=79998887760,
+                                             first_name='Fresh')
+        # Репликация между тестовыми БД не настроена: на реплике
+        # лежит отставшая копия пользователя.
+        User.objects.db_manager(REPLICA).create_user(
+            id=self.user.id, phone=79998887760, first_name='Stale')
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.user)
+        self.url = reverse('api-user-detail', args=[self.user.id])
+
+    def first_name(self, **headers):
+        # Список пользователей не кэшируется.
+        response = self.client.get(reverse('api-user-list'), **headers)
+        self.assertEqual(response.status_code, 200)
+        return response.data['results'][0]['first_name']
+
+    def test_get_reads_from_replica(self):
+        """Проверяем, что GET-запрос читает данные с реплики."""
+        with self.assertNumQueries(0, using='default'):
+            self.assertEqual(self.first_name(), 'Stale')
+
+    def test_detail_cache_is_filled_from_primary(self):
+        """Проверяем, что кэш детальных данных заполняется только
+        из основной БД и после окончания окна чтения из основной БД
+        клиент не получает данные отставшей реплики."""
+        url = reverse('api-user-detail', args=[self.user.id])
+        response = self.client.get(url)
+        self.assertEqual(response.data['first_name'], 'Fresh')
+        response = self.client.patch(url, {'first_name': 'Jane'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.client.get(url).data['first_name'], 'Jane')
+        self.client.cookies[settings.REPLICA_STICKY_COOKIE] = str(
+            time.time() - 1)
+        with self.assertNumQueries(0, using='default'), \
+                self.assertNumQueries(0, using=REPLICA):
+            response = self.client.get(url)
+        self.assertEqual(response.data['first_name'], 'Jane')
+
+    def test_reads_after_write_use_primary(self):
+        """Проверяем, что после изменения клиент читает из основной
+        БД, пока действует cookie."""
+        response = self.client.patch(self.url, {'last_name': 'Doe'})
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(settings.REPLICA_STICKY_COOKIE, response.cookies)
+        self.assertIn('X-Primary-Until', response.headers)
+        self.assertEqual(self.first_name(), 'Fresh')
+
+        self.client.cookies[settings.REPLICA_STICKY_COOKIE] = str(
+            time.time() - 1)
+        self.assertEqual(self.first_name(), 'Stale')
+
+    def test_sticky_header(self):
+        """Проверяем, что клиенты без cookie передают окно чтения из
+        основной БД заголовком."""
+        until = str(time.time() + 60)
+        self.assertEqual(self.first_name(HTTP_X_PRIMARY_UNTIL=until),
+                         'Fresh')
+        self.assertEqual(self.first_name(HTTP_X_PRIMARY_UNTIL='bad'),
+                         'Stale')
+
+    def test_failed_write_is_not_sticky(self):
+        """Проверяем, что отклоненный запрос не переключает чтение на
+        основную БД."""
+        response = self.client.patch(self.url, {'granted_code': 'ZZZZZZ'})
+        self.assertEqual(response.status_code, 400)
+        self.assertNotIn(settings.REPLICA_STICKY_COOKIE, response.cookies)
+        self.assertEqual(self.first_name(), 'Stale')
+
+    def test_save_after_replica_read_writes_primary(self):
+        """Проверяем, что объект, прочитанный с реплики, сохраняется
+        в основную БД."""
+        with replica_reads():
+            user = User.objects.get(pk=self.user.pk)
+            self.assertEqual(user._state.db, REPLICA)
+            user.last_name = 'Doe'
+            user.save()
+        self.assertEqual(User.objects.get(pk=self.user.pk).last_name, 'Doe')
+        self.assertEqual(User.objects.using(REPLICA)
+                         .get(pk=self.user.pk).last_name, '')
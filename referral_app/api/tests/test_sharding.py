@@ -0,0 +1,86 @@
+from unittest import mock, skipUnless
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from rest_framework import status
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
+
+from api.authentication import token_cache
+
+User = get_user_model()
+
+SHARD = 'users_shard_1'
+SHARDS = [
+    (71000000000, 75999999999, 'default'),
+    (76000000000, 79999999999, SHARD),
+]
+# Вторая БД есть только в настройках referral_app.settings_shards.
+SHARDED = SHARD in settings.DATABASES
+
+
+@skipUnless(SHARDED, 'нужны настройки referral_app.settings_shards')
+@override_settings(USER_SHARDS=SHARDS, TOKEN_CACHE_ALIAS='default')
+@mock.patch('api.utils.get_sms_batcher')
+class ShardedTokenTests(TestCase):
+    databases = {'default', SHARD} if SHARDED else {'default'}
+
+    def setUp(self):
+        cache.clear()
+        token_cache.clear()
+        self.client = APIClient()
+
+    def sign_in(self, phone, get_batcher):
+        response = self.client.post(reverse('api-register'),
+                                    {'phone': phone}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        code = get_batcher.return_value.add.call_args.kwargs['text'][-4:]
+        response = self.client.post(
+            reverse('api-verification'),
+            {'phone': phone, 'verification_code': code}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return response.data['token']
+
+    def test_token_authenticates_user_from_shard(self, get_batcher):
+        """Проверяем, что после верификации токен пользователя из
+        другой БД авторизует именно его, а не пользователя БД по
+        умолчанию с тем же id."""
+        far = User.objects.register(79998887760)
+        near = User.objects.create_user(id=far.id, phone=71234567890)
+        token = self.sign_in(far.phone, get_batcher)
+        self.assertTrue(Token.objects.using(SHARD)
+                        .filter(key=token, user_id=far.id).exists())
+        self.assertFalse(Token.objects.filter(key=token).exists())
+
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {token}')
+        url = reverse('api-user-detail', args=[near.id])
+        for attempt in ('db', 'local cache', 'shared cache'):
+            with self.subTest(attempt=attempt):
+                if attempt == 'shared cache':
+                    token_cache.clear()
+                response = self.client.patch(
+                    url, {'first_name': 'Mallory'}, format='json')
+                self.assertEqual(response.wsgi_request.user.phone,
+                                 far.phone)
+                # Пользователь с тем же id из другой БД - чужой.
+                self.assertEqual(response.status_code,
+                                 status.HTTP_403_FORBIDDEN)
+        near.refresh_from_db()
+        self.assertEqual(near.first_name, '')
+
+    def test_deactivation_drops_shard_tokens(self, get_batcher):
+        """Проверяем, что деактивация пользователя из другой БД
+        сбрасывает его токены из кэшей."""
+        token = self.sign_in(79998887760, get_batcher)
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {token}')
+        url = reverse('api-referral-leaderboard')
+        self.assertEqual(self.client.get(url).status_code,
+                         status.HTTP_200_OK)
+        user = User.objects.for_phone(79998887760).get(phone=79998887760)
+        user.is_active = False
+        user.save()
+        self.assertEqual(self.client.get(url).status_code,
+                         status.HTTP_401_UNAUTHORIZED)
@@ -0,0 +1,114 @@
+from unittest import mock
+
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.test import RequestFactory, TestCase
+from django.urls import reverse
+from rest_framework import status
+from rest_framework.test import APIClient
+
+from api.throttling import (IpRateThrottle, PhoneRateThrottle,
+                            get_throttle_wait)
+
+User = get_user_model()
+
+RATES = {'registration_phone': '2/min', 'registration_ip': '4/min'}
+
+
+@mock.patch.dict(PhoneRateThrottle.THROTTLE_RATES, RATES)
+class ThrottlingTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.now = 6000.0
+        timer = mock.patch(
+            'api.throttling.SlidingWindowRateThrottle.timer',
+            side_effect=lambda *args: self.now)
+        timer.start()
+        self.addCleanup(timer.stop)
+        self.factory = RequestFactory()
+
+    def request(self, phone, ip='10.0.0.1'):
+        request = self.factory.post('/', REMOTE_ADDR=ip)
+        request.data = {'phone': phone}
+        return request
+
+    def allowed(self, throttle_class, request):
+        return throttle_class().allow_request(request, None)
+
+    def test_phone_throttle_uses_sliding_window(self):
+        """Лимит по телефону учитывает запросы предыдущего окна
+        пропорционально непрошедшей части окна."""
+        phone = 79998887760
+        results = [self.allowed(PhoneRateThrottle, self.request(phone, ip))
+                   for ip in ('10.0.0.1', '10.0.0.2', '10.0.0.3')]
+        self.assertEqual(results, [True, True, False])
+        self.assertTrue(self.allowed(PhoneRateThrottle,
+                                     self.request(79998887761)))
+        # В середине следующего окна учитывается половина из трех
+        # запросов прошлого окна: 1.5 + 1 > 2.
+        self.now += 90
+        self.assertFalse(self.allowed(PhoneRateThrottle,
+                                      self.request(phone)))
+        self.now += 60
+        self.assertTrue(self.allowed(PhoneRateThrottle, self.request(phone)))
+
+    def test_phone_throttle_is_keyed_by_parsed_number(self):
+        """Разные записи одного номера попадают в один лимит."""
+        spellings = ['79998887760', '079998887760', '79998887760.0',
+                     ' 79998887760', '+79998887760']
+        results = [self.allowed(PhoneRateThrottle, self.request(phone))
+                   for phone in spellings]
+        self.assertEqual(results, [True, True, False, False, False])
+
+    def test_ip_throttle_is_keyed_by_address(self):
+        """Лимит по IP-адресу не зависит от номера телефона."""
+        results = [self.allowed(IpRateThrottle, self.request(phone))
+                   for phone in range(79998887760, 79998887765)]
+        self.assertEqual(results, [True] * 4 + [False])
+        self.assertTrue(self.allowed(
+            IpRateThrottle, self.request(79998887760, ip='10.0.0.2')))
+
+    def test_ip_throttle_ignores_spoofed_forwarded_for(self):
+        """Лимит по IP-адресу нельзя обойти, подставляя свои адреса
+        в X-Forwarded-For: учитывается адрес, добавленный прокси."""
+        results = []
+        for idx in range(5):
+            request = self.request(79998887760 + idx, ip='172.18.0.2')
+            request.META['HTTP_X_FORWARDED_FOR'] = (
+                f'192.168.0.{idx}, 10.0.0.1')
+            results.append(self.allowed(IpRateThrottle, request))
+        self.assertEqual(results, [True] * 4 + [False])
+
+    def test_get_throttle_wait_returns_time_to_next_window(self):
+        """get_throttle_wait возвращает None для разрешенного запроса
+        и время до следующего окна для отклоненного."""
+        self.now += 15
+        request = self.request(79998887760)
+        self.assertIsNone(get_throttle_wait(request))
+        self.assertIsNone(get_throttle_wait(request))
+        self.assertEqual(get_throttle_wait(request), 45)
+
+    def test_registration_rejects_non_object_body(self):
+        """Тело запроса не в виде объекта отклоняется с кодом 400."""
+        response = APIClient().post(reverse('api-register'), data=[1, 2],
+                                    format='json')
+        self.assertEqual(response.status_code,
+                         status.HTTP_400_BAD_REQUEST)
+
+    @mock.patch('api.utils.get_sms_batcher')
+    def test_registration_rejects_before_db_and_sms(self, get_batcher):
+        """Запрос регистрации сверх лимита отклоняется с кодом 429
+        без обращений к БД и без отправки sms."""
+        client = APIClient()
+        url = reverse('api-register')
+        for _ in range(2):
+            client.post(url, data={'phone': 79998887760}, format='json')
+        get_batcher.reset_mock()
+        with self.assertNumQueries(0):
+            response = client.post(url, data={'phone': 79998887760},
+                                   format='json')
+        self.assertEqual(response.status_code,
+                         status.HTTP_429_TOO_MANY_REQUESTS)
+        self.assertIn('Retry-After', response)
+        get_batcher.assert_not_called()
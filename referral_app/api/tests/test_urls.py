@@ -1,17 +1,23 @@
-from datetime import datetime
+from unittest import mock
 
-from django.conf import settings
 from django.contrib.auth import get_user_model
+from django.core.cache import cache
 from rest_framework.test import APIClient, APITestCase
 
+from users.verification import get_code_store
+
 User = get_user_model()
 
 
+# Sms не уходят в общий буфер процесса, иначе его таймер после
+# тестов обращается к брокеру.
+@mock.patch('api.utils.get_sms_batcher', new=mock.MagicMock())
 class ApiUrlsTests(APITestCase):
 
     @classmethod
     def setUpClass(cls):
         super().setUpClass()
+        cache.clear()
         cls.user_one = User.objects.create_user(
             phone=79998887760,
             invite_code='AAa111',
@@ -25,10 +31,9 @@ class ApiUrlsTests(APITestCase):
             phone=79998887762,
             invite_code='AAa113',
             granted_code='AAa111',
-            verification_code='1111',
-            verif_cutoff_timestamp=(datetime.utcnow().timestamp()
-                                    + settings.VERIF_TIME),
         )
+        cls.code_three = get_code_store().issue(cls.user_three.phone,
+                                                code='1111')
         cls.guest_client = APIClient()
         cls.authorized_client = APIClient()
         cls.authorized_client.force_authenticate(user=cls.user_one)
@@ -38,6 +43,7 @@ class ApiUrlsTests(APITestCase):
         пользователю."""
         urls_for_guest = [
             ('/api/users/', 200),
+            ('/api/users/export/', 200),
             (f'/api/users/{self.user_one.id}/', 200),
         ]
         for each_url, code in urls_for_guest:
@@ -51,7 +57,7 @@ class ApiUrlsTests(APITestCase):
         registration_data = {'phone': 79998887764}
         verif_data = {
             'phone': self.user_three.phone,
-            'verification_code': self.user_three.verification_code
+            'verification_code': self.code_three
         }
         urls_for_guest = [
             ('/api/auth/registration/', registration_data, 201),
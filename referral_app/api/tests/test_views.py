@@ -1,18 +1,29 @@
-from datetime import datetime
+import json
+from unittest import mock
 
-from django.conf import settings
 from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.db import connection
+from django.test import override_settings
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
 from rest_framework import status
 from rest_framework.authtoken.models import Token
 from rest_framework.test import APIClient, APITestCase
 
+from api.serializers import UserRetrieveSerializer
+from users.verification import get_code_store
+
 User = get_user_model()
 
 
+# Sms не уходят в общий буфер процесса, иначе его таймер после
+# тестов обращается к брокеру.
+@mock.patch('api.utils.get_sms_batcher', new=mock.MagicMock())
 class ApiViewsTests(APITestCase):
 
     def setUp(self):
+        cache.clear()
         self.user_one = User.objects.create_user(
             phone=79998887760,
             invite_code='AAa111',
@@ -26,16 +37,14 @@ class ApiViewsTests(APITestCase):
             phone=79998887762,
             invite_code='AAa113',
             granted_code='AAa111',
-            verification_code='2222',
-            verif_cutoff_timestamp=(datetime.utcnow().timestamp()
-                                    + settings.VERIF_TIME),
         )
         self.user_four = User.objects.create_user(
             phone=79998887763,
-            verification_code='1111',
-            verif_cutoff_timestamp=(datetime.utcnow().timestamp()
-                                    + settings.VERIF_TIME),
         )
+        self.code_three = get_code_store().issue(self.user_three.phone,
+                                                 code='2222')
+        self.code_four = get_code_store().issue(self.user_four.phone,
+                                                code='1111')
         self.guest_client = APIClient()
         self.authorized_client = APIClient()
         self.authorized_client.force_authenticate(user=self.user_one)
@@ -66,6 +75,21 @@ class ApiViewsTests(APITestCase):
                 expected_value = getattr(expected_user, key)
                 self.assertEqual(response_value, expected_value)
 
+    def test_api_regiser_post_queues_sms(self):
+        """Метод POST Эндпойнта api-register ставит sms с кодом в буфер
+        пакетной отправки, а не публикует задачу на каждый запрос."""
+        with mock.patch('api.utils.get_sms_batcher') as get_batcher:
+            response = self.guest_client.post(
+                reverse('api-register'),
+                data={'phone': 79998887765},
+                format='json'
+            )
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        get_batcher.return_value.add.assert_called_once()
+        kwargs = get_batcher.return_value.add.call_args.kwargs
+        self.assertEqual(kwargs['phone'], 79998887765)
+        self.assertRegex(kwargs['text'], r'\d{4}$')
+
     def test_api_regiser_post_invalid_data_fails(self):
         """Метод POST Эндпойнта api-regiser при отправке некорректных данных
         не создает пользователя и возвращает код 400."""
@@ -120,13 +144,47 @@ class ApiViewsTests(APITestCase):
             ]
         )
         self.assertEqual(response.status_code, status.HTTP_200_OK)
-        self.assertEqual(len(response.data), len(expected_users))
-        for user_idx, response_user in enumerate(response.data):
+        results = response.data['results']
+        self.assertEqual(len(results), len(expected_users))
+        for user_idx, response_user in enumerate(results):
             self.assertEqual(sorted(response_user.keys()), expected_keys)
             for key, response_value in response_user.items():
                 expected_value = getattr(expected_users[user_idx], key)
                 self.assertEqual(response_value, expected_value)
 
+    def test_api_user_list_cursor_pagination(self):
+        """Метод GET Эндпойнта api-user-list отдает пользователей
+        страницами по курсору без пропусков и повторов."""
+        expected_ids = list(
+            User.objects.order_by('-id').values_list('id', flat=True))
+        received_ids = []
+        url = reverse('api-user-list') + '?limit=3'
+        while url:
+            response = self.guest_client.get(url)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertLessEqual(len(response.data['results']), 3)
+            received_ids.extend(
+                item['id'] for item in response.data['results'])
+            url = response.data['next']
+        self.assertEqual(received_ids, expected_ids)
+
+    def test_api_user_export_streams_ndjson(self):
+        """Метод GET Эндпойнта api-user-export отдает всех пользователей
+        построчно в формате NDJSON."""
+        response = self.guest_client.get(reverse('api-user-export'))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertTrue(response.streaming)
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        lines = b''.join(response.streaming_content).decode().splitlines()
+        exported = [json.loads(line) for line in lines]
+        expected_users = User.objects.order_by('id')
+        self.assertEqual(len(exported), len(expected_users))
+        for item, user in zip(exported, expected_users):
+            with self.subTest(user=user.id):
+                self.assertEqual(item['id'], user.id)
+                self.assertEqual(item['phone'], user.phone)
+                self.assertEqual(item['invite_code'], user.invite_code)
+
     def test_api_user_list_invalid_methods_not_allowed(self):
         """Эндпойнт api-user-list не принимает запросы
         с неразрешенными методами."""
@@ -177,6 +235,181 @@ class ApiViewsTests(APITestCase):
                 expected_code_applicants[idx]['phone'],
             )
 
+    def test_api_user_detail_get_query_count(self):
+        """GET api_user_detail: пользователь и список применивших его
+        инвайт-код загружаются двумя запросами."""
+        with self.assertNumQueries(2):
+            response = self.guest_client.get(
+                reverse('api-user-detail', args=[self.user_one.id]))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(response.data['code_applicants']), 2)
+
+    @override_settings(CODE_APPLICANTS_LIMIT=1)
+    def test_api_user_detail_code_applicants_are_capped(self):
+        """GET api_user_detail: список применивших инвайт-код
+        ограничен настройкой CODE_APPLICANTS_LIMIT."""
+        response = self.guest_client.get(
+            reverse('api-user-detail', args=[self.user_one.id]))
+        self.assertEqual(response.data['code_applicants'],
+                         [{'phone': self.user_two.phone}])
+
+    def test_api_user_detail_get_is_cached_with_etag(self):
+        """GET api_user_detail: повторный запрос отдается из кэша без
+        обращений к БД, с совпадающим ETag - ответом 304."""
+        url = reverse('api-user-detail', args=[self.user_one.id])
+        response = self.guest_client.get(url)
+        etag = response['ETag']
+        with self.assertNumQueries(0):
+            cached_response = self.guest_client.get(url)
+        self.assertEqual(cached_response.data, response.data)
+        self.assertEqual(cached_response['ETag'], etag)
+        response = self.guest_client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertEqual(response['ETag'], etag)
+        response = self.guest_client.get(url, HTTP_IF_NONE_MATCH='"old"')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_api_user_detail_cache_is_invalidated(self):
+        """GET api_user_detail: кэш ответа сбрасывается при изменении
+        профиля и при вводе инвайт-кода пользователя."""
+        url = reverse('api-user-detail', args=[self.user_one.id])
+        etag = self.guest_client.get(url)['ETag']
+        self.authorized_client.patch(
+            url, data={'first_name': 'John'}, format='json')
+        response = self.guest_client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['first_name'], 'John')
+        etag = response['ETag']
+        client = APIClient()
+        client.force_authenticate(user=self.user_four)
+        client.patch(
+            reverse('api-user-detail', args=[self.user_four.id]),
+            data={'granted_code': self.user_one.invite_code},
+            format='json')
+        response = self.guest_client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertIn({'phone': self.user_four.phone},
+                      response.data['code_applicants'])
+
+    def test_api_user_detail_stale_read_is_not_cached(self):
+        """GET api_user_detail: ответ, построенный до изменения
+        пользователя, не попадает в кэш после инвалидации."""
+        url = reverse('api-user-detail', args=[self.user_one.id])
+        serializer_data = UserRetrieveSerializer.data
+
+        def change_user_during_read(serializer):
+            data = serializer_data.fget(serializer)
+            self.authorized_client.patch(
+                url, data={'first_name': 'John'}, format='json')
+            return data
+
+        with mock.patch.object(UserRetrieveSerializer, 'data',
+                               property(change_user_during_read)):
+            response = self.guest_client.get(url)
+        self.assertEqual(response.data['first_name'], '')
+        response = self.guest_client.get(url)
+        self.assertEqual(response.data['first_name'], 'John')
+
+    def test_api_user_detail_other_id_spelling_is_not_cached(self):
+        """GET api_user_detail: ответ на id с ведущими нулями
+        не кэшируется, так как его ключ не сбрасывается."""
+        url = reverse('api-user-detail', args=[f'0{self.user_one.id}'])
+        self.assertEqual(self.guest_client.get(url).status_code,
+                         status.HTTP_200_OK)
+        User.objects.filter(id=self.user_one.id).update(first_name='John')
+        self.assertEqual(self.guest_client.get(url).data['first_name'],
+                         'John')
+
+    def test_api_user_applicants_get_returns_all_pages(self):
+        """GET api-user-applicants: отдает всех применивших инвайт-код
+        пользователя постранично, в порядке номеров телефонов."""
+        url = (reverse('api-user-applicants', args=[self.user_one.id])
+               + '?limit=1')
+        phones = []
+        while url:
+            response = self.guest_client.get(url)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            phones.extend(item['phone'] for item in response.data['results'])
+            url = response.data['next']
+        self.assertEqual(phones, [self.user_two.phone, self.user_three.phone])
+
+    def test_api_user_applicants_query_count_is_constant(self):
+        """GET api-user-applicants: количество запросов к БД не зависит
+        от числа приглашенных на странице."""
+        url = reverse('api-user-applicants', args=[self.user_one.id])
+        for idx in range(5):
+            User.objects.create_user(phone=79998887770 + idx,
+                                     granted_code=self.user_one.invite_code)
+        with self.assertNumQueries(2):
+            response = self.guest_client.get(url)
+        self.assertEqual(len(response.data['results']), 7)
+
+    def test_api_user_referral_tree_get_returns_levels(self):
+        """GET api-user-referral-tree: отдает глубину, размер и количество
+        приглашенных на каждом уровне."""
+        client = APIClient()
+        client.force_authenticate(user=self.user_four)
+        client.patch(
+            reverse('api-user-detail', args=[self.user_four.id]),
+            data={'granted_code': self.user_two.invite_code},
+            format='json')
+        url = reverse('api-user-referral-tree', args=[self.user_one.id])
+        response = self.authorized_client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data, {
+            'depth': 2,
+            'size': 3,
+            'levels': [{'level': 1, 'count': 2}, {'level': 2, 'count': 1}],
+        })
+        response = self.authorized_client.get(url + '?depth=1')
+        self.assertEqual(response.data['levels'],
+                         [{'level': 1, 'count': 2}])
+        for depth in ('0', '100', 'x'):
+            with self.subTest(depth=depth):
+                response = self.authorized_client.get(
+                    url + f'?depth={depth}')
+                self.assertEqual(response.status_code,
+                                 status.HTTP_400_BAD_REQUEST)
+
+    def test_api_user_referral_tree_is_owner_or_staff_only(self):
+        """GET api-user-referral-tree и api-user-referral-tree-members:
+        дерево приглашенных видят только сам пользователь и персонал."""
+        staff_client = APIClient()
+        staff_client.force_authenticate(user=User.objects.create_user(
+            phone=79998887769, is_staff=True))
+        for name in ('api-user-referral-tree',
+                     'api-user-referral-tree-members'):
+            url = reverse(name, args=[self.user_one.id])
+            with self.subTest(name=name):
+                self.assertEqual(self.guest_client.get(url).status_code,
+                                 status.HTTP_401_UNAUTHORIZED)
+                self.assertEqual(
+                    self.authorized_client2.get(url).status_code,
+                    status.HTTP_403_FORBIDDEN)
+                self.assertEqual(staff_client.get(url).status_code,
+                                 status.HTTP_200_OK)
+
+    def test_api_user_referral_tree_members_get_returns_level(self):
+        """GET api-user-referral-tree-members: отдает приглашенных
+        на заданном уровне постранично."""
+        User.objects.filter(id=self.user_four.id).update(
+            inviter=self.user_two)
+        url = reverse('api-user-referral-tree-members',
+                      args=[self.user_one.id])
+        response = self.authorized_client.get(url + '?level=2')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['results'],
+                         [{'phone': self.user_four.phone}])
+        response = self.authorized_client.get(url)
+        self.assertEqual(
+            [item['phone'] for item in response.data['results']],
+            [self.user_two.phone, self.user_three.phone])
+        for level in ('0', '100', 'x'):
+            with self.subTest(level=level):
+                response = self.authorized_client.get(url + f'?level={level}')
+                self.assertEqual(response.status_code,
+                                 status.HTTP_400_BAD_REQUEST)
+
     def test_api_user_detail_invalid_methods_not_allowed(self):
         """Эндпойнт api-user-detail не принимает запросы
         с неразрешенными методами."""
@@ -256,6 +489,111 @@ class ApiViewsTests(APITestCase):
         updated_user = User.objects.get(id=self.user_one.id)
         self.assertEqual(updated_user.granted_code,
                          self.user_two.invite_code)
+        self.assertEqual(updated_user.inviter, self.user_two)
+
+    def test_api_user_detail_patch_granted_code_increments_counter(self):
+        """PATCH api_user_detail: ввод инвайт-кода увеличивает счетчик
+        приглашенных у владельца кода."""
+        count_before = User.objects.get(id=self.user_two.id).applicants_count
+        self.authorized_client.patch(
+            reverse('api-user-detail', args=[self.user_one.id]),
+            data={'granted_code': self.user_two.invite_code},
+            format='json')
+        count_after = User.objects.get(id=self.user_two.id).applicants_count
+        self.assertEqual(count_after, count_before + 1)
+
+    def test_api_user_detail_patch_granted_code_query_count(self):
+        """PATCH api_user_detail: ввод инвайт-кода выполняется без
+        повторной загрузки пользователя - поиск владельца кода, условное
+        обновление строки и увеличение счетчика."""
+        data = {
+            'first_name': 'John',
+            'granted_code': self.user_two.invite_code,
+        }
+        # Загрузка пользователя, поиск кода, два UPDATE, а также
+        # SAVEPOINT и RELEASE SAVEPOINT транзакции.
+        with self.assertNumQueries(6):
+            response = self.authorized_client.patch(
+                reverse('api-user-detail', args=[self.user_one.id]),
+                data=data,
+                format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        updated_user = User.objects.get(id=self.user_one.id)
+        self.assertEqual(updated_user.first_name, 'John')
+        self.assertEqual(updated_user.inviter, self.user_two)
+
+    def test_api_referral_leaderboard_get_returns_correct_data(self):
+        """GET api-referral-leaderboard: отдает пользователей с наибольшим
+        числом приглашенных в порядке убывания."""
+        self.authorized_client.patch(
+            reverse('api-user-detail', args=[self.user_one.id]),
+            data={'granted_code': self.user_three.invite_code},
+            format='json')
+        response = self.guest_client.get(
+            reverse('api-referral-leaderboard'))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(
+            [(item['id'], item['applicants_count'])
+             for item in response.data],
+            [(self.user_one.id, 2), (self.user_three.id, 1)],
+        )
+        self.assertEqual(
+            sorted(response.data[0].keys()),
+            sorted(['id', 'phone', 'invite_code', 'applicants_count']),
+        )
+        response = self.guest_client.get(
+            reverse('api-referral-leaderboard') + '?limit=1')
+        self.assertEqual(len(response.data), 1)
+
+    def test_api_referral_export_is_staff_only(self):
+        """GET api-referral-export: выгрузка графа доступна только
+        персоналу."""
+        url = reverse('api-referral-export')
+        self.assertEqual(self.guest_client.get(url).status_code,
+                         status.HTTP_401_UNAUTHORIZED)
+        self.assertEqual(self.authorized_client.get(url).status_code,
+                         status.HTTP_403_FORBIDDEN)
+
+    def test_api_referral_export_streams_edges(self):
+        """GET api-referral-export: отдает ребра графа потоком в CSV
+        или поколоночными порциями."""
+        staff = User.objects.create_user(phone=79998887769, is_staff=True)
+        client = APIClient()
+        client.force_authenticate(user=staff)
+        url = reverse('api-referral-export')
+        response = client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response['Content-Type'], 'text/csv')
+        lines = b''.join(response.streaming_content).decode().splitlines()
+        self.assertEqual(lines, [
+            'inviter_id,invitee_id',
+            f'{self.user_one.id},{self.user_two.id}',
+            f'{self.user_one.id},{self.user_three.id}',
+        ])
+        response = client.get(url + '?output=columns')
+        chunks = [json.loads(line) for line in b''.join(
+            response.streaming_content).decode().splitlines()]
+        self.assertEqual(chunks, [{
+            'inviter_id': [self.user_one.id, self.user_one.id],
+            'invitee_id': [self.user_two.id, self.user_three.id],
+        }])
+        response = client.get(url + '?output=parquet')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_api_user_detail_patch_updates_only_changed_columns(self):
+        """PATCH api_user_detail: UPDATE затрагивает только измененные
+        колонки."""
+        with CaptureQueriesContext(connection) as queries:
+            self.authorized_client.patch(
+                reverse('api-user-detail', args=[self.user_one.id]),
+                data={'first_name': 'John', 'last_name': ''},
+                format='json')
+        updates = [query['sql'] for query in queries
+                   if query['sql'].startswith('UPDATE')]
+        self.assertEqual(len(updates), 1)
+        set_clause = updates[0].split(' SET ')[1].split(' WHERE ')[0]
+        self.assertIn('"first_name"', set_clause)
+        self.assertEqual(set_clause.count('='), 1)
 
     def test_api_user_detail_patch_invalid_granted_code_fails(self):
         """PATCH api_user_detail: невалидный полученный инвайт-код не может
@@ -316,7 +654,7 @@ class ApiViewsTests(APITestCase):
         """POST api-verification: метод отдает правильный ответ."""
         user_data = {
             'phone': self.user_four.phone,
-            'verification_code': self.user_four.verification_code
+            'verification_code': self.code_four
         }
         invite_code_before = self.user_four.invite_code
         response = self.guest_client.post(
@@ -336,7 +674,7 @@ class ApiViewsTests(APITestCase):
         """POST api-verification: инвайт-код создается только один раз."""
         user_data = {
             'phone': self.user_three.phone,
-            'verification_code': self.user_three.verification_code
+            'verification_code': self.code_three
         }
         invite_code_before = self.user_three.invite_code
         response = self.guest_client.post(
@@ -363,11 +701,11 @@ class ApiViewsTests(APITestCase):
                 'phone': self.user_four.phone,
             },
             {
-                'verification_code': self.user_four.verification_code
+                'verification_code': self.code_four
             },
             {
                 'phone': 79998887790,
-                'verification_code': self.user_four.verification_code
+                'verification_code': self.code_four
             },
             {
                 'phone': self.user_four.phone,
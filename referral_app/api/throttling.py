@@ -0,0 +1,90 @@
+from collections.abc import Mapping
+
+from rest_framework import serializers
+from rest_framework.throttling import SimpleRateThrottle
+
+
+class SlidingWindowRateThrottle(SimpleRateThrottle):
+    """Ограничение частоты запросов по скользящему окну.
+
+    Вместо списка времен запросов (как в SimpleRateThrottle) хранятся
+    два счетчика: за текущее и за предыдущее окно фиксированной длины.
+    Количество запросов за последние duration секунд оценивается как
+    счетчик текущего окна плюс доля предыдущего, пропорциональная
+    непрошедшей части окна. Проверка стоит O(1) операций с кэшем,
+    счетчик увеличивается атомарным cache.incr. Отклоненные запросы
+    тоже учитываются, поэтому непрерывный поток запросов остается
+    заблокированным."""
+
+    def allow_request(self, request, view):
+        if self.rate is None:
+            return True
+        self.key = self.get_cache_key(request, view)
+        if self.key is None:
+            return True
+
+        now = self.timer()
+        window, offset = divmod(now, self.duration)
+        current_key = f'{self.key}:{int(window)}'
+        previous_key = f'{self.key}:{int(window) - 1}'
+        previous = self.cache.get(previous_key, 0)
+        self.cache.add(current_key, 0, self.duration * 2)
+        try:
+            current = self.cache.incr(current_key)
+        except ValueError:
+            # Ключ истек между add и incr.
+            self.cache.set(current_key, 1, self.duration * 2)
+            current = 1
+        self.remaining = self.duration - offset
+        estimate = previous * self.remaining / self.duration + current
+        return estimate <= self.num_requests
+
+    def wait(self):
+        return self.remaining
+
+
+class PhoneRateThrottle(SlidingWindowRateThrottle):
+    """Ограничение количества запросов кода на один номер телефона."""
+
+    scope = 'registration_phone'
+
+    def get_cache_key(self, request, view):
+        """Номер разбирается так же, как в UserCreateSerializer, чтобы
+        разные записи одного номера ('+7...', '07...', '7....0') не
+        получали отдельные лимиты. Без корректного номера ограничение
+        не применяется: такой запрос отклоняет сериализатор."""
+        if not isinstance(request.data, Mapping):
+            return None
+        try:
+            phone = serializers.IntegerField().to_internal_value(
+                request.data.get('phone'))
+        except serializers.ValidationError:
+            return None
+        return self.cache_format % {'scope': self.scope, 'ident': phone}
+
+
+class IpRateThrottle(SlidingWindowRateThrottle):
+    """Ограничение количества запросов кода с одного IP-адреса."""
+
+    scope = 'registration_ip'
+
+    def get_cache_key(self, request, view):
+        return self.cache_format % {
+            'scope': self.scope,
+            'ident': self.get_ident(request),
+        }
+
+
+REGISTRATION_THROTTLES = (PhoneRateThrottle, IpRateThrottle)
+
+
+def get_throttle_wait(request, throttle_classes=REGISTRATION_THROTTLES):
+    """Проверка ограничений для представлений без APIView. Возвращает
+    None, если запрос разрешен, иначе - время ожидания в секундах.
+    У запроса должен быть атрибут data с данными запроса."""
+    waits = [throttle.wait() for throttle in
+             (throttle_class() for throttle_class in throttle_classes)
+             if not throttle.allow_request(request, None)]
+    if not waits:
+        return None
+    return max(waits)
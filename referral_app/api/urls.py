@@ -1,18 +1,32 @@
+from django.conf import settings
 from django.contrib.auth import get_user_model
 from django.urls import include, path
 from rest_framework.routers import DefaultRouter
 
-from .views import CustomObtainAuthToken, UserCreateView, UserViewSet
+from . import async_views
+from .views import (CustomObtainAuthToken, ReferralExportView,
+                    ReferralLeaderboardView, UserCreateView, UserViewSet)
 
 User = get_user_model()
 
 router = DefaultRouter()
 router.register('users', UserViewSet, basename='api-user')
 
+if settings.ASYNC_AUTH_VIEWS:
+    register_view = async_views.register
+    verify_view = async_views.verify
+else:
+    register_view = UserCreateView.as_view()
+    verify_view = CustomObtainAuthToken.as_view()
+
 urlpatterns = [
     path('', include(router.urls)),
-    path('auth/registration/', UserCreateView.as_view(), name='api-register'),
-    path('auth/verification/',
-         CustomObtainAuthToken.as_view(),
-         name='api-verification'),
+    path('auth/registration/', register_view, name='api-register'),
+    path('auth/verification/', verify_view, name='api-verification'),
+    path('referrals/leaderboard/',
+         ReferralLeaderboardView.as_view(),
+         name='api-referral-leaderboard'),
+    path('referrals/export/',
+         ReferralExportView.as_view(),
+         name='api-referral-export'),
 ]
@@ -0,0 +1,30 @@
+import json
+
+from users.sms import get_sms_batcher
+from users.verification import get_code_store
+
+
+def iter_ndjson(queryset, fields, chunk_size):
+    """Генератор для потоковой выгрузки queryset в формате NDJSON.
+    Строки читаются из БД порциями по chunk_size и отдаются клиенту
+    по одной порции, поэтому весь список в память не загружается."""
+    rows = queryset.values_list(*fields).iterator(chunk_size=chunk_size)
+    lines = []
+    for row in rows:
+        lines.append(json.dumps(dict(zip(fields, row)), ensure_ascii=False))
+        if len(lines) >= chunk_size:
+            yield '\n'.join(lines) + '\n'
+            lines = []
+    if lines:
+        yield '\n'.join(lines) + '\n'
+
+
+def send_verification_code(phone):
+    """Создает код верификации для телефона и ставит sms с ним
+    в буфер пакетной отправки. Заблокированному после неверных
+    попыток телефону код не отправляется."""
+    code = get_code_store().issue(phone)
+    if code is None:
+        return None
+    get_sms_batcher().add(phone=phone, text=f'Код верификации {code}')
+    return code
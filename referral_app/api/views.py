@@ -1,20 +1,30 @@
-import datetime as dt
-
 from django.conf import settings
 from django.contrib.auth import get_user_model
-from rest_framework import mixins, status
-from rest_framework.authtoken.models import Token
+from django.http import Http404, HttpResponse, StreamingHttpResponse
+from django.utils.crypto import constant_time_compare
+from django.utils.http import parse_etags
+from rest_framework import generics, mixins, permissions, status
 from rest_framework.authtoken.views import ObtainAuthToken
+from rest_framework.decorators import action
 from rest_framework.response import Response
 from rest_framework.views import APIView
 from rest_framework.viewsets import GenericViewSet
 
-from users.tasks import send_sms
-from users.utils import generate_sequense
+from users.referrals import (EXPORT_FORMATS, iter_edges,
+                             referral_level_counts, referral_level_members)
+from users.routers import primary_reads
 
-from .permissions import IsOwnerOrReadOnly
-from .serializers import (CustomAuthTokenSerializer, UserCreateSerializer,
+from .authentication import get_user_token
+from .caching import (get_user_detail, make_etag, set_user_detail,
+                      user_detail_cache_key)
+from .metrics import request_metrics
+from .pagination import ApplicantCursorPagination, UserCursorPagination
+from .permissions import IsOwnerOrAdmin, IsOwnerOrReadOnly
+from .serializers import (CustomAuthTokenSerializer, LeaderboardSerializer,
+                          UserBriefSerializer, UserCreateSerializer,
                           UserRetrieveSerializer, UserSerializer)
+from .throttling import REGISTRATION_THROTTLES
+from .utils import iter_ndjson, send_verification_code
 
 User = get_user_model()
 
@@ -28,27 +38,180 @@ class UserViewSet(mixins.RetrieveModelMixin, mixins.UpdateModelMixin,
     queryset = User.objects.all()
     serializer_class = UserSerializer
     permission_classes = (IsOwnerOrReadOnly,)
+    pagination_class = UserCursorPagination
+
+    def get_queryset(self):
+        if self.action in ('retrieve',):
+            return User.objects.with_applicants()
+        return super().get_queryset()
 
     def get_serializer_class(self):
         if self.action in ('retrieve',):
             return UserRetrieveSerializer
         return UserSerializer
 
+    def retrieve(self, request, *args, **kwargs):
+        """Данные пользователя отдаются из кэша ответов с ETag. Если
+        данные не изменились с прошлого запроса клиента (заголовок
+        If-None-Match), отдается пустой ответ 304. Кэш общий для всех
+        клиентов, поэтому при промахе данные читаются из основной БД:
+        реплика может отставать от изменения, которое уже сбросило
+        кэш, и устаревший ответ остался бы в кэше до истечения TTL."""
+        key = user_detail_cache_key(self.kwargs['pk'])
+        cached = get_user_detail(key)
+        if cached is None:
+            with primary_reads():
+                data = super().retrieve(request, *args, **kwargs).data
+            # Ответ на другую запись id (например, "05") не кэшируется:
+            # инвалидация сбрасывает только поколение ключа с id.
+            if str(data['id']) == self.kwargs['pk']:
+                etag = set_user_detail(key, data)
+            else:
+                etag = make_etag(data)
+        else:
+            data, etag = cached
+        if etag in parse_etags(request.headers.get('If-None-Match', '')):
+            response = Response(status=status.HTTP_304_NOT_MODIFIED)
+        else:
+            response = Response(data)
+        response['ETag'] = etag
+        return response
+
+    @action(detail=True, methods=['get'],
+            pagination_class=ApplicantCursorPagination)
+    def applicants(self, request, pk=None):
+        """Полный список пользователей, которые ввели инвайт-код
+        пользователя, - постранично."""
+        user = self.get_object()
+        # inviter_id нужен менеджеру связи, иначе при выборке
+        # он догружается отдельным запросом для каждой строки.
+        queryset = user.applicants.only('phone', 'inviter_id')
+        page = self.paginate_queryset(queryset)
+        serializer = UserBriefSerializer(page, many=True)
+        return self.get_paginated_response(serializer.data)
+
+    def get_tree_level(self, name, default):
+        """Уровень дерева приглашений из параметра запроса name или
+        None, если он вне диапазона от 1 до REFERRAL_TREE_MAX_DEPTH."""
+        try:
+            level = int(self.request.query_params.get(name, default))
+        except ValueError:
+            return None
+        if 1 <= level <= settings.REFERRAL_TREE_MAX_DEPTH:
+            return level
+        return None
+
+    def tree_level_error(self, name):
+        return Response(
+            {name: ('Уровень должен быть от 1 до '
+                    f'{settings.REFERRAL_TREE_MAX_DEPTH}')},
+            status=status.HTTP_400_BAD_REQUEST)
+
+    @action(detail=True, methods=['get'], url_path='referral-tree',
+            permission_classes=(IsOwnerOrAdmin,))
+    def referral_tree(self, request, pk=None):
+        """Размер дерева приглашенных пользователя: количество
+        приглашенных на каждом уровне до depth (по умолчанию
+        и не больше REFERRAL_TREE_MAX_DEPTH). Доступно самому
+        пользователю и персоналу."""
+        user = self.get_object()
+        depth = self.get_tree_level('depth',
+                                    settings.REFERRAL_TREE_MAX_DEPTH)
+        if depth is None:
+            return self.tree_level_error('depth')
+        levels = referral_level_counts(user.id, depth)
+        return Response({
+            'depth': len(levels),
+            'size': sum(count for _, count in levels),
+            'levels': [{'level': level, 'count': count}
+                       for level, count in levels],
+        })
+
+    @action(detail=True, methods=['get'],
+            url_path='referral-tree/members',
+            permission_classes=(IsOwnerOrAdmin,),
+            pagination_class=ApplicantCursorPagination)
+    def referral_tree_members(self, request, pk=None):
+        """Приглашенные пользователя на уровне level (по умолчанию 1)
+        дерева приглашений - постранично. Доступно самому пользователю
+        и персоналу."""
+        user = self.get_object()
+        level = self.get_tree_level('level', 1)
+        if level is None:
+            return self.tree_level_error('level')
+        queryset = referral_level_members(user.id, level).only('phone')
+        page = self.paginate_queryset(queryset)
+        serializer = UserBriefSerializer(page, many=True)
+        return self.get_paginated_response(serializer.data)
+
+    @action(detail=False, methods=['get'])
+    def export(self, request):
+        """Потоковая выгрузка всех пользователей в формате NDJSON."""
+        queryset = User.objects.order_by('id')
+        return StreamingHttpResponse(
+            iter_ndjson(
+                queryset,
+                UserSerializer.Meta.fields,
+                settings.EXPORT_CHUNK_SIZE,
+            ),
+            content_type='application/x-ndjson',
+        )
+
+
+class ReferralLeaderboardView(generics.ListAPIView):
+    """Класс для обработки эндпойнта рейтинга пользователей
+    по количеству приглашенных. Рейтинг читается по индексу
+    на счетчике applicants_count, без агрегации по таблице."""
+
+    serializer_class = LeaderboardSerializer
+    pagination_class = None
+
+    def get_queryset(self):
+        try:
+            limit = int(self.request.query_params.get(
+                'limit', settings.LEADERBOARD_SIZE))
+        except ValueError:
+            limit = settings.LEADERBOARD_SIZE
+        limit = min(max(limit, 1), settings.LEADERBOARD_MAX_SIZE)
+        return (User.objects
+                .filter(applicants_count__gt=0)
+                .order_by('-applicants_count', 'id')
+                .only(*LeaderboardSerializer.Meta.fields)[:limit])
+
+
+class ReferralExportView(APIView):
+    """Класс для обработки эндпойнта потоковой выгрузки реферального
+    графа для аналитики. Доступен только персоналу. Формат задается
+    параметром output: csv (по умолчанию) или columns."""
+
+    permission_classes = (permissions.IsAdminUser,)
+
+    def get(self, request):
+        export_format = request.query_params.get('output', 'csv')
+        if export_format not in EXPORT_FORMATS:
+            return Response(
+                {'output': f'Допустимые значения: {EXPORT_FORMATS}'},
+                status=status.HTTP_400_BAD_REQUEST)
+        content_type = ('text/csv' if export_format == 'csv'
+                        else 'application/x-ndjson')
+        return StreamingHttpResponse(
+            iter_edges(export_format, settings.EXPORT_CHUNK_SIZE),
+            content_type=content_type,
+        )
+
 
 class UserCreateView(APIView):
-    """Класс для обработки эндпойнта на создание пользователя."""
+    """Класс для обработки эндпойнта на создание пользователя.
+    Частота запросов ограничена по номеру телефона и по IP-адресу
+    до обращения к БД и отправки sms."""
+
+    throttle_classes = REGISTRATION_THROTTLES
 
     def post(self, request):
         serializer = UserCreateSerializer(data=request.data)
         if serializer.is_valid():
-            code = generate_sequense(4, digits_only=True)
-            deadline = dt.datetime.utcnow().timestamp() + settings.VERIF_TIME
-            serializer.save(verification_code=code,
-                            verif_cutoff_timestamp=deadline)
-            send_sms.delay(
-                phone=serializer.validated_data.get('phone'),
-                code=code,
-            )
+            serializer.save()
+            send_verification_code(serializer.validated_data['phone'])
             return Response(serializer.data, status=status.HTTP_201_CREATED)
         return Response(
             serializer.errors,
@@ -65,6 +228,20 @@ class CustomObtainAuthToken(ObtainAuthToken):
         serializer = self.get_serializer(data=request.data)
         serializer.is_valid(raise_exception=True)
         user = serializer.validated_data['user']
-        token, created = Token.objects.get_or_create(user=user)
+        token = get_user_token(user)
         user.create_invite_code()
         return Response({'token': token.key})
+
+
+def metrics(request):
+    """Метрики запросов в текстовом формате Prometheus. Отдаются
+    только с заголовком Authorization: Bearer <METRICS_TOKEN>. Если сбор
+    метрик выключен или METRICS_TOKEN не задан, эндпойнт отвечает 404."""
+    if not settings.REQUEST_METRICS_ENABLED or not settings.METRICS_TOKEN:
+        raise Http404
+    if not constant_time_compare(
+            request.headers.get('Authorization', ''),
+            f'Bearer {settings.METRICS_TOKEN}'):
+        return HttpResponse(status=status.HTTP_403_FORBIDDEN)
+    return HttpResponse(request_metrics.render(),
+                        content_type='text/plain; version=0.0.4')
@@ -0,0 +1,49 @@
+"""Бенчмарки приложения. Запускаются из папки с manage.py, например:
+python -m benchmarks.registration
+
+Каждый бенчмарк работает на временной тестовой БД, которая создается
+так же, как при запуске тестов, и удаляется после замера."""
+import contextlib
+import os
+import tempfile
+import time
+
+import django
+
+
+def setup_django():
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'referral_app.settings')
+    django.setup()
+
+
+@contextlib.contextmanager
+def benchmark_database(verbosity=0, threaded=False):
+    """Контекстный менеджер: создает тестовую БД с миграциями
+    и удаляет её на выходе. С threaded=True тестовая БД SQLite
+    создается в файле, а не в памяти, чтобы к ней могли подключаться
+    несколько потоков."""
+    from django.db import connection
+    from django.test.utils import (setup_test_environment,
+                                   teardown_test_environment)
+
+    old_name = connection.settings_dict['NAME']
+    if threaded and connection.vendor == 'sqlite':
+        connection.settings_dict['TEST']['NAME'] = os.path.join(
+            tempfile.gettempdir(), 'referral_app_benchmark.sqlite3')
+    setup_test_environment()
+    connection.creation.create_test_db(verbosity=verbosity, autoclobber=True)
+    try:
+        yield connection
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity=verbosity)
+        teardown_test_environment()
+
+
+def measure(func, count):
+    """Вызывает func(i) для i от 0 до count - 1 и возвращает
+    количество вызовов в секунду."""
+    started = time.perf_counter()
+    for idx in range(count):
+        func(idx)
+    elapsed = time.perf_counter() - started
+    return count / elapsed if elapsed else float('inf')
@@ -0,0 +1,115 @@
+"""Нагрузочный сценарий для сравнения синхронного и асинхронного
+профилей сервера: отправляет регистрации POST /api/auth/registration/
+с большим числом одновременных запросов и выводит пропускную
+способность и задержки. Приложение запускается дважды - с
+SERVER_PROFILE=wsgi и с SERVER_PROFILE=asgi, - и сценарий выполняется
+для каждого запуска:
+
+python -m benchmarks.concurrency --base-url http://127.0.0.1:8000 \\
+    --concurrency 1000 --requests 10000 --label asgi
+
+Все регистрации идут с одного IP-адреса, поэтому приложение нужно
+запускать с лимитом REGISTRATION_IP_RATE не меньше числа запросов
+(например, REGISTRATION_IP_RATE=100000/hour). Ответы 429 считаются
+отдельно от ошибок; если они есть, сценарий завершается с ошибкой:
+такие замеры показывают скорость ограничителя, а не регистрации.
+"""
+import argparse
+import asyncio
+import json
+import statistics
+import sys
+import time
+from urllib.parse import urlsplit
+
+FIRST_PHONE = 71000000000
+HTTP_TOO_MANY_REQUESTS = 429
+
+
+async def post_json(host, port, path, payload, timeout):
+    """Минимальный HTTP/1.1 POST на отдельном соединении. Возвращает
+    код ответа."""
+    body = json.dumps(payload).encode()
+    request = (
+        f'POST {path} HTTP/1.1\r\n'
+        f'Host: {host}:{port}\r\n'
+        'Content-Type: application/json\r\n'
+        f'Content-Length: {len(body)}\r\n'
+        'Connection: close\r\n\r\n'
+    ).encode() + body
+    reader, writer = await asyncio.wait_for(
+        asyncio.open_connection(host, port), timeout)
+    try:
+        writer.write(request)
+        await writer.drain()
+        status_line = await asyncio.wait_for(reader.readline(), timeout)
+        await asyncio.wait_for(reader.read(), timeout)
+    finally:
+        writer.close()
+    return int(status_line.split()[1])
+
+
+async def run(args):
+    url = urlsplit(args.base_url)
+    host, port = url.hostname, url.port or 80
+    semaphore = asyncio.Semaphore(args.concurrency)
+    latencies = []
+    errors = 0
+    throttled = 0
+
+    async def one(idx):
+        nonlocal errors, throttled
+        async with semaphore:
+            started = time.perf_counter()
+            try:
+                status = await post_json(
+                    host, port, '/api/auth/registration/',
+                    {'phone': args.first_phone + idx}, args.timeout)
+            except (OSError, asyncio.TimeoutError, IndexError, ValueError):
+                status = None
+            latencies.append((time.perf_counter() - started) * 1000)
+            if status == HTTP_TOO_MANY_REQUESTS:
+                throttled += 1
+            elif status != 201:
+                errors += 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*(one(idx) for idx in range(args.requests)))
+    elapsed = time.perf_counter() - started
+    latencies.sort()
+    return {
+        'label': args.label,
+        'requests': args.requests,
+        'concurrency': args.concurrency,
+        'errors': errors,
+        'throttled': throttled,
+        'rps': round(args.requests / elapsed, 1),
+        'p50_ms': round(statistics.median(latencies), 2),
+        'p99_ms': round(latencies[int(0.99 * (len(latencies) - 1))], 2),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+    )
+    parser.add_argument('--base-url', default='http://127.0.0.1:8000')
+    parser.add_argument('--requests', type=int, default=10000)
+    parser.add_argument('--concurrency', type=int, default=1000)
+    parser.add_argument('--timeout', type=float, default=30)
+    parser.add_argument('--first-phone', type=int, default=FIRST_PHONE,
+                        help='первый номер телефона для регистраций')
+    parser.add_argument('--label', default='',
+                        help='подпись прогона в результатах')
+    args = parser.parse_args()
+    report = asyncio.run(run(args))
+    print(json.dumps(report, ensure_ascii=False))
+    if report['throttled']:
+        sys.exit(f'{report["throttled"]} запросов отклонены ограничением '
+                 'частоты: запустите приложение с REGISTRATION_IP_RATE '
+                 f'не меньше {args.requests}/hour.')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,79 @@
+"""Быстрое заполнение БД пользователями для бенчмарков."""
+import random
+import string
+
+FIRST_PHONE = 71000000000
+CODE_SYMBOLS = string.digits + string.ascii_uppercase
+
+
+def invite_code_for(user_id):
+    """Уникальный инвайт-код пользователя - его id в 36-ричной записи.
+    Коды пользователей не пересекаются с кодами пула: пул в новой БД
+    пуст, а при пополнении пропускает коды, занятые пользователями."""
+    code = []
+    for _ in range(6):
+        user_id, rest = divmod(user_id, len(CODE_SYMBOLS))
+        code.append(CODE_SYMBOLS[rest])
+    return ''.join(reversed(code))
+
+
+def generate_inviters(count, invited_share, seed=0):
+    """Возвращает список пригласивших: inviters[i] - id пригласившего
+    пользователя с id i + 1 или None. Пригласивший выбирается
+    пропорционально числу уже приглашенных им плюс один
+    (preferential attachment), поэтому, как и в реальных реферальных
+    программах, большую часть приглашений делают немногие
+    пользователи."""
+    rng = random.Random(seed)
+    urn = []
+    inviters = []
+    for user_id in range(1, count + 1):
+        inviter_id = None
+        if urn and rng.random() < invited_share:
+            inviter_id = rng.choice(urn)
+            urn.append(inviter_id)
+        urn.append(user_id)
+        inviters.append(inviter_id)
+    return inviters
+
+
+def seed_users(count, invited_share=0.7, batch_size=10000, seed=0):
+    """Создает count пользователей с id от 1 до count пакетными INSERT.
+    У каждого есть инвайт-код, у приглашенных - полученный код,
+    пригласивший и правильный счетчик приглашенных. Возвращает список
+    пригласивших из generate_inviters."""
+    from django.contrib.auth import get_user_model
+    from django.core.management.color import no_style
+    from django.db import connection
+
+    User = get_user_model()
+    inviters = generate_inviters(count, invited_share, seed)
+    applicants_counts = [0] * (count + 1)
+    for inviter_id in inviters:
+        if inviter_id is not None:
+            applicants_counts[inviter_id] += 1
+
+    batch = []
+    for user_id, inviter_id in enumerate(inviters, start=1):
+        batch.append(User(
+            id=user_id,
+            phone=FIRST_PHONE + user_id,
+            password='!',
+            invite_code=invite_code_for(user_id),
+            granted_code=(invite_code_for(inviter_id)
+                          if inviter_id is not None else ''),
+            inviter_id=inviter_id,
+            applicants_count=applicants_counts[user_id],
+        ))
+        if len(batch) >= batch_size:
+            User.objects.bulk_create(batch)
+            batch = []
+    if batch:
+        User.objects.bulk_create(batch)
+
+    # id заданы явно, поэтому последовательность для новых
+    # пользователей нужно сдвинуть (в PostgreSQL).
+    with connection.cursor() as cursor:
+        for sql in connection.ops.sequence_reset_sql(no_style(), [User]):
+            cursor.execute(sql)
+    return inviters
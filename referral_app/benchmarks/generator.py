@@ -0,0 +1,49 @@
+"""Микро-бенчмарк генератора кодов: сравнивает прежнюю генерацию
+через random.sample по одному символу с пакетной генерацией
+из os.urandom."""
+import argparse
+import random
+import string
+import timeit
+
+from users.utils import generate_sequences, generate_sequense
+
+
+def legacy_generate_sequense(length, digits_only=False):
+    """Прежняя реализация generate_sequense - для сравнения."""
+    if digits_only:
+        symbols = string.digits
+    else:
+        symbols = string.ascii_letters + string.digits
+    result = [random.sample(symbols, 1)[0] for _ in range(length)]
+    return ''.join(result)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--count', type=int, default=10000,
+                        help='количество кодов в одном замере')
+    parser.add_argument('--length', type=int, default=6,
+                        help='длина кода')
+    parser.add_argument('--repeat', type=int, default=5,
+                        help='количество замеров, берется лучший')
+    args = parser.parse_args()
+
+    cases = [
+        ('random.sample по символу', lambda: [
+            legacy_generate_sequense(args.length)
+            for _ in range(args.count)]),
+        ('generate_sequense по коду', lambda: [
+            generate_sequense(args.length) for _ in range(args.count)]),
+        ('generate_sequences пакетом', lambda: generate_sequences(
+            args.count, args.length)),
+    ]
+    print(f'Кодов: {args.count}, длина: {args.length}')
+    for name, func in cases:
+        best = min(timeit.repeat(func, number=1, repeat=args.repeat))
+        print(f'{name:30} {best * 1000:8.2f} мс '
+              f'({args.count / best:,.0f} кодов/сек)')
+
+
+if __name__ == '__main__':
+    main()
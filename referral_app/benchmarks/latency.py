@@ -0,0 +1,80 @@
+"""Нагрузочный сценарий: измеряет задержку GET /api/users/{id}/
+у запущенного приложения. Чтобы сравнить работу с постоянными
+соединениями к БД и без них, приложение запускается дважды: с
+DB_CONN_MAX_AGE=0 и с DB_CONN_MAX_AGE=60 (или через PgBouncer),
+и сценарий выполняется для каждого запуска:
+
+python -m benchmarks.latency --base-url http://127.0.0.1:8000 --ids 1-100
+"""
+import argparse
+import json
+import statistics
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from itertools import cycle, islice
+
+
+def parse_ids(value):
+    if '-' in value:
+        first, last = value.split('-')
+        return list(range(int(first), int(last) + 1))
+    return [int(item) for item in value.split(',')]
+
+
+def percentile(values, share):
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, int(round(share * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def fetch(url, timeout):
+    started = time.perf_counter()
+    try:
+        with urllib.request.urlopen(url, timeout=timeout) as response:
+            response.read()
+            status = response.status
+    except urllib.error.HTTPError as error:
+        status = error.code
+    return time.perf_counter() - started, status
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+    )
+    parser.add_argument('--base-url', default='http://127.0.0.1:8000')
+    parser.add_argument('--ids', type=parse_ids, default=parse_ids('1-100'),
+                        help='id пользователей: "1-100" или "1,5,7"')
+    parser.add_argument('--requests', type=int, default=2000)
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--timeout', type=float, default=10)
+    parser.add_argument('--label', default='',
+                        help='подпись прогона в результатах')
+    args = parser.parse_args()
+
+    urls = [f'{args.base_url.rstrip("/")}/api/users/{user_id}/'
+            for user_id in islice(cycle(args.ids), args.requests)]
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+        results = list(executor.map(
+            lambda url: fetch(url, args.timeout), urls))
+    elapsed = time.perf_counter() - started
+
+    latencies = [latency * 1000 for latency, _ in results]
+    errors = sum(1 for _, status in results if status != 200)
+    print(json.dumps({
+        'label': args.label,
+        'requests': len(results),
+        'concurrency': args.concurrency,
+        'errors': errors,
+        'rps': round(len(results) / elapsed, 1),
+        'p50_ms': round(statistics.median(latencies), 2),
+        'p99_ms': round(percentile(latencies, 0.99), 2),
+    }, ensure_ascii=False))
+
+
+if __name__ == '__main__':
+    main()
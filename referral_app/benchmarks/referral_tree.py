@@ -0,0 +1,88 @@
+"""Бенчмарк дерева приглашенных: сравнивает подсчет приглашенных
+по уровням одним рекурсивным запросом (WITH RECURSIVE) с обходом
+дерева в Python - по запросу на каждый уровень. Дерево строится
+синтетически (benchmarks.fixtures.seed_users): каждый следующий
+пользователь с вероятностью --invited-share приглашен одним из ранее
+зарегистрированных."""
+import argparse
+import time
+
+from benchmarks import benchmark_database, setup_django
+from benchmarks.fixtures import seed_users
+
+# Ограничение на количество параметров в одном запросе у SQLite.
+IN_BATCH = 500
+
+
+def python_level_counts(User, user_id, max_depth):
+    """Обход дерева в Python: запрос на каждый уровень, уровень
+    разбивается на пачки по IN_BATCH идентификаторов."""
+    levels = []
+    frontier = [user_id]
+    for level in range(1, max_depth + 1):
+        children = []
+        for start in range(0, len(frontier), IN_BATCH):
+            children.extend(User.objects
+                            .filter(inviter_id__in=frontier[
+                                start:start + IN_BATCH])
+                            .values_list('id', flat=True))
+        if not children:
+            break
+        levels.append((level, len(children)))
+        frontier = children
+    return levels
+
+
+def timed(func):
+    started = time.perf_counter()
+    result = func()
+    return result, time.perf_counter() - started
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--users', type=int, default=1000000,
+                        help='количество пользователей в дереве')
+    parser.add_argument('--invited-share', type=float, default=0.7,
+                        help='доля пользователей, пришедших по приглашению')
+    parser.add_argument('--roots', default='1,10,100,1000',
+                        help='id пользователей, для которых строится дерево')
+    parser.add_argument('--batch-size', type=int, default=10000,
+                        help='размер пакета при заполнении БД')
+    args = parser.parse_args()
+
+    setup_django()
+    from django.conf import settings
+    from django.contrib.auth import get_user_model
+    from django.db import connection
+    from django.test.utils import CaptureQueriesContext
+
+    from users.referrals import referral_level_counts
+
+    User = get_user_model()
+    max_depth = settings.REFERRAL_TREE_MAX_DEPTH
+
+    with benchmark_database():
+        _, elapsed = timed(lambda: seed_users(
+            args.users, args.invited_share, args.batch_size))
+        print(f'Пользователей: {args.users}, дерево построено '
+              f'за {elapsed:.1f} сек')
+        for root in map(int, args.roots.split(',')):
+            with CaptureQueriesContext(connection) as cte_queries:
+                cte_levels, cte_time = timed(
+                    lambda: referral_level_counts(root, max_depth))
+            with CaptureQueriesContext(connection) as python_queries:
+                python_levels, python_time = timed(
+                    lambda: python_level_counts(User, root, max_depth))
+            assert cte_levels == python_levels
+            size = sum(count for _, count in cte_levels)
+            print(f'id={root}: уровней {len(cte_levels)}, '
+                  f'приглашенных {size}')
+            print(f'  WITH RECURSIVE: {cte_time * 1000:9.1f} мс, '
+                  f'запросов: {len(cte_queries)}')
+            print(f'  обход в Python: {python_time * 1000:9.1f} мс, '
+                  f'запросов: {len(python_queries)}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,45 @@
+"""Бенчмарк регистрации по номеру телефона: сравнивает создание
+пользователя с хэшированием случайного пароля (как было раньше)
+и без пароля."""
+import argparse
+
+from benchmarks import benchmark_database, measure, setup_django
+
+FIRST_PHONE = 71000000000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--count', type=int, default=200,
+                        help='количество регистраций в каждом режиме')
+    args = parser.parse_args()
+
+    setup_django()
+    from django.contrib.auth import get_user_model
+
+    from users.utils import generate_sequense
+
+    User = get_user_model()
+
+    with benchmark_database():
+        hashed = measure(
+            lambda idx: User.objects.create_user(
+                phone=FIRST_PHONE + idx,
+                password=generate_sequense(60),
+            ),
+            args.count,
+        )
+        passwordless = measure(
+            lambda idx: User.objects.create_user(
+                phone=FIRST_PHONE + args.count + idx,
+            ),
+            args.count,
+        )
+
+    print(f'Регистраций: {args.count} в каждом режиме')
+    print(f'С хэшированием пароля: {hashed:.1f} рег./сек')
+    print(f'Без пароля:            {passwordless:.1f} рег./сек')
+
+
+if __name__ == '__main__':
+    main()
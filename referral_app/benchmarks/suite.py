@@ -0,0 +1,292 @@
+"""Набор бенчмарков API. Заполняет тестовую БД пользователями
+с реалистичным распределением приглашений (benchmarks.fixtures),
+затем выполняет запросы к каждому эндпойнту с фиксированным числом
+одновременных потоков и выводит пропускную способность, задержки
+(p50/p90/p99) и количество запросов к БД на один запрос к API.
+Запросы выполняются внутри процесса через тестовый клиент, без
+HTTP-сервера, поэтому замеряется только код приложения и БД.
+
+Работает с SQLite и с PostgreSQL (настройки БД берутся из переменных
+окружения, как у приложения). Результаты сохраняются в JSON
+в benchmarks/results/<метка>.json, меткой по умолчанию служит
+текущий коммит. Сравнение с прошлым прогоном:
+
+python -m benchmarks.suite --users 10000 --compare \\
+    benchmarks/results/<метка>.json
+"""
+import argparse
+import itertools
+import json
+import os
+import random
+import statistics
+import subprocess
+import threading
+import time
+from collections import Counter, namedtuple
+from datetime import datetime, timezone
+from unittest import mock
+
+from benchmarks import benchmark_database, setup_django
+from benchmarks.fixtures import FIRST_PHONE, invite_code_for, seed_users
+from benchmarks.latency import percentile
+
+RESULTS_DIR = os.path.join(os.path.dirname(__file__), 'results')
+
+# Запрос к API: метод, адрес, данные, пользователь для авторизации
+# и ожидаемый код ответа.
+Call = namedtuple('Call', 'method url data user status')
+
+
+def registration_calls(count, users, inviters, rng):
+    from django.urls import reverse
+
+    return [Call('post', reverse('api-register'),
+                 {'phone': FIRST_PHONE + users + idx + 1}, None, 201)
+            for idx in range(count)]
+
+
+def verification_calls(count, users, inviters, rng):
+    from django.urls import reverse
+
+    from users.verification import get_code_store
+
+    calls = []
+    for user_id in rng.sample(range(1, users + 1), min(count, users)):
+        phone = FIRST_PHONE + user_id
+        code = get_code_store().issue(phone)
+        calls.append(Call('post', reverse('api-verification'),
+                          {'phone': phone, 'verification_code': code},
+                          None, 200))
+    return calls
+
+
+def apply_invite_code_calls(count, users, inviters, rng):
+    """Ввод инвайт-кода случайного пользователя теми, кто пришел
+    без приглашения."""
+    from django.contrib.auth import get_user_model
+    from django.urls import reverse
+
+    User = get_user_model()
+    not_invited = [user_id for user_id, inviter_id
+                   in enumerate(inviters, start=1) if inviter_id is None]
+    chosen = rng.sample(not_invited, min(count, len(not_invited)))
+    instances = User.objects.in_bulk(chosen)
+    calls = []
+    for user_id in chosen:
+        code_owner = rng.randint(1, users)
+        if code_owner == user_id:
+            code_owner = user_id % users + 1
+        calls.append(Call('patch',
+                          reverse('api-user-detail', args=[user_id]),
+                          {'granted_code': invite_code_for(code_owner)},
+                          instances[user_id], 200))
+    return calls
+
+
+def read_calls(url_name, user_picker=None, as_owner=False):
+    """Сценарий чтения: GET url_name. Для детальных эндпойнтов id
+    пользователя выбирает функция, которую возвращает
+    user_picker(users, inviters, rng). С as_owner запрос выполняет
+    сам выбранный пользователь."""
+    def build(count, users, inviters, rng):
+        from django.contrib.auth import get_user_model
+        from django.urls import reverse
+
+        pick_user = user_picker and user_picker(users, inviters, rng)
+        ids = [None if pick_user is None else pick_user()
+               for _ in range(count)]
+        owners = (get_user_model().objects.in_bulk(set(ids))
+                  if as_owner else {})
+        return [
+            Call('get',
+                 reverse(url_name, args=[] if user_id is None
+                         else [user_id]),
+                 None, owners.get(user_id), 200)
+            for user_id in ids
+        ]
+    return build
+
+
+def random_user(users, inviters, rng):
+    return lambda: rng.randint(1, users)
+
+
+def popular_inviter(users, inviters, rng):
+    """Один из 100 пользователей с наибольшим числом приглашенных."""
+    counts = Counter(filter(None, inviters))
+    popular = [user_id for user_id, _ in counts.most_common(100)]
+    return lambda: rng.choice(popular)
+
+
+SCENARIOS = {
+    'registration': registration_calls,
+    'verification': verification_calls,
+    'apply_invite_code': apply_invite_code_calls,
+    'retrieve': read_calls('api-user-detail', random_user),
+    'list': read_calls('api-user-list'),
+    'applicants': read_calls('api-user-applicants', popular_inviter),
+    'referral_tree': read_calls('api-user-referral-tree', random_user,
+                                as_owner=True),
+    'leaderboard': read_calls('api-referral-leaderboard'),
+}
+
+
+def run_calls(calls, concurrency):
+    """Выполняет запросы в concurrency потоках. Возвращает время
+    выполнения всех запросов и для каждого запроса - задержку,
+    количество запросов к БД и признак ожидаемого ответа."""
+    from django.db import connection, connections
+    from django.test.utils import CaptureQueriesContext
+    from rest_framework.test import APIClient
+
+    results = [None] * len(calls)
+    indexes = itertools.count()
+
+    def worker():
+        client = APIClient()
+        try:
+            for idx in iter(lambda: next(indexes), None):
+                if idx >= len(calls):
+                    return
+                call = calls[idx]
+                client.force_authenticate(user=call.user)
+                with CaptureQueriesContext(connection) as queries:
+                    started = time.perf_counter()
+                    response = getattr(client, call.method)(
+                        call.url, data=call.data, format='json')
+                    latency = time.perf_counter() - started
+                results[idx] = (latency, len(queries),
+                                response.status_code == call.status)
+        finally:
+            # Соединения потоков закрываются, иначе тестовую БД
+            # PostgreSQL не удастся удалить.
+            connections.close_all()
+
+    threads = [threading.Thread(target=worker) for _ in range(concurrency)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return time.perf_counter() - started, results
+
+
+def summarize(elapsed, results):
+    latencies = [latency * 1000 for latency, _, _ in results]
+    queries = [count for _, count, _ in results]
+    return {
+        'requests': len(results),
+        'errors': sum(1 for _, _, ok in results if not ok),
+        'rps': round(len(results) / elapsed, 1),
+        'p50_ms': round(statistics.median(latencies), 2),
+        'p90_ms': round(percentile(latencies, 0.9), 2),
+        'p99_ms': round(percentile(latencies, 0.99), 2),
+        'queries_avg': round(statistics.mean(queries), 2),
+        'queries_max': max(queries),
+    }
+
+
+def current_commit():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'],
+            capture_output=True, text=True, check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def print_report(report, previous=None):
+    previous_scenarios = (previous or {}).get('scenarios', {})
+    print(f"{'сценарий':18} {'rps':>9} {'p50 мс':>8} {'p90 мс':>8} "
+          f"{'p99 мс':>8} {'запросов к БД':>14} {'ошибок':>7}")
+    for name, result in report['scenarios'].items():
+        line = (f"{name:18} {result['rps']:9.1f} {result['p50_ms']:8.2f} "
+                f"{result['p90_ms']:8.2f} {result['p99_ms']:8.2f} "
+                f"{result['queries_avg']:14.2f} {result['errors']:7}")
+        before = previous_scenarios.get(name)
+        if before:
+            rps_change = result['rps'] / before['rps'] - 1
+            queries_change = result['queries_avg'] - before['queries_avg']
+            line += (f'   rps {rps_change:+.0%}, '
+                     f'запросов к БД {queries_change:+.2f}')
+        print(line)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+    )
+    parser.add_argument('--users', type=int, default=10000,
+                        help='количество пользователей в БД')
+    parser.add_argument('--invited-share', type=float, default=0.7,
+                        help='доля пользователей, пришедших по приглашению')
+    parser.add_argument('--requests', type=int, default=500,
+                        help='количество запросов в каждом сценарии')
+    parser.add_argument('--concurrency', type=int, default=8,
+                        help='количество одновременных потоков')
+    parser.add_argument('--scenarios', default=','.join(SCENARIOS),
+                        help='сценарии через запятую: '
+                             + ', '.join(SCENARIOS))
+    parser.add_argument('--label', default=None,
+                        help='метка прогона, по умолчанию - текущий коммит')
+    parser.add_argument('--compare', default=None,
+                        help='JSON прошлого прогона для сравнения')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    setup_django()
+    from django.core.cache import cache
+    from django.db import connection
+    from rest_framework.throttling import SimpleRateThrottle
+
+    commit = current_commit()
+    report = {
+        'label': args.label or commit or 'local',
+        'commit': commit,
+        'created': datetime.now(timezone.utc).isoformat(),
+        'users': args.users,
+        'concurrency': args.concurrency,
+        'scenarios': {},
+    }
+    rng = random.Random(args.seed)
+    # Ограничения частоты запросов и отправка sms не замеряются:
+    # иначе сценарий регистрации упрется в лимит с одного адреса
+    # и будет зависеть от брокера сообщений.
+    no_throttling = mock.patch.dict(
+        SimpleRateThrottle.THROTTLE_RATES,
+        {scope: None for scope in SimpleRateThrottle.THROTTLE_RATES})
+    with benchmark_database(threaded=True), no_throttling, \
+            mock.patch('api.utils.get_sms_batcher'):
+        report['database'] = connection.vendor
+        started = time.perf_counter()
+        inviters = seed_users(args.users, args.invited_share,
+                              seed=args.seed)
+        report['seed_seconds'] = round(time.perf_counter() - started, 2)
+        print(f"БД: {connection.vendor}, пользователей: {args.users}, "
+              f"заполнение: {report['seed_seconds']} сек")
+        for scenario in args.scenarios.split(','):
+            cache.clear()
+            # Запросы готовятся заранее, чтобы подготовка данных
+            # не попадала в замер.
+            calls = SCENARIOS[scenario](args.requests, args.users,
+                                        inviters, rng)
+            report['scenarios'][scenario] = summarize(
+                *run_calls(calls, args.concurrency))
+
+    previous = None
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as file:
+            previous = json.load(file)
+    print_report(report, previous)
+    os.makedirs(RESULTS_DIR, exist_ok=True)
+    path = os.path.join(RESULTS_DIR, f"{report['label']}.json")
+    with open(path, 'w', encoding='utf-8') as file:
+        json.dump(report, file, ensure_ascii=False, indent=2)
+    print(f'Результаты сохранены в {path}')
+
+
+if __name__ == '__main__':
+    main()
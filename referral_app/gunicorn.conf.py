@@ -0,0 +1,14 @@
+"""Настройки gunicorn. Профиль сервера задается переменной
+SERVER_PROFILE: wsgi (по умолчанию) - синхронные воркеры, asgi -
+воркеры uvicorn с асинхронными эндпойнтами регистрации
+и верификации."""
+import os
+
+bind = os.getenv('GUNICORN_BIND', '0.0.0.0:8000')
+workers = int(os.getenv('GUNICORN_WORKERS', 2))
+
+if os.getenv('SERVER_PROFILE', 'wsgi') == 'asgi':
+    wsgi_app = 'referral_app.asgi:application'
+    worker_class = 'uvicorn.workers.UvicornWorker'
+else:
+    wsgi_app = 'referral_app.wsgi:application'
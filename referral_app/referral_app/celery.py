@@ -8,3 +8,9 @@ os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'referral_app.settings')
 app = Celery('referral_app',
              broker=CELERY_BROKER_URL,
              include=['users.tasks'])
+app.conf.beat_schedule = {
+    'refill-invite-code-pool': {
+        'task': 'users.tasks.refill_invite_code_pool',
+        'schedule': 60.0,
+    },
+}
@@ -9,6 +9,10 @@ BASE_DIR = Path(__file__).resolve().parent.parent
 SECRET_KEY = os.getenv('SECRET_KEY', default='django-insecure-$6x0yx)qwu5&j')
 DEBUG = False
 ALLOWED_HOSTS = ['*']
+# wsgi - синхронные воркеры gunicorn, asgi - воркеры uvicorn
+# и асинхронные эндпойнты регистрации и верификации.
+SERVER_PROFILE = os.getenv('SERVER_PROFILE', default='wsgi')
+ASYNC_AUTH_VIEWS = SERVER_PROFILE == 'asgi'
 
 INSTALLED_APPS = [
     'django.contrib.admin',
@@ -25,6 +29,8 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'api.middleware.RequestMetricsMiddleware',
+    'api.middleware.ReplicaReadMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -36,6 +42,19 @@ MIDDLEWARE = [
 
 ROOT_URLCONF = 'referral_app.urls'
 
+# Метрики запросов по представлениям (api.middleware) и эндпойнт
+# /metrics в формате Prometheus.
+REQUEST_METRICS_ENABLED = (
+    os.getenv('REQUEST_METRICS_ENABLED', default='False') == 'True'
+)
+REQUEST_METRICS_SAMPLE_RATE = float(
+    os.getenv('REQUEST_METRICS_SAMPLE_RATE', default=0.1)
+)
+SLOW_REQUEST_THRESHOLD = float(
+    os.getenv('SLOW_REQUEST_THRESHOLD', default=1.0)
+)
+METRICS_TOKEN = os.getenv('METRICS_TOKEN', default='')
+
 TEMPLATES = [
     {
         'BACKEND': 'django.template.backends.django.DjangoTemplates',
@@ -64,7 +83,67 @@ DATABASES = {
         'USER': os.getenv('POSTGRES_USER', default='postgres'),
         'PASSWORD': os.getenv('POSTGRES_PASSWORD', default='postgres'),
         'HOST': os.getenv('DB_HOST', default='db'),
-        'PORT': os.getenv('DB_PORT', default='5432')
+        'PORT': os.getenv('DB_PORT', default='5432'),
+        # Постоянные соединения: соединение открывается один раз на
+        # воркер и переиспользуется между запросами. В асинхронном
+        # режиме Django не переиспользует соединения между запросами,
+        # поэтому там по умолчанию они закрываются сразу.
+        'CONN_MAX_AGE': int(os.getenv(
+            'DB_CONN_MAX_AGE',
+            default=0 if SERVER_PROFILE == 'asgi' else 60
+        )),
+        'CONN_HEALTH_CHECKS': (
+            os.getenv('DB_CONN_HEALTH_CHECKS', default='True') == 'True'
+        ),
+        # При подключении через PgBouncer в режиме пулинга транзакций
+        # серверные курсоры недоступны.
+        'DISABLE_SERVER_SIDE_CURSORS': (
+            os.getenv('DB_PGBOUNCER', default='False') == 'True'
+        ),
+    }
+}
+
+# Реплики для чтения: адреса серверов через запятую. Реплика
+# подключается с теми же параметрами, что и основная БД, в тестах
+# вместо нее используется основная БД.
+DB_REPLICA_HOSTS = [host for host in os.getenv('DB_REPLICA_HOSTS',
+                                               default='').split(',')
+                    if host]
+for number, host in enumerate(DB_REPLICA_HOSTS, start=1):
+    DATABASES[f'replica_{number}'] = {
+        **DATABASES['default'],
+        'HOST': host,
+        'TEST': {'MIRROR': 'default'},
+    }
+# Алиас основной БД -> алиасы ее реплик. Чтение в GET-запросах к API
+# идет с реплик (api.middleware.ReplicaReadMiddleware), кроме
+# REPLICA_STICKY_TIME секунд после изменяющего запроса клиента.
+DATABASE_REPLICAS = {
+    'default': [f'replica_{number}'
+                for number in range(1, len(DB_REPLICA_HOSTS) + 1)],
+}
+REPLICA_STICKY_TIME = int(os.getenv('REPLICA_STICKY_TIME', default=5))
+REPLICA_STICKY_COOKIE = 'primary_until'
+
+# Распределение таблицы пользователей по БД: диапазоны номеров
+# (первый, последний, алиас из DATABASES). Запросы с известным номером
+# направляет users.routers.PhoneShardRouter. Пока все диапазоны должны
+# ссылаться на default (проверка users.E003).
+USER_SHARDS = [
+    (71000000000, 79999999999, 'default'),
+]
+DATABASE_ROUTERS = [
+    'users.routers.PhoneShardRouter',
+    'users.routers.ReplicaRouter',
+]
+
+CACHES = {
+    'default': {
+        'BACKEND': os.getenv(
+            'CACHE_BACKEND',
+            default='django.core.cache.backends.locmem.LocMemCache'
+        ),
+        'LOCATION': os.getenv('CACHE_LOCATION', default=''),
     }
 }
 
@@ -99,9 +178,23 @@ STATIC_ROOT = BASE_DIR / 'static'
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': [
-        'rest_framework.authentication.TokenAuthentication',
+        'api.authentication.CachedTokenAuthentication',
     ],
+    'DEFAULT_THROTTLE_RATES': {
+        'registration_phone': os.getenv('REGISTRATION_PHONE_RATE',
+                                        default='5/hour'),
+        'registration_ip': os.getenv('REGISTRATION_IP_RATE',
+                                     default='100/hour'),
+    },
+    # IP клиента берется из X-Forwarded-For, который дописывает nginx.
+    # Адреса левее добавлены самим клиентом и не учитываются.
+    'NUM_PROXIES': int(os.getenv('NUM_PROXIES', default=1)),
 }
+TOKEN_CACHE_SIZE = int(os.getenv('TOKEN_CACHE_SIZE', default=10000))
+TOKEN_CACHE_TTL = int(os.getenv('TOKEN_CACHE_TTL', default=60))
+TOKEN_CACHE_ALIAS = os.getenv('TOKEN_CACHE_ALIAS', default=None)
+USER_DETAIL_CACHE_ALIAS = 'default'
+USER_DETAIL_CACHE_TTL = int(os.getenv('USER_DETAIL_CACHE_TTL', default=300))
 
 CORS_ORIGIN_ALLOW_ALL = True
 CORS_URLS_REGEX = r'^/api/.*$'
@@ -110,6 +203,24 @@ CSRF_TRUSTED_ORIGINS = os.getenv(
     default='http://127.0.0.1:8000'
 ).split(',')
 VERIF_TIME = 3 * 60
+VERIF_MAX_ATTEMPTS = 5
+VERIF_LOCKOUT_TIME = int(os.getenv('VERIF_LOCKOUT_TIME', default=60 * 60))
+VERIFICATION_CODE_STORE = os.getenv(
+    'VERIFICATION_CODE_STORE',
+    default='users.verification.CacheCodeStore'
+)
+VERIFICATION_CODE_CACHE = 'default'
+SMS_PROVIDER = os.getenv('SMS_PROVIDER', default='users.sms.LogSmsProvider')
+SMS_BATCH_SIZE = int(os.getenv('SMS_BATCH_SIZE', default=100))
+SMS_BATCH_WINDOW = float(os.getenv('SMS_BATCH_WINDOW', default=0.5))
+EXPORT_CHUNK_SIZE = 2000
+CODE_APPLICANTS_LIMIT = 100
+LEADERBOARD_SIZE = 10
+LEADERBOARD_MAX_SIZE = 100
+REFERRAL_TREE_MAX_DEPTH = 10
+INVITE_CODE_POOL_SIZE = 10000
+INVITE_CODE_POOL_BATCH = 1000
+INVITE_CODE_REFILL_ATTEMPTS = 3
 
 RABBITMQ = {
     'PROTOCOL': 'amqp',
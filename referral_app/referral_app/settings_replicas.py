@@ -0,0 +1,18 @@
+"""Настройки для проверки чтения с реплик: основная БД и реплика -
+две отдельные БД SQLite, репликации между ними нет, поэтому тесты
+сами решают, какие данные видны на реплике. Чтение с реплики
+включают только тесты реплик (DATABASE_REPLICAS), остальные тесты
+работают с основной БД.
+
+python manage.py test --settings=referral_app.settings_replicas
+"""
+from .settings import *  # noqa: F401,F403
+from .settings import BASE_DIR
+
+DATABASES = {
+    alias: {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': BASE_DIR / f'{alias}.sqlite3',
+    }
+    for alias in ('default', 'replica_1')
+}
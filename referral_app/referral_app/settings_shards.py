@@ -0,0 +1,17 @@
+"""Настройки для проверки распределения пользователей по нескольким БД:
+вместо шардов используются отдельные БД SQLite.
+
+python manage.py test --settings=referral_app.settings_shards
+"""
+from .settings import *  # noqa: F401,F403
+from .settings import BASE_DIR
+
+USER_SHARD_ALIASES = ('default', 'users_shard_1')
+
+DATABASES = {
+    alias: {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': BASE_DIR / f'{alias}.sqlite3',
+    }
+    for alias in USER_SHARD_ALIASES
+}
@@ -1,10 +1,116 @@
-from django.contrib import admin
+from django.contrib import admin, messages
+from django.contrib.admin.options import IncorrectLookupParameters
 from django.contrib.auth import get_user_model
 from django.contrib.auth.admin import Group, UserAdmin
+from django.core.paginator import Paginator
+from django.db import connections
+from django.utils.functional import cached_property
 from django.utils.translation import gettext_lazy as _
 
+from .signals import users_bulk_updated
+
 User = get_user_model()
 
+PHONE_LENGTH = 11
+# Ниже этого числа строк оценка из статистики PostgreSQL неточна,
+# и дешевле посчитать строки точно.
+ESTIMATED_COUNT_THRESHOLD = 10000
+
+
+def phone_range(prefix):
+    """Диапазон номеров телефонов с заданным префиксом. Фильтр
+    по диапазону использует индекс на phone."""
+    return (int(prefix.ljust(PHONE_LENGTH, '0')),
+            int(prefix.ljust(PHONE_LENGTH, '9')))
+
+
+class PhonePrefixFilter(admin.SimpleListFilter):
+    """Фильтр по началу номера телефона. В списке - коды 790-799,
+    в адресе можно указать любой префикс: ?phone_prefix=7999888."""
+
+    title = 'префиксу телефона'
+    parameter_name = 'phone_prefix'
+
+    def lookups(self, request, model_admin):
+        return [(f'79{digit}', f'+7 9{digit}x') for digit in range(10)]
+
+    def queryset(self, request, queryset):
+        prefix = self.value()
+        if not prefix:
+            return queryset
+        if not prefix.isdigit() or len(prefix) > PHONE_LENGTH:
+            raise IncorrectLookupParameters(prefix)
+        return queryset.filter(phone__range=phone_range(prefix))
+
+
+class PhoneRangeFilter(admin.ListFilter):
+    """Фильтр по диапазону номеров телефонов: ?phone_from=&phone_to=."""
+
+    title = 'диапазону телефонов'
+    parameters = ('phone_from', 'phone_to')
+    template = 'admin/users/phone_range_filter.html'
+
+    def __init__(self, request, params, model, model_admin):
+        super().__init__(request, params, model, model_admin)
+        self.values = {}
+        for parameter in self.parameters:
+            if parameter in params:
+                value = params.pop(parameter)
+                if isinstance(value, list):
+                    value = value[-1]
+                self.values[parameter] = value
+                self.used_parameters[parameter] = value
+
+    def has_output(self):
+        return True
+
+    def expected_parameters(self):
+        return list(self.parameters)
+
+    def queryset(self, request, queryset):
+        lookups = {'phone_from': 'phone__gte', 'phone_to': 'phone__lte'}
+        try:
+            return queryset.filter(**{
+                lookups[parameter]: int(value)
+                for parameter, value in self.values.items() if value
+            })
+        except ValueError as error:
+            raise IncorrectLookupParameters(error)
+
+    def choices(self, changelist):
+        yield {
+            'phone_from': self.values.get('phone_from', ''),
+            'phone_to': self.values.get('phone_to', ''),
+            'other_params': [
+                (name, value)
+                for name, value in changelist.get_filters_params().items()
+                if name not in self.parameters
+            ],
+            'reset_query_string': changelist.get_query_string(
+                remove=self.parameters),
+        }
+
+
+class EstimatedCountPaginator(Paginator):
+    """Пагинатор, который для списка без фильтров берет количество
+    строк из статистики PostgreSQL (pg_class.reltuples) вместо
+    COUNT(*) по всей таблице."""
+
+    @cached_property
+    def count(self):
+        queryset = self.object_list
+        connection = connections[queryset.db]
+        if not queryset.query.where and connection.vendor == 'postgresql':
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    'SELECT reltuples FROM pg_class WHERE relname = %s',
+                    [queryset.model._meta.db_table],
+                )
+                row = cursor.fetchone()
+            if row and row[0] >= ESTIMATED_COUNT_THRESHOLD:
+                return int(row[0])
+        return super().count
+
 
 class MyUserAdmin(UserAdmin):
     '''Класс для вывода на странице админа
@@ -20,8 +126,7 @@ class MyUserAdmin(UserAdmin):
                     'email',
                     'invite_code',
                     'granted_code',
-                    'verification_code',
-                    'verif_cutoff_timestamp',
+                    'inviter',
                 )
             }
         ),
@@ -58,13 +163,50 @@ class MyUserAdmin(UserAdmin):
         'last_name',
         'invite_code',
         'granted_code',
-        'verification_code',
-        'verif_cutoff_timestamp',
         'is_staff',
     )
-    list_filter = ('phone',)
+    list_filter = (PhonePrefixFilter, PhoneRangeFilter,
+                   'is_active', 'is_staff')
+    raw_id_fields = ('inviter',)
     ordering = ('id',)
-    search_fields = ('phone', 'first_name', 'last_name', 'invite_code')
+    # Поиск - только точное совпадение по индексированным полям,
+    # см. get_search_results.
+    search_fields = ('phone', 'invite_code')
+    search_help_text = 'Точный номер телефона или инвайт-код.'
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+    actions = ('activate_users', 'deactivate_users')
+
+    def get_search_results(self, request, queryset, search_term):
+        search_term = search_term.strip()
+        if not search_term:
+            return queryset, False
+        if search_term.isdigit() and len(search_term) == PHONE_LENGTH:
+            return queryset.filter(phone=int(search_term)), False
+        return queryset.filter(invite_code=search_term), False
+
+    def set_active(self, queryset, is_active):
+        # Изменение одним UPDATE, без загрузки и сохранения каждого
+        # пользователя. post_save при этом не отправляется, поэтому
+        # кэши сбрасываются по сигналу users_bulk_updated.
+        user_ids = list(queryset.values_list('id', flat=True))
+        updated = queryset.update(is_active=is_active)
+        users_bulk_updated.send(sender=User, user_ids=user_ids,
+                                fields=('is_active',), using=queryset.db)
+        return updated
+
+    @admin.action(description='Активировать выбранных пользователей')
+    def activate_users(self, request, queryset):
+        updated = self.set_active(queryset, True)
+        self.message_user(request, f'Активировано пользователей: {updated}',
+                          messages.SUCCESS)
+
+    @admin.action(description='Деактивировать выбранных пользователей')
+    def deactivate_users(self, request, queryset):
+        updated = self.set_active(queryset, False)
+        self.message_user(request,
+                          f'Деактивировано пользователей: {updated}',
+                          messages.SUCCESS)
 
 
 admin.site.register(User, MyUserAdmin)
@@ -0,0 +1,67 @@
+from django.conf import settings
+from django.core.checks import Error, Tags, register
+from django.core.exceptions import ImproperlyConfigured
+from django.db import DEFAULT_DB_ALIAS
+from django.utils.module_loading import import_string
+
+from .sharding import get_user_shards
+from .verification import CacheCodeStore, InMemoryCodeStore
+
+# Бэкенды кэша, которые хранят данные в памяти одного процесса.
+PROCESS_LOCAL_CACHES = (
+    'django.core.cache.backends.locmem.LocMemCache',
+    'django.core.cache.backends.dummy.DummyCache',
+)
+
+
+@register(Tags.caches, deploy=True)
+def check_code_store_is_shared(app_configs, **kwargs):
+    """Коды верификации должны храниться в общем для всех воркеров
+    хранилище: иначе код, выданный одним воркером, не пройдет проверку
+    в другом."""
+    store = import_string(settings.VERIFICATION_CODE_STORE)
+    if issubclass(store, InMemoryCodeStore):
+        local = True
+    elif issubclass(store, CacheCodeStore):
+        backend = settings.CACHES[settings.VERIFICATION_CODE_CACHE][
+            'BACKEND']
+        local = backend in PROCESS_LOCAL_CACHES
+    else:
+        local = False
+    if not local:
+        return []
+    return [Error(
+        'Коды верификации хранятся в памяти процесса: при нескольких '
+        'воркерах код, выданный одним воркером, не пройдет проверку '
+        'в другом.',
+        hint='Укажите общий кэш (CACHE_BACKEND=django.core.cache.'
+             'backends.redis.RedisCache и CACHE_LOCATION) или другое '
+             'хранилище в VERIFICATION_CODE_STORE.',
+        id='users.E001',
+    )]
+
+
+@register()
+def check_user_shards(app_configs, **kwargs):
+    """Пользователи пока должны храниться в БД default. Роутер
+    направляет в другие БД запросы с известным номером, но id
+    пользователей уникальны только в пределах одной БД, а поиск по id
+    и инвайт-коду, связь inviter, импорт, пересчет счетчиков и кэш
+    данных пользователя работают только с БД default."""
+    try:
+        aliases = {alias for _, _, alias in get_user_shards()}
+    except ImproperlyConfigured as exc:
+        return [Error(str(exc), id='users.E002')]
+    if aliases <= {DEFAULT_DB_ALIAS}:
+        return []
+    return [Error(
+        'USER_SHARDS размещает пользователей вне БД default '
+        f'({", ".join(sorted(aliases - {DEFAULT_DB_ALIAS}))}), а поиск '
+        'по id и инвайт-коду, связь inviter, импорт, пересчет '
+        'счетчиков и кэш данных пользователя работают только с БД '
+        'default.',
+        hint='Оставьте в USER_SHARDS только БД default. Внутри одной БД '
+             'PostgreSQL таблицу можно секционировать по номерам '
+             '(users.partitioning.PartitionByPhoneRange).',
+        id='users.E003',
+    )]
@@ -0,0 +1,40 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from users.referrals import EXPORT_FORMATS, iter_edges
+
+
+class Command(BaseCommand):
+    help = ('Потоковая выгрузка реферального графа (пригласивший - '
+            'приглашенный) в CSV или поколоночными JSON-порциями.')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--output',
+            default='-',
+            help='Путь к файлу или "-" для вывода в stdout.',
+        )
+        parser.add_argument(
+            '--format',
+            choices=EXPORT_FORMATS,
+            default='csv',
+            help='Формат выгрузки.',
+        )
+        parser.add_argument(
+            '--chunk-size',
+            type=int,
+            default=settings.EXPORT_CHUNK_SIZE,
+            help='Количество ребер, читаемых из БД за раз.',
+        )
+
+    def handle(self, *args, **options):
+        if options['chunk_size'] < 1:
+            raise CommandError('Размер порции должен быть больше нуля.')
+        chunks = iter_edges(options['format'], options['chunk_size'])
+        if options['output'] == '-':
+            for chunk in chunks:
+                self.stdout.write(chunk, ending='')
+            return
+        with open(options['output'], 'w', encoding='utf-8',
+                  newline='') as output:
+            output.writelines(chunks)
@@ -0,0 +1,173 @@
+import csv
+import json
+import sys
+from itertools import zip_longest
+
+from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import UNUSABLE_PASSWORD_PREFIX
+from django.core.management.base import BaseCommand, CommandError
+
+from users.models import MAX_PHONE, MIN_PHONE, InviteCode
+from users.signals import users_bulk_updated
+from users.utils import generate_sequences
+
+User = get_user_model()
+
+IMPORT_FIELDS = ('first_name', 'last_name', 'email')
+
+
+class Command(BaseCommand):
+    help = ('Импорт пользователей из файла CSV или NDJSON. Файл читается '
+            'потоком, пользователи создаются пакетами через bulk INSERT, '
+            'поэтому расход памяти не зависит от размера файла. '
+            'Поля: phone (обязательно), first_name, last_name, email.')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'path',
+            help='Путь к файлу или "-" для чтения из stdin.',
+        )
+        parser.add_argument(
+            '--format',
+            choices=('csv', 'ndjson'),
+            help='Формат файла. По умолчанию определяется по расширению.',
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=5000,
+            help='Количество пользователей в одном INSERT.',
+        )
+        parser.add_argument(
+            '--on-conflict',
+            choices=('skip', 'update'),
+            default='skip',
+            help=('Что делать с уже зарегистрированными телефонами: '
+                  'пропустить или обновить имя, фамилию и email.'),
+        )
+        parser.add_argument(
+            '--assign-invite-codes',
+            action='store_true',
+            help='Сразу выдать новым пользователям инвайт-коды из пула.',
+        )
+
+    def handle(self, *args, **options):
+        file_format = options['format']
+        path = options['path']
+        if file_format is None:
+            file_format = 'ndjson' if path.endswith(
+                ('.ndjson', '.jsonl')) else 'csv'
+        if options['batch_size'] < 1:
+            raise CommandError('Размер пакета должен быть больше нуля.')
+
+        self.processed = self.invalid = self.created = 0
+        if path == '-':
+            self.import_rows(self.read_rows(sys.stdin, file_format), options)
+        else:
+            with open(path, encoding='utf-8', newline='') as source:
+                self.import_rows(self.read_rows(source, file_format),
+                                 options)
+        self.stdout.write(self.style.SUCCESS(
+            f'Обработано строк: {self.processed}, создано пользователей: '
+            f'{self.created}, пропущено некорректных строк: {self.invalid}'))
+
+    def read_rows(self, source, file_format):
+        if file_format == 'csv':
+            yield from csv.DictReader(source)
+            return
+        for line in source:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                row = json.loads(line)
+            except ValueError:
+                row = None
+            yield row if isinstance(row, dict) else {}
+
+    def clean_row(self, row):
+        """Возвращает данные пользователя или None, если строка
+        некорректна. Телефон проверяется по тому же диапазону,
+        что и в модели User. Из NDJSON принимаются только целые числа
+        и строки: дробная часть числа (79998887760.5, 7.9e10) не
+        отбрасывается молча, такая строка считается некорректной."""
+        phone = row.get('phone')
+        if isinstance(phone, bool) or not isinstance(phone, (int, str)):
+            return None
+        try:
+            phone = int(phone)
+        except ValueError:
+            return None
+        if not MIN_PHONE <= phone <= MAX_PHONE:
+            return None
+        data = {'phone': phone}
+        for field in IMPORT_FIELDS:
+            data[field] = str(row.get(field) or '')[
+                :User._meta.get_field(field).max_length]
+        return data
+
+    def import_rows(self, rows, options):
+        batch = {}
+        for row in rows:
+            self.processed += 1
+            data = self.clean_row(row)
+            if data is None:
+                self.invalid += 1
+                if options['verbosity'] >= 2:
+                    self.stderr.write(
+                        f'Строка {self.processed}: некорректные данные')
+                continue
+            batch[data['phone']] = data
+            if len(batch) >= options['batch_size']:
+                self.save_batch(batch, options)
+                batch = {}
+        if batch:
+            self.save_batch(batch, options)
+
+    def save_batch(self, batch, options):
+        """Сохраняет пакет (словарь телефон -> данные) одним INSERT.
+        Уже зарегистрированные телефоны определяются заранее одним
+        запросом по уникальному индексу, поэтому инвайт-коды забираются
+        из пула только для новых пользователей, а число созданных
+        пользователей известно без пересчета всей таблицы. Телефон,
+        зарегистрированный параллельно между проверкой и INSERT,
+        пропускается, а забранный для него код остается занятым.
+        Обновленные пользователи убираются из кэша ответов сигналом
+        users_bulk_updated."""
+        existing = dict(User.objects
+                        .filter(phone__in=list(batch))
+                        .values_list('phone', 'id'))
+        rows = [data for phone, data in batch.items()
+                if phone not in existing]
+        created = len(rows)
+        invite_codes = (InviteCode.objects.claim_many(created)
+                        if options['assign_invite_codes'] and created
+                        else [])
+        if options['on_conflict'] == 'update':
+            rows += [batch[phone] for phone in existing]
+        passwords = generate_sequences(len(rows), 40)
+        users = [
+            User(
+                password=UNUSABLE_PASSWORD_PREFIX + password,
+                invite_code=invite_code,
+                **data,
+            )
+            for data, password, invite_code
+            in zip_longest(rows, passwords, invite_codes)
+        ]
+        if users and options['on_conflict'] == 'update':
+            User.objects.bulk_create(
+                users,
+                update_conflicts=True,
+                unique_fields=['phone'],
+                update_fields=list(IMPORT_FIELDS),
+            )
+            if existing:
+                users_bulk_updated.send(
+                    sender=User, user_ids=list(existing.values()),
+                    fields=IMPORT_FIELDS, using=User.objects.db)
+        elif users:
+            User.objects.bulk_create(users, ignore_conflicts=True)
+        self.created += created
+        if options['verbosity'] >= 1:
+            self.stdout.write(f'Обработано строк: {self.processed}')
@@ -0,0 +1,23 @@
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+
+User = get_user_model()
+
+
+class Command(BaseCommand):
+    help = ('Пересчитывает у пользователей счетчики приглашенных '
+            '(например, после загрузки данных в обход API).')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=10000,
+            help='Размер диапазона id, обновляемого одним запросом.',
+        )
+
+    def handle(self, *args, **options):
+        updated = User.objects.rebuild_applicants_counts(
+            batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(
+            f'Счетчики пересчитаны, обновлено пользователей: {updated}'))
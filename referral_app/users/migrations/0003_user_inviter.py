@@ -0,0 +1,37 @@
+# Generated by Django 4.2.4 on 2026-10-18 19:00
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def fill_inviter(apps, schema_editor):
+    """Заполняет ссылку на пригласившего пользователя по ранее
+    введенным инвайт-кодам."""
+    User = apps.get_model('users', 'User')
+    inviters = (User.objects
+                .filter(invite_code=models.OuterRef('granted_code'))
+                .values('id')[:1])
+    (User.objects
+     .exclude(granted_code='')
+     .update(inviter=models.Subquery(inviters)))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0002_user_ordering'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='user',
+            name='inviter',
+            field=models.ForeignKey(blank=True, db_index=False, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='applicants', to=settings.AUTH_USER_MODEL, verbose_name='Пригласивший пользователь'),
+        ),
+        migrations.AddIndex(
+            model_name='user',
+            index=models.Index(fields=['inviter', 'phone'], name='users_user_inviter_phone_idx'),
+        ),
+        migrations.RunPython(fill_inviter, migrations.RunPython.noop),
+    ]
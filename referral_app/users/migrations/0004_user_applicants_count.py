@@ -0,0 +1,39 @@
+# Generated by Django 4.2.4 on 2026-10-18 19:01
+
+from django.db import migrations, models
+from django.db.models.functions import Coalesce
+
+
+def fill_applicants_count(apps, schema_editor):
+    """Заполняет счетчик приглашенных для существующих пользователей."""
+    User = apps.get_model('users', 'User')
+    counts = (User.objects
+              .filter(inviter=models.OuterRef('pk'))
+              .order_by()
+              .values('inviter')
+              .annotate(count=models.Count('id'))
+              .values('count'))
+    inviters = User.objects.exclude(inviter=None).values('inviter')
+    (User.objects
+     .filter(id__in=inviters)
+     .update(applicants_count=Coalesce(models.Subquery(counts), 0)))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0003_user_inviter'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='user',
+            name='applicants_count',
+            field=models.PositiveIntegerField(default=0, verbose_name='Количество приглашенных'),
+        ),
+        migrations.AddIndex(
+            model_name='user',
+            index=models.Index(fields=['-applicants_count', 'id'], name='users_user_leaderboard_idx'),
+        ),
+        migrations.RunPython(fill_applicants_count, migrations.RunPython.noop),
+    ]
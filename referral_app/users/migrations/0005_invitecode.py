@@ -0,0 +1,46 @@
+# Generated by Django 4.2.4 on 2026-10-18 19:03
+
+from django.db import migrations, models
+
+
+def register_used_codes(apps, schema_editor):
+    """Заносит в пул уже выданные пользователям инвайт-коды как
+    использованные, чтобы пул не выдал их повторно."""
+    User = apps.get_model('users', 'User')
+    InviteCode = apps.get_model('users', 'InviteCode')
+    codes = (User.objects
+             .exclude(invite_code=None)
+             .exclude(invite_code='')
+             .values_list('invite_code', flat=True)
+             .iterator(chunk_size=10000))
+    batch = []
+    for code in codes:
+        batch.append(InviteCode(code=code, is_used=True))
+        if len(batch) >= 10000:
+            InviteCode.objects.bulk_create(batch, ignore_conflicts=True)
+            batch = []
+    InviteCode.objects.bulk_create(batch, ignore_conflicts=True)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0004_user_applicants_count'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='InviteCode',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('code', models.CharField(max_length=6, unique=True, verbose_name='Инвайт-код')),
+                ('is_used', models.BooleanField(default=False, verbose_name='Использован')),
+            ],
+            options={
+                'verbose_name': 'Инвайт-код',
+                'verbose_name_plural': 'Инвайт-коды',
+                'indexes': [models.Index(condition=models.Q(('is_used', False)), fields=['id'], name='users_invitecode_free_idx')],
+            },
+        ),
+        migrations.RunPython(register_used_codes, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,21 @@
+# Generated by Django 4.2.4 on 2026-10-18 19:05
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0005_invitecode'),
+    ]
+
+    operations = [
+        migrations.RemoveField(
+            model_name='user',
+            name='verif_cutoff_timestamp',
+        ),
+        migrations.RemoveField(
+            model_name='user',
+            name='verification_code',
+        ),
+    ]
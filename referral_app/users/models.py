@@ -1,13 +1,21 @@
-import datetime as dt
-
 from django.apps import apps
+from django.conf import settings
 from django.contrib.auth.hashers import make_password
 from django.contrib.auth.models import AbstractUser, UserManager
 from django.core.validators import MaxValueValidator, MinValueValidator
-from django.db import IntegrityError, models
+from django.db import (IntegrityError, connections, models, router,
+                       transaction)
+from django.db.models.functions import Coalesce
+from django.db.models.signals import post_save
 from django.utils.translation import gettext_lazy as _
 
-from .utils import generate_sequense
+from .sharding import shards_for_phone_range
+from .utils import db_sync_to_async, generate_sequences
+from .verification import get_code_store
+
+MIN_PHONE = 71000000000
+MAX_PHONE = 79999999999
+PHONE_RANGE_MESSAGE = f'Должно быть значение от {MIN_PHONE} до {MAX_PHONE}'
 
 
 class CustomUserManager(UserManager):
@@ -17,17 +25,159 @@ class CustomUserManager(UserManager):
     def _create_user(self, phone, password, **extra_fields):
         if not phone:
             raise ValueError('Должен быть указан номер телефона.')
-        if not password:
-            password = generate_sequense(60)
 
         GlobalUserModel = apps.get_model(
             self.model._meta.app_label, self.model._meta.object_name)
 
+        granted_code = extra_fields.get('granted_code')
+        if granted_code and 'inviter' not in extra_fields:
+            extra_fields['inviter'] = (self.filter(invite_code=granted_code)
+                                       .first())
         user = self.model(phone=phone, **extra_fields)
-        user.password = make_password(password)
+        if password:
+            user.password = make_password(password)
+        else:
+            # Вход по телефону выполняется по sms-коду, поэтому пароль
+            # не нужен: сохраняем маркер неиспользуемого пароля без
+            # вызова хэширующей функции.
+            user.set_unusable_password()
         user.save(using=self._db)
+        if user.inviter_id:
+            self.increment_applicants_count(user.inviter_id)
         return user
 
+    def with_applicants(self, limit=None):
+        """Возвращает queryset, в котором для каждого пользователя
+        одним запросом на всю выборку подгружаются первые limit
+        пользователей, воспользовавшихся его инвайт-кодом. Результат
+        доступен в атрибуте first_applicants."""
+        if limit is None:
+            limit = settings.CODE_APPLICANTS_LIMIT
+        applicants = (self.model.objects
+                      .only('id', 'phone', 'inviter_id')
+                      .order_by('phone'))
+        return self.prefetch_related(models.Prefetch(
+            'applicants',
+            queryset=applicants[:limit],
+            to_attr='first_applicants',
+        ))
+
+    def increment_applicants_count(self, user_id):
+        """Атомарно увеличивает счетчик пользователей, которые ввели
+        инвайт-код пользователя user_id."""
+        return (self.filter(pk=user_id)
+                .update(applicants_count=models.F('applicants_count') + 1))
+
+    def rebuild_applicants_counts(self, batch_size=10000):
+        """Пересчитывает счетчики приглашенных по таблице пользователей.
+        Обновление идет порциями по диапазонам id, чтобы не держать
+        блокировку на всей таблице. Возвращает число обновленных
+        строк."""
+        counts = (self.model.objects
+                  .filter(inviter=models.OuterRef('pk'))
+                  .order_by()
+                  .values('inviter')
+                  .annotate(count=models.Count('id'))
+                  .values('count'))
+        last_id = self.aggregate(last_id=models.Max('id'))['last_id'] or 0
+        updated = 0
+        for start in range(0, last_id + 1, batch_size):
+            updated += (self.filter(id__gte=start, id__lt=start + batch_size)
+                        .update(applicants_count=Coalesce(
+                            models.Subquery(counts), 0)))
+        return updated
+
+    def for_phone(self, phone):
+        """Менеджер, привязанный к БД, в которой хранится пользователь
+        с номером phone (см. users.routers.PhoneShardRouter)."""
+        db = self._db or router.db_for_read(self.model, phone=phone)
+        return self.db_manager(db, hints={'phone': phone})
+
+    def get_by_natural_key(self, username):
+        try:
+            phone = int(username)
+        except (TypeError, ValueError):
+            raise self.model.DoesNotExist from None
+        return self.for_phone(phone).get(phone=phone)
+
+    def iter_phone_range(self, first, last, chunk_size=2000):
+        """Пользователи с номерами от first до last включительно
+        в порядке номеров. Каждая БД из settings.USER_SHARDS читается
+        только в пределах своего диапазона."""
+        for part_first, part_last, db in shards_for_phone_range(first, last):
+            yield from (self.db_manager(db)
+                        .filter(phone__range=(part_first, part_last))
+                        .order_by('phone')
+                        .iterator(chunk_size))
+
+    def register(self, phone):
+        """Регистрация по номеру телефона: создает пользователя или
+        возвращает существующего с этим номером. Если БД умеет
+        INSERT ... ON CONFLICT ... RETURNING (PostgreSQL, SQLite
+        3.35+), это обходится без ошибки уникальности и отката."""
+        db = self._db or router.db_for_write(self.model, phone=phone)
+        features = connections[db].features
+        if (features.supports_update_conflicts_with_target
+                and features.can_return_columns_from_insert):
+            user = self._insert_by_phone(phone, db)
+            if user is not None:
+                post_save.send(sender=self.model, instance=user,
+                               created=True, update_fields=None,
+                               raw=False, using=db)
+                return user
+            return self.db_manager(db).filter(phone=phone).first()
+        try:
+            with transaction.atomic(using=db):
+                return self.db_manager(db).create_user(phone=phone)
+        except IntegrityError:
+            return self.db_manager(db).filter(phone=phone).first()
+
+    def _insert_by_phone(self, phone, db):
+        """INSERT ... ON CONFLICT (phone) DO NOTHING RETURNING всех
+        колонок. Возвращает нового пользователя или None, если номер
+        уже занят: существующая строка не блокируется и не
+        переписывается. Сигналы не отправляются, post_save для нового
+        пользователя отправляет register."""
+        connection = connections[db]
+        quote_name = connection.ops.quote_name
+        user = self.model(phone=phone, is_staff=False, is_superuser=False)
+        user.set_unusable_password()
+        opts = self.model._meta
+        fields = [field for field in opts.concrete_fields
+                  if not field.primary_key]
+        sql = (
+            f'INSERT INTO {quote_name(opts.db_table)} '
+            f'({", ".join(quote_name(field.column) for field in fields)}) '
+            f'VALUES ({", ".join(["%s"] * len(fields))}) '
+            f'ON CONFLICT ({quote_name(opts.get_field("phone").column)}) '
+            'DO NOTHING RETURNING '
+            + ', '.join(quote_name(field.column)
+                        for field in opts.concrete_fields)
+        )
+        params = [field.get_db_prep_save(field.pre_save(user, True),
+                                         connection)
+                  for field in fields]
+        with connection.cursor() as cursor:
+            cursor.execute(sql, params)
+            row = cursor.fetchone()
+        if row is None:
+            return None
+        # Значения приводятся к типам Python так же, как при обычной
+        # выборке (например, даты в SQLite приходят строками).
+        compiler = self.none().query.get_compiler(using=db)
+        columns = [field.get_col(opts.db_table)
+                   for field in opts.concrete_fields]
+        row = next(compiler.apply_converters(
+            [row], compiler.get_converters(columns)))
+        return self.model.from_db(
+            db, [field.attname for field in opts.concrete_fields], row)
+
+    async def aregister(self, phone):
+        """Асинхронная регистрация: register выполняется в пуле потоков
+        одним коротким запросом (или короткой транзакцией), параллельно
+        с регистрациями из других запросов."""
+        return await db_sync_to_async(self.register)(phone)
+
     def create_user(self, phone=None, password=None, **extra_fields):
         extra_fields.setdefault('is_staff', False)
         extra_fields.setdefault('is_superuser', False)
@@ -45,7 +195,69 @@ class CustomUserManager(UserManager):
         return self._create_user(phone, password, **extra_fields)
 
 
-class User(AbstractUser):
+class DirtyFieldsMixin:
+    """Отслеживание измененных полей модели. Значения полей
+    запоминаются при загрузке из БД и после сохранения, и save() без
+    update_fields записывает только колонки, значения которых
+    изменились. Если ничего не изменилось, запрос не выполняется."""
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._loaded_values = dict(zip(field_names, values))
+        return instance
+
+    def _remember_values(self, attnames=None):
+        if attnames is None:
+            attnames = [field.attname
+                        for field in self._meta.concrete_fields]
+        # Словарь заменяется, а не меняется на месте: копии объекта
+        # (copy.copy) не должны делить запомненные значения.
+        loaded = dict(getattr(self, '_loaded_values', None) or {})
+        for attname in attnames:
+            if attname in self.__dict__:
+                loaded[attname] = self.__dict__[attname]
+        self._loaded_values = loaded
+
+    def get_dirty_fields(self):
+        """Имена полей, измененных с момента загрузки или сохранения.
+        Для несохраненного объекта возвращает None."""
+        loaded = getattr(self, '_loaded_values', None)
+        if self._state.adding or loaded is None:
+            return None
+        return [
+            field.name for field in self._meta.concrete_fields
+            if not field.primary_key
+            and field.attname in self.__dict__
+            and (field.attname not in loaded
+                 or loaded[field.attname] != self.__dict__[field.attname])
+        ]
+
+    def save(self, force_insert=False, force_update=False, using=None,
+             update_fields=None):
+        # Только измененные колонки пишутся лишь при обновлении той же
+        # строки: копия с pk=None и сохранение в другую БД записывают
+        # все поля.
+        if (update_fields is None and not force_insert
+                and self.pk is not None
+                and using in (None, self._state.db)):
+            update_fields = self.get_dirty_fields()
+        super().save(force_insert=force_insert, force_update=force_update,
+                     using=using, update_fields=update_fields)
+        if update_fields is None:
+            self._remember_values()
+        else:
+            self._remember_values([self._meta.get_field(name).attname
+                                   for name in update_fields])
+
+    def refresh_from_db(self, using=None, fields=None):
+        super().refresh_from_db(using=using, fields=fields)
+        self._remember_values(
+            None if fields is None
+            else [self._meta.get_field(name).attname for name in fields])
+
+
+class User(DirtyFieldsMixin, AbstractUser):
     """Класс User создает БД SQL для хранения
     информации о пользователях."""
 
@@ -59,25 +271,10 @@ class User(AbstractUser):
         'Номер телефона',
         unique=True,
         validators=[
-            MinValueValidator(
-                71000000000,
-                message='Должно быть значение от 71000000000 до 79999999999'),
-            MaxValueValidator(
-                79999999999,
-                message='Должно быть значение от 71000000000 до 79999999999')
+            MinValueValidator(MIN_PHONE, message=PHONE_RANGE_MESSAGE),
+            MaxValueValidator(MAX_PHONE, message=PHONE_RANGE_MESSAGE),
         ]
     )
-    verification_code = models.CharField(
-        'Код верификации',
-        max_length=4,
-        blank=True,
-        null=True,
-    )
-    verif_cutoff_timestamp = models.PositiveIntegerField(
-        'Срок действия кода',
-        blank=True,
-        null=True,
-    )
     invite_code = models.CharField(
         'Инвайт-код',
         max_length=6,
@@ -90,9 +287,28 @@ class User(AbstractUser):
         max_length=6,
         blank=True,
     )
+    inviter = models.ForeignKey(
+        'self',
+        verbose_name='Пригласивший пользователь',
+        on_delete=models.SET_NULL,
+        related_name='applicants',
+        db_index=False,
+        blank=True,
+        null=True,
+    )
+    applicants_count = models.PositiveIntegerField(
+        'Количество приглашенных',
+        default=0,
+    )
 
     class Meta:
-        ordering = ['-id', 'phone']
+        ordering = ['-id']
+        indexes = [
+            models.Index(fields=['inviter', 'phone'],
+                         name='users_user_inviter_phone_idx'),
+            models.Index(fields=['-applicants_count', 'id'],
+                         name='users_user_leaderboard_idx'),
+        ]
         verbose_name = 'Пользователь'
         verbose_name_plural = 'Пользователи'
 
@@ -100,14 +316,112 @@ class User(AbstractUser):
         return str(self.phone)
 
     def check_code(self, code):
-        if dt.datetime.utcnow().timestamp() > self.verif_cutoff_timestamp:
-            return False
-        return bool(code == self.verification_code)
+        return get_code_store().check(self.phone, code)
 
     def create_invite_code(self):
-        while not self.invite_code:
-            try:
-                self.invite_code = generate_sequense(6)
-                self.save()
-            except IntegrityError:
-                continue
+        """Выдает пользователю инвайт-код из пула. Записывается только
+        колонка invite_code."""
+        if self.invite_code:
+            return
+        self.invite_code = InviteCode.objects.claim()
+        self.save(update_fields=['invite_code'])
+
+
+class InviteCodePoolExhausted(Exception):
+    """Пул инвайт-кодов не удалось пополнить: все сгенерированные коды
+    уже заняты."""
+
+
+class InviteCodeManager(models.Manager):
+    """Класс для обработки операций с пулом инвайт-кодов."""
+
+    def refill(self, count=None):
+        """Добавляет в пул до count новых кодов одним bulk INSERT.
+        Коды, которые уже есть в пуле или у пользователей, пропускаются.
+        Возвращает количество добавленных кодов: сгенерированные коды,
+        которых не было в пуле до вставки и которые есть после нее."""
+        if count is None:
+            count = settings.INVITE_CODE_POOL_BATCH
+        codes = set(generate_sequences(count, 6))
+        codes -= set(User.objects
+                     .filter(invite_code__in=codes)
+                     .values_list('invite_code', flat=True))
+        codes -= set(self.filter(code__in=codes)
+                     .values_list('code', flat=True))
+        if not codes:
+            return 0
+        self.bulk_create(
+            [self.model(code=code) for code in codes],
+            ignore_conflicts=True,
+        )
+        return self.filter(code__in=codes).count()
+
+    def claim(self):
+        """Забирает из пула свободный код и помечает его
+        использованным."""
+        return self.claim_many(1)[0]
+
+    def claim_many(self, count):
+        """Забирает из пула count свободных кодов и помечает их
+        использованными. Строки блокируются через SELECT ... FOR UPDATE
+        SKIP LOCKED, поэтому параллельные запросы получают разные коды
+        без ожидания. Если кодов не хватает, пул пополняется; если
+        INVITE_CODE_REFILL_ATTEMPTS пополнений подряд не добавили ни
+        одного кода, выбрасывается InviteCodePoolExhausted."""
+        codes = []
+        empty_refills = 0
+        while len(codes) < count:
+            missing = count - len(codes)
+            with transaction.atomic():
+                free = list(self.select_for_update(skip_locked=True)
+                            .filter(is_used=False)
+                            .order_by('id')
+                            .values_list('id', 'code')[:missing])
+                if not free:
+                    if self.refill(max(missing,
+                                       settings.INVITE_CODE_POOL_BATCH)):
+                        empty_refills = 0
+                        continue
+                    empty_refills += 1
+                    if empty_refills >= settings.INVITE_CODE_REFILL_ATTEMPTS:
+                        raise InviteCodePoolExhausted(
+                            'Не удалось пополнить пул инвайт-кодов.')
+                    continue
+                # На СУБД без SELECT ... FOR UPDATE (SQLite) часть кодов
+                # мог забрать параллельный запрос - тогда берем новые.
+                updated = (self.filter(id__in=[pk for pk, _ in free],
+                                       is_used=False)
+                           .update(is_used=True))
+                if updated == len(free):
+                    codes.extend(code for _, code in free)
+        return codes
+
+
+class InviteCode(models.Model):
+    """Класс InviteCode создает таблицу пула заранее сгенерированных
+    уникальных инвайт-кодов. Использованные коды остаются в таблице,
+    чтобы уникальный индекс не допускал их повторной генерации."""
+
+    code = models.CharField(
+        'Инвайт-код',
+        max_length=6,
+        unique=True,
+    )
+    is_used = models.BooleanField(
+        'Использован',
+        default=False,
+    )
+
+    objects = InviteCodeManager()
+
+    class Meta:
+        verbose_name = 'Инвайт-код'
+        verbose_name_plural = 'Инвайт-коды'
+        indexes = [
+            models.Index(fields=['id'],
+                         condition=models.Q(is_used=False),
+                         name='users_invitecode_free_idx'),
+        ]
+
+    def __str__(self):
+        return self.code
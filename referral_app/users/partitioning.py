@@ -0,0 +1,167 @@
+"""Декларативное секционирование таблицы пользователей в PostgreSQL
+по диапазонам номеров телефонов (PARTITION BY RANGE).
+
+Операция PartitionByPhoneRange добавляется в миграцию вручную, когда
+таблицу пора делить:
+
+    operations = [
+        PartitionByPhoneRange('user', ranges=phone_prefix_ranges()),
+    ]
+
+Ограничения PostgreSQL для секционированных таблиц:
+- первичный ключ и уникальные индексы должны содержать ключ
+  секционирования, поэтому первичный ключ становится (id, phone),
+  а уникальность invite_code обеспечивает пул кодов (InviteCode);
+- внешние ключи на таблицу пользователей (токены, группы, журнал
+  админки, inviter) ссылаются на id, который больше не уникален сам
+  по себе, поэтому ограничения внешних ключей удаляются, связи
+  проверяет приложение;
+- столбец identity в секционированной таблице поддерживается только
+  с PostgreSQL 17, поэтому id получает отдельную последовательность.
+Те же изменения операция вносит в состояние миграций: invite_code
+становится неуникальным полем с индексом, у inviter и у связей других
+приложений на пользователя снимается db_constraint. Модель users.User
+при этом нужно привести к тому же виду, иначе makemigrations предложит
+вернуть ограничения.
+На других СУБД операция меняет только состояние миграций.
+"""
+from django.db.migrations.operations.base import Operation
+
+PHONE_FIRST = 71000000000
+PHONE_LAST = 79999999999
+
+
+def phone_prefix_ranges():
+    """Диапазоны по второй цифре номера: 71..., 72..., ..., 79..."""
+    step = 1000000000
+    return [(first, first + step - 1)
+            for first in range(PHONE_FIRST, PHONE_LAST, step)]
+
+
+def partition_table_statements(model, ranges, schema_editor):
+    """SQL перевода таблицы модели в секционированную по phone
+    с секциями ranges (список (первый номер, последний номер))
+    и секцией по умолчанию для номеров вне диапазонов."""
+    quote = schema_editor.quote_name
+    opts = model._meta
+    table = opts.db_table
+    old_table = f'{table}_unpartitioned'
+    sequence = f'{table}_id_partitioned_seq'
+    pk = quote(opts.pk.column)
+    phone = quote(opts.get_field('phone').column)
+    invite_code = quote(opts.get_field('invite_code').column)
+    statements = [
+        f'ALTER TABLE {quote(table)} RENAME TO {quote(old_table)}',
+        # После переименования внешние ключи других таблиц (и inviter)
+        # указывают на старую таблицу: они удаляются.
+        f"""DO $$
+DECLARE fk record;
+BEGIN
+    FOR fk IN SELECT conrelid::regclass AS tbl, conname
+              FROM pg_constraint
+              WHERE contype = 'f'
+                AND confrelid = '{old_table}'::regclass
+    LOOP
+        EXECUTE format('ALTER TABLE %s DROP CONSTRAINT %I',
+                       fk.tbl, fk.conname);
+    END LOOP;
+END $$""",
+        *(f'DROP INDEX {quote(index.name)}' for index in opts.indexes),
+        f'CREATE TABLE {quote(table)} (LIKE {quote(old_table)} '
+        f'INCLUDING DEFAULTS INCLUDING CONSTRAINTS) '
+        f'PARTITION BY RANGE ({phone})',
+        # Имена ограничений старой таблицы еще заняты ее индексами.
+        f'ALTER TABLE {quote(table)} '
+        f'ADD CONSTRAINT {quote(table + "_partitioned_pkey")} '
+        f'PRIMARY KEY ({pk}, {phone})',
+        f'ALTER TABLE {quote(table)} '
+        f'ADD CONSTRAINT {quote(table + "_phone_partitioned_key")} '
+        f'UNIQUE ({phone})',
+        *(str(index.create_sql(model, schema_editor))
+          for index in opts.indexes),
+        f'CREATE INDEX {quote(table + "_invite_code_idx")} '
+        f'ON {quote(table)} ({invite_code})',
+    ]
+    statements.extend(
+        f'CREATE TABLE {quote(f"{table}_p{first}")} '
+        f'PARTITION OF {quote(table)} '
+        f'FOR VALUES FROM ({first}) TO ({last + 1})'
+        for first, last in ranges
+    )
+    statements += [
+        f'CREATE TABLE {quote(table + "_default")} '
+        f'PARTITION OF {quote(table)} DEFAULT',
+        f'INSERT INTO {quote(table)} SELECT * FROM {quote(old_table)}',
+        f'CREATE SEQUENCE {quote(sequence)} '
+        f'OWNED BY {quote(table)}.{pk}',
+        f"SELECT setval('{sequence}', "
+        f'COALESCE(MAX({pk}), 0) + 1, false) FROM {quote(table)}',
+        f'ALTER TABLE {quote(table)} ALTER COLUMN {pk} '
+        f"SET DEFAULT nextval('{sequence}')",
+        f'DROP TABLE {quote(old_table)}',
+    ]
+    return statements
+
+
+def replace_field_options(field, **options):
+    """Копия поля field с измененными параметрами options."""
+    _, _, args, kwargs = field.deconstruct()
+    kwargs.update(options)
+    return field.__class__(*args, **kwargs)
+
+
+class PartitionByPhoneRange(Operation):
+    """Операция миграции: переводит таблицу модели model_name
+    в секционированную по диапазонам phone. Необратима."""
+
+    reversible = False
+    reduces_to_sql = True
+
+    def __init__(self, model_name, ranges):
+        self.model_name = model_name
+        self.ranges = [tuple(item) for item in ranges]
+
+    def deconstruct(self):
+        return (
+            self.__class__.__qualname__,
+            [],
+            {'model_name': self.model_name,
+             'ranges': [list(item) for item in self.ranges]},
+        )
+
+    def state_forwards(self, app_label, state):
+        # Состояние миграций повторяет изменения схемы: уникальность
+        # invite_code заменяется обычным индексом, а у связей
+        # на таблицу пользователей нет ограничений внешних ключей.
+        model_key = (app_label, self.model_name.lower())
+        invite_code = state.models[model_key].fields['invite_code']
+        state.alter_field(
+            *model_key, 'invite_code',
+            replace_field_options(invite_code, unique=False, db_index=True),
+            True)
+        related = [(related_key, name, field)
+                   for related_key, fields in
+                   state.relations[model_key].items()
+                   for name, field in fields.items()
+                   if field.db_constraint]
+        for related_key, name, field in related:
+            state.alter_field(
+                *related_key, name,
+                replace_field_options(field, db_constraint=False), True)
+
+    def database_forwards(self, app_label, schema_editor, from_state,
+                          to_state):
+        if schema_editor.connection.vendor != 'postgresql':
+            return
+        model = to_state.apps.get_model(app_label, self.model_name)
+        for sql in partition_table_statements(model, self.ranges,
+                                              schema_editor):
+            schema_editor.execute(sql, params=None)
+
+    def describe(self):
+        return (f'Секционирование {self.model_name} по диапазонам phone '
+                f'({len(self.ranges)} секций)')
+
+    @property
+    def migration_name_fragment(self):
+        return f'partition_{self.model_name.lower()}'
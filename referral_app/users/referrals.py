@@ -0,0 +1,116 @@
+import csv
+import io
+import json
+
+from django.contrib.auth import get_user_model
+from django.db import connection
+from django.db.models.expressions import RawSQL
+
+User = get_user_model()
+
+EDGE_COLUMNS = ('inviter_id', 'invitee_id')
+
+# Рекурсивный обход дерева приглашенных по inviter_id. У каждого
+# пользователя один пригласивший, поэтому цикл в графе (A пригласил B,
+# затем A ввел код B), достижимый из корня, всегда проходит через сам
+# корень: обход не возвращается в корень, и каждый приглашенный
+# попадает в дерево один раз. UNION дополнительно убирает повторы,
+# глубина ограничена.
+REFERRAL_TREE_CTE = '''
+    WITH RECURSIVE referral_tree (id, level) AS (
+        SELECT id, 1 FROM {table} WHERE inviter_id = %s AND id <> %s
+        UNION
+        SELECT child.id, parent.level + 1
+        FROM {table} AS child
+        JOIN referral_tree AS parent ON child.inviter_id = parent.id
+        WHERE parent.level < %s AND child.id <> %s
+    )
+'''
+EXPORT_FORMATS = ('csv', 'columns')
+
+
+def iter_referral_edges(chunk_size):
+    """Генератор ребер реферального графа (inviter_id, invitee_id)
+    в порядке id приглашенного. Строки читаются серверным курсором
+    порциями по chunk_size, поэтому память не зависит от размера
+    таблицы. Обычный SELECT не блокирует запись в таблицу."""
+    return (User.objects
+            .filter(inviter__isnull=False)
+            .order_by('id')
+            .values_list('inviter_id', 'id')
+            .iterator(chunk_size=chunk_size))
+
+
+def iter_edge_chunks(chunk_size):
+    """Группирует ребра в списки по chunk_size штук."""
+    chunk = []
+    for edge in iter_referral_edges(chunk_size):
+        chunk.append(edge)
+        if len(chunk) >= chunk_size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def iter_edges_csv(chunk_size):
+    """Выгрузка ребер в CSV: заголовок и по одному фрагменту текста
+    на порцию."""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(EDGE_COLUMNS)
+    yield buffer.getvalue()
+    for chunk in iter_edge_chunks(chunk_size):
+        buffer.seek(0)
+        buffer.truncate()
+        writer.writerows(chunk)
+        yield buffer.getvalue()
+
+
+def iter_edges_columns(chunk_size):
+    """Выгрузка ребер поколоночными порциями: каждая строка - JSON
+    с массивом значений для каждой колонки, как в row group
+    у Parquet."""
+    for chunk in iter_edge_chunks(chunk_size):
+        inviters, invitees = zip(*chunk)
+        yield json.dumps({
+            EDGE_COLUMNS[0]: inviters,
+            EDGE_COLUMNS[1]: invitees,
+        }) + '\n'
+
+
+def iter_edges(export_format, chunk_size):
+    if export_format == 'columns':
+        return iter_edges_columns(chunk_size)
+    return iter_edges_csv(chunk_size)
+
+
+def _referral_tree_cte():
+    return REFERRAL_TREE_CTE.format(
+        table=connection.ops.quote_name(User._meta.db_table))
+
+
+def referral_level_counts(user_id, max_depth):
+    """Количество приглашенных пользователя по уровням от 1
+    до max_depth одним рекурсивным запросом. Возвращает список
+    пар (уровень, количество) без пустых уровней."""
+    with connection.cursor() as cursor:
+        cursor.execute(
+            _referral_tree_cte()
+            + 'SELECT level, COUNT(*) FROM referral_tree '
+              'GROUP BY level ORDER BY level',
+            [user_id, user_id, max_depth, user_id],
+        )
+        return cursor.fetchall()
+
+
+def referral_level_members(user_id, level):
+    """QuerySet приглашенных пользователя на заданном уровне дерева.
+    Уровень вычисляется тем же рекурсивным запросом в подзапросе,
+    поэтому результат можно фильтровать и постранично выводить
+    как обычный QuerySet."""
+    return User.objects.filter(id__in=RawSQL(
+        _referral_tree_cte()
+        + 'SELECT id FROM referral_tree WHERE level = %s',
+        [user_id, user_id, level, user_id, level],
+    ))
@@ -0,0 +1,102 @@
+import contextlib
+import contextvars
+import random
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS
+
+from .sharding import shard_for_phone
+
+# Разрешено ли читать с реплик в текущем контексте. Включается
+# api.middleware.ReplicaReadMiddleware на время безопасных запросов.
+_replica_reads = contextvars.ContextVar('replica_reads', default=False)
+
+
+@contextlib.contextmanager
+def replica_reads():
+    """Чтение с реплик внутри блока (settings.DATABASE_REPLICAS)."""
+    token = _replica_reads.set(True)
+    try:
+        yield
+    finally:
+        _replica_reads.reset(token)
+
+
+@contextlib.contextmanager
+def primary_reads():
+    """Чтение из основной БД внутри блока, даже если снаружи включено
+    чтение с реплик."""
+    token = _replica_reads.set(False)
+    try:
+        yield
+    finally:
+        _replica_reads.reset(token)
+
+
+def replica_for(alias):
+    """Случайная реплика БД alias, если чтение с реплик разрешено
+    и реплики настроены, иначе сама alias."""
+    replicas = settings.DATABASE_REPLICAS.get(alias)
+    if replicas and _replica_reads.get():
+        return random.choice(replicas)
+    return alias
+
+
+def primary_for(alias):
+    """Основная БД для реплики alias (для основной БД - она сама)."""
+    for primary, replicas in settings.DATABASE_REPLICAS.items():
+        if alias in replicas:
+            return primary
+    return alias
+
+
+class PhoneShardRouter:
+    """Роутер БД для таблицы пользователей. Запросы, для которых
+    известен номер телефона (сохранение объекта, связанные менеджеры
+    объекта, подсказка phone), направляются в БД диапазона этого
+    номера по settings.USER_SHARDS. Остальные решения остаются за
+    следующими роутерами и настройками по умолчанию."""
+
+    def _db_for_user(self, model, hints):
+        if model._meta.label != settings.AUTH_USER_MODEL:
+            return None
+        phone = hints.get('phone')
+        instance = hints.get('instance')
+        if phone is None and instance is not None:
+            phone = getattr(instance, 'phone', None)
+        if phone is None:
+            return None
+        return shard_for_phone(phone)
+
+    def db_for_read(self, model, **hints):
+        db = self._db_for_user(model, hints)
+        return db and replica_for(db)
+
+    def db_for_write(self, model, **hints):
+        return self._db_for_user(model, hints)
+
+
+class ReplicaRouter:
+    """Роутер чтения с реплик: пока действует replica_reads(), чтение
+    идет с реплик основной БД (settings.DATABASE_REPLICAS). Запись
+    всегда идет в основную БД, в том числе для объектов, загруженных
+    с реплики."""
+
+    def _primary_for_hints(self, hints):
+        instance = hints.get('instance')
+        if instance is not None and instance._state.db:
+            return primary_for(instance._state.db)
+        return DEFAULT_DB_ALIAS
+
+    def db_for_read(self, model, **hints):
+        if not _replica_reads.get():
+            return None
+        return replica_for(self._primary_for_hints(hints))
+
+    def db_for_write(self, model, **hints):
+        return self._primary_for_hints(hints)
+
+    def allow_relation(self, obj1, obj2, **hints):
+        if primary_for(obj1._state.db) == primary_for(obj2._state.db):
+            return True
+        return None
@@ -0,0 +1,84 @@
+"""Распределение таблицы пользователей по диапазонам номеров телефонов.
+
+Диапазоны задаются в settings.USER_SHARDS списком
+(первый номер, последний номер, алиас БД). Один алиас может
+обслуживать несколько диапазонов. Номера вне диапазонов относятся
+к БД по умолчанию.
+"""
+import bisect
+from functools import lru_cache
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.db import DEFAULT_DB_ALIAS
+
+
+@lru_cache(maxsize=8)
+def _parse_shards(shards):
+    shards = sorted(shards)
+    for (_, last, alias), (first, _, next_alias) in zip(shards, shards[1:]):
+        if first <= last:
+            raise ImproperlyConfigured(
+                f'USER_SHARDS: диапазоны {alias} и {next_alias} '
+                'пересекаются'
+            )
+    for first, last, alias in shards:
+        if first > last:
+            raise ImproperlyConfigured(
+                f'USER_SHARDS: пустой диапазон {first}-{last} ({alias})'
+            )
+        if alias not in settings.DATABASES:
+            raise ImproperlyConfigured(
+                f'USER_SHARDS: БД {alias} нет в DATABASES'
+            )
+    return shards, [first for first, _, _ in shards]
+
+
+def get_user_shards():
+    """Диапазоны (первый номер, последний номер, алиас), отсортированные
+    по номеру."""
+    return _parse_shards(tuple(map(tuple, settings.USER_SHARDS)))[0]
+
+
+def get_user_shard_aliases():
+    """Алиасы всех БД с пользователями: сначала БД по умолчанию, затем
+    остальные в порядке диапазонов."""
+    aliases = [DEFAULT_DB_ALIAS]
+    for _, _, alias in get_user_shards():
+        if alias not in aliases:
+            aliases.append(alias)
+    return aliases
+
+
+def shard_for_phone(phone):
+    """Алиас БД, в которой хранится пользователь с номером phone."""
+    shards, firsts = _parse_shards(tuple(map(tuple, settings.USER_SHARDS)))
+    phone = int(phone)
+    idx = bisect.bisect_right(firsts, phone) - 1
+    if idx >= 0 and phone <= shards[idx][1]:
+        return shards[idx][2]
+    return DEFAULT_DB_ALIAS
+
+
+def shards_for_phone_range(first, last):
+    """Части диапазона first-last по БД: список (first, last, алиас)
+    в порядке номеров. Соседние части в одной БД объединяются."""
+    parts = []
+    position = first
+    for shard_first, shard_last, alias in get_user_shards():
+        if shard_last < position or shard_first > last:
+            continue
+        if shard_first > position:
+            parts.append((position, shard_first - 1, DEFAULT_DB_ALIAS))
+        parts.append((max(position, shard_first), min(shard_last, last),
+                      alias))
+        position = min(shard_last, last) + 1
+    if position <= last:
+        parts.append((position, last, DEFAULT_DB_ALIAS))
+    merged = []
+    for part in parts:
+        if merged and merged[-1][2] == part[2]:
+            merged[-1] = (merged[-1][0], part[1], part[2])
+        else:
+            merged.append(part)
+    return merged
@@ -0,0 +1,10 @@
+from django.dispatch import Signal
+
+# Пользователь user_id ввел инвайт-код пользователя inviter_id.
+# Код записывается через QuerySet.update, поэтому post_save
+# в этот момент не отправляется.
+invite_code_applied = Signal()
+
+# Поля fields пользователей user_ids из БД using изменены одним
+# QuerySet.update (например, массовым действием в админке).
+users_bulk_updated = Signal()
@@ -0,0 +1,218 @@
+import atexit
+import logging
+import threading
+import time
+
+from django.conf import settings
+from django.utils.module_loading import import_string
+
+logger = logging.getLogger(__name__)
+
+
+class BaseSmsProvider:
+    """Базовый класс провайдера sms с пакетной отправкой."""
+
+    def send_bulk(self, messages):
+        """Отправляет список сообщений вида {'phone': ..., 'text': ...}
+        одним обращением к провайдеру."""
+        raise NotImplementedError
+
+
+class LogSmsProvider(BaseSmsProvider):
+    """Провайдер, который только записывает сообщения в лог."""
+
+    def send_bulk(self, messages):
+        for message in messages:
+            logger.info('sms на номер %s: %s',
+                        message['phone'], message['text'])
+        return len(messages)
+
+
+class FakeSmsProvider(BaseSmsProvider):
+    """Провайдер для тестов: сохраняет пакеты в outbox."""
+
+    outbox = []
+
+    def send_bulk(self, messages):
+        self.outbox.append(list(messages))
+        return len(messages)
+
+
+def get_sms_provider():
+    return import_string(settings.SMS_PROVIDER)()
+
+
+class SmsMetrics:
+    """Счетчики размера пакетов и времени ожидания сообщений
+    в очереди."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.batches = 0
+            self.messages = 0
+            self.max_batch_size = 0
+            self.queue_latency_total = 0.0
+            self.queue_latency_max = 0.0
+
+    def observe_batch(self, messages, sent_at=None):
+        """Учитывает пакет: размер и время от постановки каждого
+        сообщения в очередь до sent_at."""
+        if sent_at is None:
+            sent_at = time.time()
+        latencies = [max(sent_at - message['queued_at'], 0.0)
+                     for message in messages]
+        with self._lock:
+            self.batches += 1
+            self.messages += len(messages)
+            self.max_batch_size = max(self.max_batch_size, len(messages))
+            self.queue_latency_total += sum(latencies)
+            self.queue_latency_max = max(
+                [self.queue_latency_max] + latencies)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'batches': self.batches,
+                'messages': self.messages,
+                'avg_batch_size': (self.messages / self.batches
+                                   if self.batches else 0.0),
+                'max_batch_size': self.max_batch_size,
+                'avg_queue_latency': (self.queue_latency_total / self.messages
+                                      if self.messages else 0.0),
+                'max_queue_latency': self.queue_latency_max,
+            }
+
+
+class SmsBatcher:
+    """Буфер исходящих sms. Сообщения копятся до max_size штук или
+    window секунд с момента первого сообщения в буфере, после чего
+    весь пакет передается в dispatch одним вызовом.
+
+    Если передать пакет не удалось, сообщения возвращаются в начало
+    буфера и отправляются повторно через window секунд; после
+    max_attempts неудачных попыток сообщение отбрасывается с записью
+    в лог. Буфер живет в памяти процесса: при штатном завершении
+    процесса он отправляется (close), при аварийном - теряются
+    сообщения последнего окна."""
+
+    def __init__(self, dispatch, max_size, window, metrics=None,
+                 max_attempts=3):
+        self.dispatch = dispatch
+        self.max_size = max_size
+        self.window = window
+        self.metrics = metrics or SmsMetrics()
+        self.max_attempts = max_attempts
+        self._buffer = []
+        self._timer = None
+        self._lock = threading.Lock()
+
+    def add(self, phone, text):
+        message = {'phone': phone, 'text': text, 'queued_at': time.time()}
+        with self._lock:
+            self._buffer.append(message)
+            if len(self._buffer) >= self.max_size:
+                batch = self._take()
+            else:
+                batch = None
+                self._start_timer()
+        if batch:
+            self._send(batch)
+
+    def flush(self):
+        """Отправляет накопленные сообщения, не дожидаясь окна."""
+        with self._lock:
+            batch = self._take()
+        if batch:
+            self._send(batch)
+
+    def close(self):
+        """Отправляет все сообщения перед завершением процесса.
+        Неудачные пакеты повторяются сразу, пока у сообщений есть
+        попытки."""
+        while True:
+            with self._lock:
+                batch = self._take()
+            if not batch:
+                return
+            self._send(batch)
+
+    def _start_timer(self):
+        if self._timer is None:
+            self._timer = threading.Timer(self.window, self.flush)
+            self._timer.daemon = True
+            self._timer.start()
+
+    def _take(self):
+        batch, self._buffer = self._buffer, []
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        return batch
+
+    def _send(self, batch):
+        try:
+            self.dispatch(batch)
+        except Exception:
+            self._requeue(batch)
+        else:
+            self.metrics.observe_batch(batch)
+
+    def _requeue(self, batch):
+        retry, dropped = [], []
+        for message in batch:
+            message['attempts'] = message.get('attempts', 0) + 1
+            if message['attempts'] < self.max_attempts:
+                retry.append(message)
+            else:
+                dropped.append(message)
+        if dropped:
+            logger.error('Не удалось передать %s sms за %s попыток, '
+                         'сообщения отброшены', len(dropped),
+                         self.max_attempts, exc_info=True)
+        if retry:
+            logger.warning('Не удалось передать пакет из %s sms, '
+                           'повтор через %s сек', len(retry), self.window,
+                           exc_info=True)
+            with self._lock:
+                self._buffer[:0] = retry
+                self._start_timer()
+
+
+def dispatch_to_worker(messages):
+    """Передает пакет sms воркеру Celery одной задачей. Кратковременные
+    ошибки брокера повторяются при публикации."""
+    from .tasks import send_sms_bulk
+
+    send_sms_bulk.apply_async((messages,), retry=True, retry_policy={
+        'max_retries': 3,
+        'interval_start': 0,
+        'interval_step': 0.2,
+        'interval_max': 1,
+    })
+
+
+# Пакеты, переданные буфером воркеру из процесса приложения.
+queue_metrics = SmsMetrics()
+
+_batcher = None
+_batcher_lock = threading.Lock()
+
+
+def get_sms_batcher():
+    """Возвращает буфер sms текущего процесса. При завершении процесса
+    буфер отправляется, чтобы не потерять сообщения."""
+    global _batcher
+    with _batcher_lock:
+        if _batcher is None:
+            _batcher = SmsBatcher(
+                dispatch_to_worker,
+                max_size=settings.SMS_BATCH_SIZE,
+                window=settings.SMS_BATCH_WINDOW,
+                metrics=queue_metrics,
+            )
+            atexit.register(_batcher.close)
+        return _batcher
@@ -1,7 +1,34 @@
+from django.conf import settings
+
 from referral_app.celery import app
+from users.models import InviteCode
+from users.sms import SmsMetrics, get_sms_provider
+
+# Пакеты, отправленные провайдеру из процесса, где выполняется задача.
+delivery_metrics = SmsMetrics()
+
+
+@app.task
+def send_sms_bulk(messages):
+    """Задача отправляет пакет sms одним обращением к провайдеру."""
+    sent = get_sms_provider().send_bulk(messages)
+    delivery_metrics.observe_batch(messages)
+    return sent
 
 
 @app.task
-def send_sms(phone, code):
-    """Задача имитирует отправку sms с кодом верификации."""
-    return f'Код верификации {code}, номер телефона {phone}'
+def refill_invite_code_pool():
+    """Задача пополняет пул свободных инвайт-кодов до размера
+    INVITE_CODE_POOL_SIZE. Если порция не добавила ни одного кода
+    (все сгенерированные коды уже заняты), задача завершается
+    и догоняет пул при следующем запуске."""
+    free = InviteCode.objects.filter(is_used=False).count()
+    added = 0
+    while free + added < settings.INVITE_CODE_POOL_SIZE:
+        batch = min(settings.INVITE_CODE_POOL_BATCH,
+                    settings.INVITE_CODE_POOL_SIZE - free - added)
+        batch_added = InviteCode.objects.refill(batch)
+        if not batch_added:
+            break
+        added += batch_added
+    return added
@@ -0,0 +1,86 @@
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.db import connection
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from rest_framework.authtoken.models import Token
+
+from api.authentication import token_cache
+from users.admin import EstimatedCountPaginator, phone_range
+
+User = get_user_model()
+
+
+class UserAdminTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.admin = User.objects.create_superuser(
+            phone=79990000000, password='password')
+        self.user_one = User.objects.create_user(
+            phone=79161234567, invite_code='AAa111')
+        self.user_two = User.objects.create_user(
+            phone=79261234567, invite_code='AAa112')
+        self.client.force_login(self.admin)
+        self.url = reverse('admin:users_user_changelist')
+
+    def changelist_ids(self, **params):
+        response = self.client.get(self.url, params)
+        self.assertEqual(response.status_code, 200)
+        return sorted(user.id for user
+                      in response.context['cl'].result_list)
+
+    def test_phone_range_covers_prefix(self):
+        """Проверяем, что префикс телефона превращается в диапазон."""
+        self.assertEqual(phone_range('7916'), (79160000000, 79169999999))
+
+    def test_changelist_does_not_load_all_phones(self):
+        """Проверяем, что список пользователей не выбирает все номера
+        телефонов для боковой панели фильтров."""
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get(self.url)
+        self.assertFalse([query for query in queries
+                          if 'DISTINCT' in query['sql']])
+
+    def test_phone_filters(self):
+        """Проверяем фильтры по префиксу и диапазону телефонов."""
+        self.assertEqual(self.changelist_ids(phone_prefix='7916'),
+                         [self.user_one.id])
+        self.assertEqual(
+            self.changelist_ids(phone_from=79200000000,
+                                phone_to=79300000000),
+            [self.user_two.id])
+        response = self.client.get(self.url, {'phone_prefix': 'abc'})
+        self.assertEqual(response.status_code, 302)
+
+    def test_search_is_exact(self):
+        """Проверяем, что поиск ищет только точный телефон
+        или инвайт-код."""
+        self.assertEqual(self.changelist_ids(q='79161234567'),
+                         [self.user_one.id])
+        self.assertEqual(self.changelist_ids(q='AAa112'),
+                         [self.user_two.id])
+        self.assertEqual(self.changelist_ids(q='AAa'), [])
+
+    def test_deactivate_action_updates_in_one_query(self):
+        """Проверяем, что массовая деактивация изменяет пользователей
+        одним UPDATE и сбрасывает их токены в кэше авторизации."""
+        token = Token.objects.create(user=self.user_one)
+        token_cache.set(token.key, token)
+        with CaptureQueriesContext(connection) as queries:
+            self.client.post(self.url, {
+                'action': 'deactivate_users',
+                '_selected_action': [self.user_one.id, self.user_two.id],
+            })
+        self.assertEqual(len([query for query in queries
+                              if query['sql'].startswith('UPDATE')]), 1)
+        self.assertEqual(
+            User.objects.filter(is_active=False).count(), 2)
+        self.assertIsNone(token_cache.get(token.key))
+
+    def test_paginator_counts_small_tables_exactly(self):
+        """Проверяем, что без статистики PostgreSQL пагинатор считает
+        строки точно."""
+        paginator = EstimatedCountPaginator(User.objects.all(), 100)
+        self.assertEqual(paginator.count, 3)
@@ -1,9 +1,10 @@
-from datetime import datetime
-
+from django.conf import settings
 from django.contrib.auth import get_user_model
+from django.core.cache import cache
 from django.test import TestCase
 
 from users.auth import CustomAuthBackend
+from users.verification import get_code_store
 
 User = get_user_model()
 
@@ -11,17 +12,18 @@ User = get_user_model()
 class UserAuthTests(TestCase):
 
     def setUp(self):
+        cache.clear()
         self.backend = CustomAuthBackend()
         self.user_one = User.objects.create_user(
             phone=79998887760,
-            verification_code='2222',
-            verif_cutoff_timestamp=(datetime.utcnow().timestamp() - 60),
         )
         self.user_two = User.objects.create_user(
             phone=79998887761,
-            verification_code='2222',
-            verif_cutoff_timestamp=(datetime.utcnow().timestamp() + 60),
         )
+        self.code_one = get_code_store().issue(self.user_one.phone,
+                                               code='2222', ttl=0)
+        self.code_two = get_code_store().issue(self.user_two.phone,
+                                               code='2222', ttl=60)
 
     def test_custom_auth_backend_authenticates_correcttly(self):
         """Проверяем, что метод authenticate бэкенда корректно авторизует
@@ -31,7 +33,7 @@ class UserAuthTests(TestCase):
         request = MockRequest()
         data = {
             'phone': self.user_two.phone,
-            'verification_code': self.user_two.verification_code,
+            'verification_code': self.code_two,
         }
         user = self.backend.authenticate(request, **data)
         self.assertIsNotNone(user)
@@ -52,11 +54,11 @@ class UserAuthTests(TestCase):
                 'phone': self.user_two.phone,
             },
             {
-                'verification_code': self.user_two.verification_code
+                'verification_code': self.code_two
             },
             {
                 'phone': 79998887790,
-                'verification_code': self.user_two.verification_code
+                'verification_code': self.code_two
             },
             {
                 'phone': self.user_two.phone,
@@ -68,10 +70,20 @@ class UserAuthTests(TestCase):
             },
             {
                 'phone': self.user_one.phone,
-                'verification_code': self.user_one.verification_code
+                'verification_code': self.code_one
             },
         ]
         for data in invalid_data_list:
             with self.subTest(invalid_data=str(data)):
                 user = self.backend.authenticate(request, **data)
                 self.assertIsNone(user)
+
+    def test_custom_auth_backend_rejects_without_db_queries(self):
+        """Проверяем, что неверный код отклоняется без обращения к БД,
+        а после VERIF_MAX_ATTEMPTS попыток отклоняется и верный код."""
+        data = {'phone': self.user_two.phone, 'verification_code': '0000'}
+        with self.assertNumQueries(0):
+            for _ in range(settings.VERIF_MAX_ATTEMPTS):
+                self.assertIsNone(self.backend.authenticate(None, **data))
+        data['verification_code'] = self.code_two
+        self.assertIsNone(self.backend.authenticate(None, **data))
@@ -0,0 +1,211 @@
+import json
+import os
+import tempfile
+from io import StringIO
+
+from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from django.db import connection
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+
+from users.models import InviteCode
+from users.signals import users_bulk_updated
+
+User = get_user_model()
+
+
+class UserCommandsTests(TestCase):
+
+    def setUp(self):
+        self.user_one = User.objects.create_user(
+            phone=79998887760,
+            invite_code='AAa111',
+        )
+        self.user_two = User.objects.create_user(
+            phone=79998887761,
+            invite_code='AAa112',
+            granted_code='AAa111',
+        )
+        self.user_three = User.objects.create_user(
+            phone=79998887762,
+            granted_code='AAa111',
+        )
+
+    def test_rebuild_referral_counters_restores_counts(self):
+        """Проверяем, что команда rebuild_referral_counters пересчитывает
+        счетчики приглашенных по таблице пользователей."""
+        User.objects.update(applicants_count=7)
+        call_command('rebuild_referral_counters', batch_size=1,
+                     stdout=StringIO())
+        counts = dict(User.objects.values_list('id', 'applicants_count'))
+        self.assertEqual(counts, {
+            self.user_one.id: 2,
+            self.user_two.id: 0,
+            self.user_three.id: 0,
+        })
+
+    def test_export_referrals_streams_edges_as_csv(self):
+        """Проверяем, что команда export_referrals выгружает ребра
+        реферального графа в CSV в порядке id приглашенного."""
+        output = StringIO()
+        call_command('export_referrals', chunk_size=1, stdout=output)
+        self.assertEqual(output.getvalue().splitlines(), [
+            'inviter_id,invitee_id',
+            f'{self.user_one.id},{self.user_two.id}',
+            f'{self.user_one.id},{self.user_three.id}',
+        ])
+
+    def test_export_referrals_writes_column_chunks(self):
+        """Проверяем, что в формате columns каждая строка содержит
+        порцию ребер в виде колонок."""
+        descriptor, path = tempfile.mkstemp(suffix='.ndjson')
+        os.close(descriptor)
+        self.addCleanup(os.remove, path)
+        call_command('export_referrals', output=path, format='columns',
+                     chunk_size=1)
+        with open(path, encoding='utf-8') as file:
+            chunks = [json.loads(line) for line in file]
+        self.assertEqual(chunks, [
+            {'inviter_id': [self.user_one.id],
+             'invitee_id': [self.user_two.id]},
+            {'inviter_id': [self.user_one.id],
+             'invitee_id': [self.user_three.id]},
+        ])
+
+
+class ImportUsersCommandTests(TestCase):
+
+    def setUp(self):
+        self.existing = User.objects.create_user(
+            phone=79998887760,
+            first_name='Иван',
+        )
+
+    def write_file(self, suffix, content):
+        descriptor, path = tempfile.mkstemp(suffix=suffix)
+        with os.fdopen(descriptor, 'w', encoding='utf-8') as file:
+            file.write(content)
+        self.addCleanup(os.remove, path)
+        return path
+
+    def import_users(self, path, **options):
+        stdout = StringIO()
+        call_command('import_users', path, stdout=stdout,
+                     stderr=StringIO(), **options)
+        return stdout.getvalue()
+
+    def test_import_csv_creates_valid_users(self):
+        """Проверяем, что импорт из CSV создает пользователей пакетами
+        и пропускает строки с некорректным телефоном."""
+        path = self.write_file('.csv', (
+            'phone,first_name,last_name,email\n'
+            '79998887761,Петр,Петров,p@example.com\n'
+            '79998887762,,,\n'
+            '69998887763,Ошибка,,\n'
+            'text,Ошибка,,\n'
+            '79998887764,Анна,,\n'
+        ))
+        self.import_users(path, batch_size=2)
+        self.assertEqual(
+            sorted(User.objects.values_list('phone', flat=True)),
+            [79998887760, 79998887761, 79998887762, 79998887764])
+        user = User.objects.get(phone=79998887761)
+        self.assertEqual(user.first_name, 'Петр')
+        self.assertEqual(user.email, 'p@example.com')
+        self.assertFalse(user.has_usable_password())
+        self.assertIsNone(user.invite_code)
+
+    def test_import_ndjson_skips_or_updates_existing(self):
+        """Проверяем, что существующие телефоны по умолчанию
+        пропускаются, а с --on-conflict update - обновляются."""
+        rows = [
+            {'phone': self.existing.phone, 'first_name': 'Новое имя'},
+            {'phone': 79998887761, 'first_name': 'Петр'},
+        ]
+        path = self.write_file(
+            '.ndjson', '\n'.join(json.dumps(row) for row in rows) + '\nbad\n')
+        self.import_users(path)
+        self.existing.refresh_from_db()
+        self.assertEqual(self.existing.first_name, 'Иван')
+        self.assertEqual(User.objects.count(), 2)
+
+        self.import_users(path, on_conflict='update')
+        self.existing.refresh_from_db()
+        self.assertEqual(self.existing.first_name, 'Новое имя')
+        self.assertEqual(User.objects.count(), 2)
+
+    def test_import_update_reports_updated_users(self):
+        """Проверяем, что при --on-conflict update обновленные
+        пользователи передаются в users_bulk_updated для сброса кэша,
+        а новые - нет."""
+        updates = []
+
+        def receiver(sender, user_ids, fields, using, **kwargs):
+            updates.append((user_ids, fields, using))
+
+        users_bulk_updated.connect(receiver)
+        self.addCleanup(users_bulk_updated.disconnect, receiver)
+        path = self.write_file('.csv', 'phone,first_name\n'
+                               f'{self.existing.phone},Новое имя\n'
+                               '79998887761,Петр\n')
+        self.import_users(path, on_conflict='update')
+        self.assertEqual(updates, [
+            ([self.existing.id], ('first_name', 'last_name', 'email'),
+             'default'),
+        ])
+        self.import_users(path)
+        self.assertEqual(len(updates), 1)
+
+    def test_import_rejects_non_integer_phones(self):
+        """Проверяем, что номера из NDJSON с дробной частью
+        и логические значения не принимаются за телефон."""
+        rows = [
+            {'phone': 79998887761.0},
+            {'phone': 7.9998887762e10},
+            {'phone': 79998887763.5},
+            {'phone': True},
+            {'phone': '79998887764'},
+            {'phone': 79998887765},
+        ]
+        path = self.write_file(
+            '.ndjson', '\n'.join(json.dumps(row) for row in rows))
+        output = self.import_users(path)
+        self.assertIn('пропущено некорректных строк: 4', output)
+        self.assertEqual(
+            sorted(User.objects.values_list('phone', flat=True)),
+            [79998887760, 79998887764, 79998887765])
+
+    def test_import_assigns_invite_codes_from_pool(self):
+        """Проверяем, что с --assign-invite-codes новые пользователи
+        получают разные коды из пула."""
+        path = self.write_file('.csv', 'phone\n' + '\n'.join(
+            str(79998887770 + idx) for idx in range(5)))
+        self.import_users(path, assign_invite_codes=True, batch_size=3)
+        codes = list(User.objects
+                     .filter(phone__gte=79998887770)
+                     .values_list('invite_code', flat=True))
+        self.assertEqual(len(codes), 5)
+        self.assertEqual(len(set(codes)), 5)
+        self.assertEqual(
+            InviteCode.objects.filter(code__in=codes, is_used=True).count(),
+            5)
+
+    def test_import_claims_codes_only_for_new_users(self):
+        """Проверяем, что коды из пула забираются только для
+        действительно созданных пользователей, а итог считается без
+        подсчета всей таблицы."""
+        path = self.write_file('.csv', 'phone\n{}\n79998887771\n'.format(
+            self.existing.phone))
+        InviteCode.objects.refill(10)
+        with CaptureQueriesContext(connection) as queries:
+            output = self.import_users(path, assign_invite_codes=True,
+                                       on_conflict='update')
+        self.assertIn('создано пользователей: 1,', output)
+        self.assertEqual(InviteCode.objects.filter(is_used=True).count(), 1)
+        self.existing.refresh_from_db()
+        self.assertIsNone(self.existing.invite_code)
+        self.assertIsNotNone(
+            User.objects.get(phone=79998887771).invite_code)
+        self.assertFalse(any('COUNT(' in query['sql']
+                             for query in queries.captured_queries))
@@ -1,34 +1,38 @@
-from datetime import datetime
+from unittest import mock
 
 from django.contrib.auth import get_user_model
-from django.test import TestCase
+from django.core.cache import cache
+from django.db import connection
+from django.db.models.signals import post_save
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
 from django.utils.translation import gettext_lazy as _
 
+from users.models import InviteCode, InviteCodePoolExhausted
+from users.verification import get_code_store
+
 User = get_user_model()
 
 
 class UserModelsTests(TestCase):
 
     def setUp(self):
+        cache.clear()
         self.user_one = User.objects.create_user(
             phone=79998887760,
-            verification_code='2222',
-            verif_cutoff_timestamp=(datetime.utcnow().timestamp() - 60),
         )
         self.user_two = User.objects.create_user(
             phone=79998887761,
             invite_code='AAa111',
-            verification_code='2222',
-            verif_cutoff_timestamp=(datetime.utcnow().timestamp() + 60),
         )
+        get_code_store().issue(self.user_one.phone, code='2222', ttl=0)
+        get_code_store().issue(self.user_two.phone, code='2222', ttl=60)
 
     def test_verbose_name(self):
         """Проверяем, что verbose_name в полях совпадает с ожидаемым."""
         field_verboses = [
             (self.user_one, 'phone', 'Номер телефона'),
             (self.user_one, 'email', _('email address')),
-            (self.user_one, 'verification_code', 'Код верификации'),
-            (self.user_one, 'verif_cutoff_timestamp', 'Срок действия кода'),
             (self.user_one, 'invite_code', 'Инвайт-код'),
             (self.user_one, 'granted_code', 'Полученный инвайт-код'),
         ]
@@ -60,6 +64,20 @@ class UserModelsTests(TestCase):
         self.user_one.create_invite_code()
         self.assertTrue(self.user_one.invite_code)
 
+    def test_user_create_invite_code_updates_only_invite_code(self):
+        """Проверяем, что метод create_invite_code берет код из пула
+        и записывает в строку пользователя только колонку invite_code."""
+        InviteCode.objects.refill(5)
+        with CaptureQueriesContext(connection) as queries:
+            self.user_one.create_invite_code()
+        updates = [query['sql'] for query in queries.captured_queries
+                   if query['sql'].startswith('UPDATE "users_user"')]
+        self.assertEqual(len(updates), 1)
+        self.assertIn('SET "invite_code"', updates[0])
+        self.assertNotIn('"password"', updates[0])
+        self.assertTrue(InviteCode.objects.get(
+            code=self.user_one.invite_code).is_used)
+
     def test_user_create_invite_code_saves_only_once(self):
         """Проверяем, что метод create_invite_code создает только один раз."""
         self.assertTrue(self.user_two.invite_code)
@@ -67,3 +85,203 @@ class UserModelsTests(TestCase):
         self.user_two.create_invite_code()
         invite_code_after = User.objects.get(id=self.user_two.id).invite_code
         self.assertEqual(invite_code_before, invite_code_after)
+
+    def test_create_user_without_password_skips_hashing(self):
+        """Проверяем, что при регистрации по телефону без пароля
+        хэширующая функция не вызывается, а пароль помечается
+        как неиспользуемый."""
+        with mock.patch('django.contrib.auth.hashers.get_hasher') as hasher:
+            user = User.objects.create_user(phone=79998887762)
+        hasher.assert_not_called()
+        self.assertFalse(user.has_usable_password())
+        self.assertFalse(
+            User.objects.get(id=user.id).has_usable_password())
+
+    def test_create_user_with_password_hashes_it(self):
+        """Проверяем, что явно переданный пароль хэшируется."""
+        user = User.objects.create_user(
+            phone=79998887763,
+            password='Str0ng-passw0rd',
+        )
+        self.assertTrue(user.has_usable_password())
+        self.assertTrue(user.check_password('Str0ng-passw0rd'))
+
+    def test_create_user_with_granted_code_sets_inviter(self):
+        """Проверяем, что при создании пользователя с полученным
+        инвайт-кодом заполняется ссылка на пригласившего."""
+        user = User.objects.create_user(
+            phone=79998887764,
+            granted_code=self.user_two.invite_code,
+        )
+        self.assertEqual(user.inviter, self.user_two)
+        self.assertEqual(list(self.user_two.applicants.all()), [user])
+
+    def test_register_does_not_write_existing_user(self):
+        """Проверяем, что регистрация нового номера - один запрос
+        к БД, а повторная регистрация существующего номера не пишет
+        в его строку (INSERT ... DO NOTHING и SELECT) и не меняет
+        данные пользователя."""
+        with self.assertNumQueries(1):
+            user = User.objects.register(79998887765)
+        self.assertIsNotNone(user.id)
+        self.assertFalse(user.has_usable_password())
+        self.assertIsNotNone(user.date_joined.tzinfo)
+        User.objects.filter(id=user.id).update(first_name='Иван')
+        with CaptureQueriesContext(connection) as queries:
+            again = User.objects.register(79998887765)
+        self.assertEqual(len(queries), 2)
+        self.assertIn('DO NOTHING', queries[0]['sql'])
+        self.assertNotIn('UPDATE', queries[0]['sql'])
+        self.assertEqual(again.id, user.id)
+        self.assertEqual(again.first_name, 'Иван')
+        self.assertEqual(again.password, user.password)
+        self.assertEqual(User.objects.filter(phone=79998887765).count(), 1)
+
+    def test_register_sends_post_save_for_new_user(self):
+        """Проверяем, что post_save отправляется только при создании
+        пользователя."""
+        handler = mock.Mock()
+        post_save.connect(handler, sender=User)
+        self.addCleanup(post_save.disconnect, handler, sender=User)
+        user = User.objects.register(79998887765)
+        User.objects.register(79998887765)
+        handler.assert_called_once()
+        self.assertEqual(handler.call_args.kwargs['instance'], user)
+        self.assertTrue(handler.call_args.kwargs['created'])
+
+    def test_register_falls_back_without_upsert_support(self):
+        """Проверяем, что без поддержки ON CONFLICT ... RETURNING
+        регистрация работает через INSERT с обработкой ошибки."""
+        with mock.patch.object(connection.features,
+                               'can_return_columns_from_insert', False):
+            user = User.objects.register(79998887765)
+            again = User.objects.register(79998887765)
+        self.assertEqual(again.id, user.id)
+
+    def test_save_updates_only_changed_columns(self):
+        """Проверяем, что save() без update_fields записывает только
+        измененные колонки, а без изменений не обращается к БД."""
+        user = User.objects.get(id=self.user_one.id)
+        self.assertEqual(user.get_dirty_fields(), [])
+        user.first_name = 'Иван'
+        user.email = 'ivan@example.com'
+        self.assertEqual(user.get_dirty_fields(), ['first_name', 'email'])
+        with CaptureQueriesContext(connection) as queries:
+            user.save()
+        self.assertEqual(len(queries), 1)
+        sql = queries[0]['sql']
+        self.assertTrue(sql.startswith('UPDATE'))
+        set_clause = sql.split(' SET ')[1].split(' WHERE ')[0]
+        self.assertEqual(set_clause.count('='), 2)
+        self.assertIn('"first_name"', set_clause)
+        self.assertIn('"email"', set_clause)
+        self.assertNotIn('"password"', set_clause)
+        with self.assertNumQueries(0):
+            user.save()
+        user.refresh_from_db()
+        self.assertEqual(user.first_name, 'Иван')
+        self.assertEqual(user.get_dirty_fields(), [])
+
+    def test_deferred_field_is_saved_only_when_changed(self):
+        """Проверяем, что отложенные поля учитываются, только если
+        их изменили."""
+        user = User.objects.only('id', 'phone').get(id=self.user_one.id)
+        with self.assertNumQueries(0):
+            user.save()
+        user.last_name = 'Петров'
+        self.assertEqual(user.get_dirty_fields(), ['last_name'])
+        self.assertIsNone(User(phone=79998887799).get_dirty_fields())
+
+    def test_save_copy_with_reset_pk_inserts_all_fields(self):
+        """Проверяем, что копия загруженного пользователя с pk=None
+        сохраняется новой строкой со всеми полями."""
+        user = User.objects.get(id=self.user_one.id)
+        user.pk = None
+        user.phone = 79998887799
+        user.invite_code = None
+        user.save()
+        self.assertNotEqual(user.pk, self.user_one.pk)
+        copy = User.objects.get(pk=user.pk)
+        self.assertEqual(copy.phone, 79998887799)
+        self.assertEqual(copy.password, self.user_one.password)
+        self.assertEqual(copy.date_joined, self.user_one.date_joined)
+        self.assertEqual(copy.get_dirty_fields(), [])
+
+    def test_with_applicants_prefetches_in_one_query(self):
+        """Проверяем, что with_applicants подгружает применивших
+        инвайт-код для всей выборки одним дополнительным запросом."""
+        inviters = [self.user_two]
+        for idx in range(3):
+            inviters.append(User.objects.create_user(
+                phone=79998887770 + idx,
+                invite_code=f'BBb11{idx}',
+            ))
+        for idx, inviter in enumerate(inviters):
+            for jdx in range(idx + 1):
+                User.objects.create_user(
+                    phone=79998887800 + idx * 10 + jdx,
+                    granted_code=inviter.invite_code,
+                )
+        with self.assertNumQueries(2):
+            users = list(User.objects.with_applicants(limit=2)
+                         .filter(id__in=[user.id for user in inviters])
+                         .order_by('id'))
+            counts = [len(user.first_applicants) for user in users]
+        self.assertEqual(counts, [1, 2, 2, 2])
+
+
+class InviteCodeModelsTests(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user(
+            phone=79998887760,
+            invite_code='AAa111',
+        )
+
+    def test_refill_adds_unique_free_codes(self):
+        """Проверяем, что refill добавляет в пул свободные коды."""
+        added = InviteCode.objects.refill(50)
+        self.assertGreater(added, 0)
+        self.assertEqual(InviteCode.objects.filter(is_used=False).count(),
+                         added)
+
+    @override_settings(INVITE_CODE_POOL_BATCH=3)
+    def test_claim_refills_empty_pool(self):
+        """Проверяем, что claim пополняет пустой пул и не выдает
+        один код дважды."""
+        codes = {InviteCode.objects.claim() for _ in range(10)}
+        self.assertEqual(len(codes), 10)
+        self.assertEqual(
+            InviteCode.objects.filter(code__in=codes, is_used=True).count(),
+            10)
+
+    def test_refill_skips_codes_of_users(self):
+        """Проверяем, что refill не добавляет в пул коды, которые уже
+        выданы пользователям."""
+        with mock.patch('users.models.generate_sequences',
+                        return_value=['AAa111', 'BBb222']):
+            InviteCode.objects.refill(2)
+        self.assertEqual(
+            list(InviteCode.objects.values_list('code', flat=True)),
+            ['BBb222'])
+
+    def test_refill_counts_only_inserted_codes(self):
+        """Проверяем, что refill возвращает количество добавленных
+        кодов, а не разницу размеров пула."""
+        InviteCode.objects.create(code='BBb222')
+        with mock.patch('users.models.generate_sequences',
+                        return_value=['BBb222', 'CCc333']):
+            self.assertEqual(InviteCode.objects.refill(2), 1)
+        with mock.patch('users.models.generate_sequences',
+                        return_value=['AAa111', 'BBb222']):
+            self.assertEqual(InviteCode.objects.refill(2), 0)
+
+    @override_settings(INVITE_CODE_REFILL_ATTEMPTS=3)
+    def test_claim_fails_when_refill_adds_nothing(self):
+        """Проверяем, что claim не зацикливается, если пул не удается
+        пополнить."""
+        with mock.patch.object(InviteCode.objects, 'refill',
+                               return_value=0) as refill:
+            with self.assertRaises(InviteCodePoolExhausted):
+                InviteCode.objects.claim()
+        self.assertEqual(refill.call_count, 3)
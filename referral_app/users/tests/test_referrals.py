@@ -0,0 +1,57 @@
+from django.contrib.auth import get_user_model
+from django.test import TestCase
+
+from users.referrals import referral_level_counts, referral_level_members
+
+User = get_user_model()
+
+
+class ReferralTreeTests(TestCase):
+
+    def setUp(self):
+        # root -> (child_one, child_two), child_one -> grandchild.
+        self.root = User.objects.create_user(phone=79998887760)
+        self.child_one = User.objects.create_user(
+            phone=79998887761, inviter=self.root)
+        self.child_two = User.objects.create_user(
+            phone=79998887762, inviter=self.root)
+        self.grandchild = User.objects.create_user(
+            phone=79998887763, inviter=self.child_one)
+
+    def test_level_counts_in_one_query(self):
+        """Проверяем, что количество приглашенных по уровням
+        считается одним запросом."""
+        with self.assertNumQueries(1):
+            levels = referral_level_counts(self.root.id, 10)
+        self.assertEqual(levels, [(1, 2), (2, 1)])
+        self.assertEqual(referral_level_counts(self.grandchild.id, 10), [])
+
+    def test_level_counts_are_limited_by_depth(self):
+        """Проверяем, что обход останавливается на максимальной
+        глубине."""
+        self.assertEqual(referral_level_counts(self.root.id, 1), [(1, 2)])
+
+    def test_cycle_members_are_counted_once(self):
+        """Проверяем, что при цикле в графе приглашений каждый
+        приглашенный учитывается один раз, а корень не попадает
+        в свое дерево."""
+        User.objects.filter(id=self.root.id).update(
+            inviter=self.grandchild)
+        self.assertEqual(referral_level_counts(self.root.id, 10),
+                         [(1, 2), (2, 1)])
+        self.assertEqual(referral_level_counts(self.child_one.id, 10),
+                         [(1, 1), (2, 1), (3, 1)])
+        self.assertFalse(referral_level_members(self.root.id, 3).exists())
+
+    def test_level_members_returns_users_of_level(self):
+        """Проверяем, что referral_level_members отдает пользователей
+        только заданного уровня."""
+        self.assertQuerySetEqual(
+            referral_level_members(self.root.id, 1).order_by('id'),
+            [self.child_one, self.child_two],
+        )
+        self.assertQuerySetEqual(
+            referral_level_members(self.root.id, 2),
+            [self.grandchild],
+        )
+        self.assertFalse(referral_level_members(self.root.id, 3).exists())
@@ -0,0 +1,224 @@
+from unittest import mock, skipUnless
+
+from django.conf import settings
+from django.contrib.auth import authenticate, get_user_model
+from django.core.cache import cache
+from django.core.exceptions import ImproperlyConfigured
+from django.db import connection
+from django.db.migrations.loader import MigrationLoader
+from django.test import SimpleTestCase, TestCase, override_settings
+
+from users.checks import check_user_shards
+from users.partitioning import (PartitionByPhoneRange,
+                                partition_table_statements,
+                                phone_prefix_ranges)
+from users.sharding import (get_user_shards, shard_for_phone,
+                            shards_for_phone_range)
+from users.verification import get_code_store
+
+User = get_user_model()
+
+SHARD = 'users_shard_1'
+SHARDS = [
+    (71000000000, 75999999999, 'default'),
+    (76000000000, 79999999999, SHARD),
+]
+# Вторая БД есть только в настройках referral_app.settings_shards.
+SHARDED = SHARD in settings.DATABASES
+
+
+class ShardMapTests(SimpleTestCase):
+
+    @override_settings(USER_SHARDS=[
+        (71000000000, 75999999999, 'default'),
+        (76000000000, 79999999999, 'default'),
+    ])
+    def test_shard_for_phone(self):
+        """Проверяем выбор БД по номеру, в том числе вне диапазонов."""
+        self.assertEqual(shard_for_phone(71000000000), 'default')
+        self.assertEqual(shard_for_phone('79998887760'), 'default')
+        self.assertEqual(shard_for_phone(80000000000), 'default')
+
+    @override_settings(USER_SHARDS=[
+        (71000000000, 72999999999, 'default'),
+        (75000000000, 79999999999, 'default'),
+    ])
+    def test_phone_range_merge(self):
+        """Проверяем, что части диапазона в одной БД объединяются,
+        включая номера вне диапазонов."""
+        self.assertEqual(shards_for_phone_range(72000000000, 76000000000),
+                         [(72000000000, 76000000000, 'default')])
+
+    def test_invalid_shards(self):
+        """Проверяем, что пересекающиеся диапазоны и неизвестная БД
+        считаются ошибкой настроек."""
+        invalid = [
+            [(71000000000, 75999999999, 'default'),
+             (75000000000, 79999999999, 'default')],
+            [(71000000000, 79999999999, 'missing')],
+        ]
+        for shards in invalid:
+            with self.subTest(shards=shards), \
+                    override_settings(USER_SHARDS=shards):
+                with self.assertRaises(ImproperlyConfigured):
+                    get_user_shards()
+                self.assertEqual(
+                    [error.id for error in check_user_shards(None)],
+                    ['users.E002'])
+
+    def test_check_rejects_other_databases(self):
+        """Проверяем, что пользователей нельзя разместить вне БД
+        default, пока поиск по id и связи работают только в ней."""
+        self.assertEqual(check_user_shards(None), [])
+        with mock.patch('users.checks.get_user_shards',
+                        return_value=SHARDS):
+            errors = check_user_shards(None)
+        self.assertEqual([error.id for error in errors], ['users.E003'])
+        self.assertIn(SHARD, errors[0].msg)
+
+
+@skipUnless(SHARDED, 'нужны настройки referral_app.settings_shards')
+@override_settings(USER_SHARDS=SHARDS)
+class PhoneShardRoutingTests(TestCase):
+    databases = {'default', SHARD} if SHARDED else {'default'}
+
+    def setUp(self):
+        cache.clear()
+
+    def test_register_routes_by_phone(self):
+        """Проверяем, что пользователь создается в БД своего
+        диапазона."""
+        near = User.objects.register(71234567890)
+        far = User.objects.register(79998887760)
+        self.assertEqual(near._state.db, 'default')
+        self.assertEqual(far._state.db, SHARD)
+        self.assertTrue(User.objects.using(SHARD)
+                        .filter(phone=79998887760).exists())
+        self.assertFalse(User.objects.filter(phone=79998887760).exists())
+        self.assertEqual(User.objects.register(79998887760).pk, far.pk)
+
+    def test_get_by_natural_key(self):
+        """Проверяем, что поиск по номеру идет в нужную БД."""
+        User.objects.register(79998887760)
+        with self.assertNumQueries(0, using='default'), \
+                self.assertNumQueries(1, using=SHARD):
+            user = User.objects.get_by_natural_key('79998887760')
+        self.assertEqual(user.phone, 79998887760)
+        with self.assertRaises(User.DoesNotExist):
+            User.objects.get_by_natural_key('not a phone')
+
+    def test_authenticate_user_from_shard(self):
+        """Проверяем вход по коду для пользователя из другой БД."""
+        User.objects.register(79998887760)
+        code = get_code_store().issue(79998887760)
+        user = authenticate(phone=79998887760, verification_code=code)
+        self.assertIsNotNone(user)
+        self.assertEqual(user._state.db, SHARD)
+
+    def test_save_stays_in_shard(self):
+        """Проверяем, что сохранение загруженного пользователя пишет
+        в его БД."""
+        user = User.objects.register(79998887760)
+        user.first_name = 'Jane'
+        user.save()
+        self.assertEqual(User.objects.for_phone(79998887760)
+                         .get(phone=79998887760).first_name, 'Jane')
+
+    def test_save_using_other_db_writes_all_fields(self):
+        """Проверяем, что сохранение в другую БД записывает все поля,
+        а не только измененные."""
+        user = User.objects.register(79998887760)
+        user.first_name = 'Jane'
+        user.save(using='default')
+        copy = User.objects.using('default').get(pk=user.pk)
+        self.assertEqual(copy.phone, 79998887760)
+        self.assertEqual(copy.first_name, 'Jane')
+        self.assertEqual(copy.password, user.password)
+
+    def test_phone_range_split(self):
+        """Проверяем разбиение диапазона номеров по БД."""
+        self.assertEqual(
+            shards_for_phone_range(72000000000, 76000000000),
+            [(72000000000, 75999999999, 'default'),
+             (76000000000, 76000000000, SHARD)],
+        )
+        self.assertEqual(
+            shards_for_phone_range(71000000000, 71000000005),
+            [(71000000000, 71000000005, 'default')],
+        )
+
+    def test_iter_phone_range(self):
+        """Проверяем выборку диапазона номеров из нескольких БД
+        в порядке номеров."""
+        phones = [79998887760, 71234567890, 76000000000, 75999999999]
+        for phone in phones:
+            User.objects.register(phone)
+        self.assertEqual(
+            [user.phone for user in User.objects.iter_phone_range(
+                71000000000, 79999999999)],
+            sorted(phones),
+        )
+        self.assertEqual(
+            [user.phone for user in User.objects.iter_phone_range(
+                75000000000, 76500000000)],
+            [75999999999, 76000000000],
+        )
+
+
+class PartitionByPhoneRangeTests(SimpleTestCase):
+    # Редактор схемы SQLite нельзя открыть внутри транзакции TestCase.
+    databases = {'default'}
+
+    def test_phone_prefix_ranges(self):
+        """Проверяем, что диапазоны по префиксам покрывают все номера
+        без пересечений."""
+        ranges = phone_prefix_ranges()
+        self.assertEqual(len(ranges), 9)
+        self.assertEqual(ranges[0], (71000000000, 71999999999))
+        self.assertEqual(ranges[-1], (79000000000, 79999999999))
+        for (_, last), (first, _) in zip(ranges, ranges[1:]):
+            self.assertEqual(first, last + 1)
+
+    def test_statements(self):
+        """Проверяем SQL секционирования таблицы пользователей."""
+        with connection.schema_editor(collect_sql=True) as schema_editor:
+            statements = partition_table_statements(
+                User, [(71000000000, 75999999999)], schema_editor)
+        sql = '\n'.join(statements)
+        self.assertIn('PARTITION BY RANGE ("phone")', sql)
+        self.assertIn('PRIMARY KEY ("id", "phone")', sql)
+        self.assertIn('FOR VALUES FROM (71000000000) TO (76000000000)', sql)
+        self.assertIn('PARTITION OF "users_user" DEFAULT', sql)
+        self.assertIn('users_user_leaderboard_idx', sql)
+        self.assertEqual(statements[-1],
+                         'DROP TABLE "users_user_unpartitioned"')
+
+    def test_operation_noop_without_postgresql(self):
+        """Проверяем, что на других СУБД операция ничего не делает."""
+        operation = PartitionByPhoneRange('user', phone_prefix_ranges())
+        self.assertFalse(operation.reversible)
+        name, args, kwargs = operation.deconstruct()
+        self.assertEqual(PartitionByPhoneRange(*args, **kwargs).ranges,
+                         operation.ranges)
+        if connection.vendor == 'postgresql':
+            return
+        with connection.schema_editor(collect_sql=True) as schema_editor:
+            operation.database_forwards('users', schema_editor, None, None)
+        self.assertEqual(schema_editor.collected_sql, [])
+
+    def test_state_drops_constraints(self):
+        """Проверяем, что состояние миграций отражает удаленные
+        ограничения: уникальность invite_code и внешние ключи на
+        пользователя."""
+        state = MigrationLoader(None).project_state()
+        operation = PartitionByPhoneRange('User', phone_prefix_ranges())
+        operation.state_forwards('users', state)
+        user = state.models[('users', 'user')]
+        self.assertFalse(user.fields['invite_code'].unique)
+        self.assertTrue(user.fields['invite_code'].db_index)
+        self.assertFalse(user.fields['inviter'].db_constraint)
+        token = state.models[('authtoken', 'token')]
+        self.assertFalse(token.fields['user'].db_constraint)
+        self.assertFalse(
+            state.apps.get_model('users', 'User')
+            ._meta.get_field('inviter').db_constraint)
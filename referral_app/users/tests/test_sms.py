@@ -0,0 +1,107 @@
+import time
+
+from django.test import TestCase, override_settings
+
+from users.sms import FakeSmsProvider, SmsBatcher
+from users.tasks import delivery_metrics, send_sms_bulk
+
+
+class SmsBatcherTests(TestCase):
+
+    def setUp(self):
+        self.batches = []
+        self.batcher = SmsBatcher(self.batches.append, max_size=3,
+                                  window=0.05)
+
+    def test_batch_is_sent_when_full(self):
+        """Проверяем, что заполненный буфер отправляется одним пакетом
+        сразу, без ожидания окна."""
+        for idx in range(3):
+            self.batcher.add(79998887760 + idx, f'Код {idx}')
+        self.assertEqual(len(self.batches), 1)
+        self.assertEqual([message['phone'] for message in self.batches[0]],
+                         [79998887760, 79998887761, 79998887762])
+        stats = self.batcher.metrics.stats()
+        self.assertEqual(stats['batches'], 1)
+        self.assertEqual(stats['max_batch_size'], 3)
+
+    def test_batch_is_sent_after_window(self):
+        """Проверяем, что неполный буфер отправляется по истечении
+        окна."""
+        self.batcher.add(79998887760, 'Код')
+        self.batcher.add(79998887761, 'Код')
+        self.assertEqual(self.batches, [])
+        deadline = time.monotonic() + 2
+        while not self.batches and time.monotonic() < deadline:
+            time.sleep(0.01)
+        self.assertEqual(len(self.batches), 1)
+        self.assertEqual(len(self.batches[0]), 2)
+        self.assertGreater(self.batcher.metrics.stats()['max_queue_latency'],
+                           0)
+
+    def flaky_batcher(self, failures, **kwargs):
+        """Буфер, у которого первые failures передач падают."""
+        attempts = []
+
+        def dispatch(messages):
+            attempts.append([message['phone'] for message in messages])
+            if len(attempts) <= failures:
+                raise ConnectionError
+            self.batches.append(messages)
+
+        batcher = SmsBatcher(dispatch, max_size=1, window=60, **kwargs)
+        self.addCleanup(batcher._take)
+        return batcher, attempts
+
+    def test_dispatch_error_requeues_batch(self):
+        """Проверяем, что ошибка передачи не прерывает запрос, а пакет
+        возвращается в буфер и уходит при следующей отправке."""
+        batcher, attempts = self.flaky_batcher(failures=1)
+        with self.assertLogs('users.sms', level='WARNING'):
+            batcher.add(79998887760, 'Код')
+        self.assertEqual(self.batches, [])
+        batcher.flush()
+        self.assertEqual(attempts, [[79998887760], [79998887760]])
+        self.assertEqual(len(self.batches), 1)
+
+    def test_message_is_dropped_after_max_attempts(self):
+        """Проверяем, что сообщение отбрасывается после max_attempts
+        неудачных попыток."""
+        batcher, attempts = self.flaky_batcher(failures=10, max_attempts=2)
+        with self.assertLogs('users.sms', level='WARNING'):
+            batcher.add(79998887760, 'Код')
+        with self.assertLogs('users.sms', level='ERROR'):
+            batcher.flush()
+        batcher.flush()
+        self.assertEqual(len(attempts), 2)
+        self.assertEqual(batcher._buffer, [])
+
+    def test_close_sends_buffer(self):
+        """Проверяем, что close отправляет буфер перед завершением
+        процесса, повторяя неудачные попытки."""
+        batcher, attempts = self.flaky_batcher(failures=1)
+        batcher.max_size = 10
+        batcher.add(79998887760, 'Код')
+        with self.assertLogs('users.sms', level='WARNING'):
+            batcher.close()
+        self.assertEqual(len(attempts), 2)
+        self.assertEqual(len(self.batches), 1)
+        self.assertIsNone(batcher._timer)
+
+
+class SmsTasksTests(TestCase):
+
+    @override_settings(SMS_PROVIDER='users.sms.FakeSmsProvider')
+    def test_send_sms_bulk_sends_batch_once(self):
+        """Проверяем, что задача отправляет пакет одним обращением
+        к провайдеру."""
+        FakeSmsProvider.outbox.clear()
+        messages = [
+            {'phone': 79998887760, 'text': 'Код 1', 'queued_at': time.time()},
+            {'phone': 79998887761, 'text': 'Код 2', 'queued_at': time.time()},
+        ]
+        batches_before = delivery_metrics.stats()['batches']
+        self.assertEqual(send_sms_bulk(messages), 2)
+        self.assertEqual(FakeSmsProvider.outbox, [messages])
+        self.assertEqual(delivery_metrics.stats()['batches'],
+                         batches_before + 1)
@@ -0,0 +1,27 @@
+from unittest import mock
+
+from django.test import TestCase, override_settings
+
+from users.models import InviteCode
+from users.tasks import refill_invite_code_pool
+
+
+class UserTasksTests(TestCase):
+
+    @override_settings(INVITE_CODE_POOL_SIZE=25, INVITE_CODE_POOL_BATCH=10)
+    def test_refill_invite_code_pool_fills_up_to_size(self):
+        """Проверяем, что задача пополняет пул до заданного размера
+        и не добавляет коды в полный пул."""
+        InviteCode.objects.refill(5)
+        refill_invite_code_pool()
+        self.assertEqual(InviteCode.objects.filter(is_used=False).count(), 25)
+        self.assertEqual(refill_invite_code_pool(), 0)
+
+    @override_settings(INVITE_CODE_POOL_SIZE=25, INVITE_CODE_POOL_BATCH=10)
+    def test_refill_invite_code_pool_stops_when_nothing_added(self):
+        """Проверяем, что задача завершается, если порция не добавила
+        ни одного кода."""
+        with mock.patch.object(InviteCode.objects, 'refill',
+                               return_value=0) as refill:
+            self.assertEqual(refill_invite_code_pool(), 0)
+        refill.assert_called_once_with(10)
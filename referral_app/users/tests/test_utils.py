@@ -1,6 +1,21 @@
+import asyncio
+import string
+import threading
+from collections import Counter
+from unittest import mock
+
 from django.test import TestCase
 
-from users.utils import generate_sequense
+from users.utils import (db_sync_to_async, generate_sequences,
+                         generate_sequense)
+
+
+def chi_square_threshold(degrees):
+    """Критическое значение хи-квадрат для уровня значимости 0.0001
+    (аппроксимация Уилсона-Хилферти)."""
+    z_score = 3.719
+    ratio = 2 / (9 * degrees)
+    return degrees * (1 - ratio + z_score * ratio ** 0.5) ** 3
 
 
 class UserUtilsTests(TestCase):
@@ -25,3 +40,48 @@ class UserUtilsTests(TestCase):
             sequence = generate_sequense(expected_length, digits_only=True)
             self.assertEqual(len(sequence), expected_length)
             self.assertTrue(sequence.isdigit())
+
+    def test_generate_sequences_returns_batch(self):
+        """Проверяем, что функция generate_sequences возвращает заданное
+        количество последовательностей заданной длины."""
+        for count, length, digits_only in [(1, 4, True), (1000, 6, False),
+                                           (10, 60, False), (0, 6, False)]:
+            with self.subTest(count=count, length=length):
+                sequences = generate_sequences(count, length, digits_only)
+                self.assertEqual(len(sequences), count)
+                for sequence in sequences:
+                    self.assertEqual(len(sequence), length)
+                    self.assertTrue(sequence.isalnum())
+                    if digits_only:
+                        self.assertTrue(sequence.isdigit())
+
+    def test_generate_sequences_symbols_are_uniform(self):
+        """Проверяем критерием хи-квадрат, что все символы алфавита
+        встречаются равновероятно."""
+        alphabets = [
+            (False, string.ascii_letters + string.digits),
+            (True, string.digits),
+        ]
+        for digits_only, alphabet in alphabets:
+            with self.subTest(digits_only=digits_only):
+                symbols = ''.join(generate_sequences(
+                    len(alphabet) * 500, 4, digits_only))
+                frequencies = Counter(symbols)
+                self.assertEqual(set(frequencies), set(alphabet))
+                expected = len(symbols) / len(alphabet)
+                statistic = sum(
+                    (frequencies[symbol] - expected) ** 2 / expected
+                    for symbol in alphabet)
+                self.assertLess(statistic,
+                                chi_square_threshold(len(alphabet) - 1))
+
+    async def test_db_sync_to_async_runs_calls_concurrently(self):
+        """Проверяем, что вызовы через db_sync_to_async выполняются
+        параллельно и закрывают устаревшие соединения."""
+        barrier = threading.Barrier(2, timeout=5)
+        with mock.patch('users.utils.close_old_connections') as close:
+            # При последовательном выполнении первый вызов не дождется
+            # второго на барьере.
+            await asyncio.gather(db_sync_to_async(barrier.wait)(),
+                                 db_sync_to_async(barrier.wait)())
+        self.assertEqual(close.call_count, 2)
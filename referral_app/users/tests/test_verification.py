@@ -0,0 +1,143 @@
+from unittest import mock
+
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.test import TestCase, override_settings
+
+from users.checks import check_code_store_is_shared
+from users.verification import CacheCodeStore, InMemoryCodeStore
+
+User = get_user_model()
+
+PHONE = 79998887760
+
+
+class CodeStoreTestsMixin:
+    """Общие проверки для всех реализаций хранилища кодов."""
+
+    def test_issue_returns_four_digit_code(self):
+        """Проверяем, что issue возвращает код из четырех цифр."""
+        code = self.store.issue(PHONE)
+        self.assertEqual(len(code), 4)
+        self.assertTrue(code.isdigit())
+
+    def test_check_accepts_code_only_once(self):
+        """Проверяем, что верный код принимается один раз."""
+        code = self.store.issue(PHONE)
+        self.assertTrue(self.store.check(PHONE, code))
+        self.assertFalse(self.store.check(PHONE, code))
+
+    def test_check_rejects_wrong_and_expired_codes(self):
+        """Проверяем, что неверный и истекший коды не принимаются."""
+        self.store.issue(PHONE, code='1111')
+        self.assertFalse(self.store.check(PHONE, '2222'))
+        self.assertFalse(self.store.check(PHONE + 1, '1111'))
+        self.store.issue(PHONE, code='1111', ttl=0)
+        self.assertFalse(self.store.check(PHONE, '1111'))
+
+    @override_settings(VERIF_MAX_ATTEMPTS=3)
+    def test_code_is_dropped_after_max_attempts(self):
+        """Проверяем, что после VERIF_MAX_ATTEMPTS неверных попыток
+        код сбрасывается."""
+        self.store.issue(PHONE, code='1111')
+        for _ in range(3):
+            self.assertFalse(self.store.check(PHONE, '0000'))
+        self.assertFalse(self.store.check(PHONE, '1111'))
+
+    @override_settings(VERIF_MAX_ATTEMPTS=3)
+    def test_parallel_guesses_are_limited(self):
+        """Проверяем, что параллельные попытки, прочитавшие код и
+        блокировку до записи блокировки, сравнивают код не больше
+        VERIF_MAX_ATTEMPTS раз."""
+        self.store.issue(PHONE, code='0015')
+        # Блокировка и сброс кода еще не записаны ни одним из запросов.
+        with mock.patch.object(self.store, 'is_locked', return_value=False), \
+                mock.patch.object(self.store, 'set'), \
+                mock.patch.object(self.store, 'delete', return_value=True):
+            results = [self.store.check(PHONE, f'{guess:04d}')
+                       for guess in range(20)]
+        self.assertNotIn(True, results)
+
+    @override_settings(VERIF_MAX_ATTEMPTS=3)
+    def test_new_code_does_not_reset_attempts(self):
+        """Проверяем, что новый код не сбрасывает счетчик попыток,
+        а после VERIF_MAX_ATTEMPTS попыток телефон блокируется: новые
+        коды не выдаются."""
+        self.store.issue(PHONE, code='1111')
+        for _ in range(2):
+            self.store.check(PHONE, '0000')
+        self.store.issue(PHONE, code='2222')
+        self.assertFalse(self.store.check(PHONE, '0000'))
+        self.assertTrue(self.store.is_locked(PHONE))
+        self.assertIsNone(self.store.issue(PHONE, code='3333'))
+        self.assertFalse(self.store.check(PHONE, '3333'))
+        self.assertFalse(self.store.is_locked(PHONE + 1))
+
+    @override_settings(VERIF_MAX_ATTEMPTS=3, VERIF_LOCKOUT_TIME=0)
+    def test_lockout_expires(self):
+        """Проверяем, что блокировка снимается через
+        VERIF_LOCKOUT_TIME секунд."""
+        self.store.issue(PHONE, code='1111')
+        for _ in range(3):
+            self.store.check(PHONE, '0000')
+        self.assertFalse(self.store.is_locked(PHONE))
+        self.store.issue(PHONE, code='2222')
+        self.assertTrue(self.store.check(PHONE, '2222'))
+
+    @override_settings(VERIF_MAX_ATTEMPTS=3)
+    def test_correct_code_resets_attempts(self):
+        """Проверяем, что верный код сбрасывает счетчик попыток."""
+        self.store.issue(PHONE, code='1111')
+        for _ in range(2):
+            self.store.check(PHONE, '0000')
+        self.assertTrue(self.store.check(PHONE, '1111'))
+        self.store.issue(PHONE, code='2222')
+        for _ in range(2):
+            self.store.check(PHONE, '0000')
+        self.assertTrue(self.store.check(PHONE, '2222'))
+
+
+class InMemoryCodeStoreTests(CodeStoreTestsMixin, TestCase):
+
+    def setUp(self):
+        self.store = InMemoryCodeStore()
+
+
+class CacheCodeStoreTests(CodeStoreTestsMixin, TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.store = CacheCodeStore()
+
+    def test_check_code_does_not_touch_users_table(self):
+        """Проверяем, что проверка кода пользователя не обращается
+        к БД."""
+        user = User.objects.create_user(phone=PHONE)
+        code = self.store.issue(PHONE)
+        with self.assertNumQueries(0):
+            self.assertTrue(user.check_code(code))
+
+
+class CodeStoreCheckTests(TestCase):
+
+    def test_process_local_store_is_deploy_error(self):
+        """Проверяем, что хранилище кодов в памяти процесса считается
+        ошибкой развертывания, а общий кэш - нет."""
+        redis = {'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': 'redis://localhost:6379/0',
+        }}
+        cases = [
+            ('users.verification.CacheCodeStore', None, ['users.E001']),
+            ('users.verification.InMemoryCodeStore', None, ['users.E001']),
+            ('users.verification.CacheCodeStore', redis, []),
+        ]
+        for store, caches, expected in cases:
+            overrides = {'VERIFICATION_CODE_STORE': store}
+            if caches:
+                overrides['CACHES'] = caches
+            with self.subTest(store=store, caches=bool(caches)), \
+                    override_settings(**overrides):
+                self.assertEqual(
+                    [error.id for error in check_code_store_is_shared(None)],
+                    expected)
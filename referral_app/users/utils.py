@@ -1,12 +1,62 @@
-import random
+import functools
+import os
 import string
 
+from asgiref.sync import sync_to_async
+from django.db import close_old_connections
+
+LETTERS_AND_DIGITS = string.ascii_letters + string.digits
+
+
+def _make_translation(symbols):
+    """Готовит таблицу перевода случайного байта в символ алфавита
+    и набор байтов, которые нужно отбросить. Отбрасываются байты
+    за пределами диапазона, кратного размеру алфавита, - так все
+    символы равновероятны."""
+    alphabet_size = len(symbols)
+    limit = 256 - 256 % alphabet_size
+    table = bytes(ord(symbols[byte % alphabet_size]) for byte in range(256))
+    return table, bytes(range(limit, 256)), limit
+
+
+TRANSLATIONS = {
+    False: _make_translation(LETTERS_AND_DIGITS),
+    True: _make_translation(string.digits),
+}
+
+
+def generate_sequences(count, length, digits_only=False):
+    """Функция для генерации count случайных последовательностей букв
+    и цифр длины length за один вызов. Случайные байты берутся из
+    os.urandom одним блоком и переводятся в символы через
+    bytes.translate."""
+    table, rejected, limit = TRANSLATIONS[bool(digits_only)]
+    needed = count * length
+    result = b''
+    while len(result) < needed:
+        missing = needed - len(result)
+        chunk = os.urandom(missing * 256 // limit + 16)
+        result += chunk.translate(table, rejected)
+    result = result[:needed].decode('ascii')
+    return [result[idx:idx + length] for idx in range(0, needed, length)]
+
 
 def generate_sequense(length, digits_only=False):
     """Функция для генерации случайной последовательности букв и цифр."""
-    if digits_only:
-        symbols = string.digits
-    else:
-        symbols = string.ascii_letters + string.digits
-    result = [random.sample(symbols, 1)[0] for _ in range(length)]
-    return ''.join(result)
+    return generate_sequences(1, length, digits_only=digits_only)[0]
+
+
+def db_sync_to_async(func):
+    """sync_to_async для коротких обращений к БД из асинхронного кода.
+    Функция выполняется в пуле потоков (thread_sensitive=False), поэтому
+    обращения разных запросов идут параллельно, а не по очереди
+    в одном потоке. Потоки пула не получают сигналов начала и конца
+    запроса, поэтому после вызова соединение потока закрывается, если
+    истек его CONN_MAX_AGE или оно сломано."""
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        try:
+            return func(*args, **kwargs)
+        finally:
+            close_old_connections()
+    return sync_to_async(wrapper, thread_sensitive=False)
@@ -0,0 +1,166 @@
+import threading
+import time
+from functools import lru_cache
+
+from django.conf import settings
+from django.core.cache import caches
+from django.utils.module_loading import import_string
+
+from .utils import generate_sequense
+
+
+class BaseCodeStore:
+    """Базовый класс хранилища кодов верификации. Код хранится
+    отдельно от строки пользователя, истекает через VERIF_TIME секунд
+    и может быть использован только один раз. Неверные попытки
+    считаются по номеру телефона: после VERIF_MAX_ATTEMPTS попыток код
+    сбрасывается, а телефон блокируется на VERIF_LOCKOUT_TIME секунд -
+    новые коды не выдаются и не проверяются. Новый код счетчик
+    попыток не сбрасывает.
+
+    Наследники реализуют примитивы get, set, delete и incr."""
+
+    code_prefix = 'verif-code'
+    attempts_prefix = 'verif-attempts'
+    lock_prefix = 'verif-lock'
+
+    def get(self, key):
+        raise NotImplementedError
+
+    def set(self, key, value, ttl):
+        raise NotImplementedError
+
+    def delete(self, key):
+        """Удаляет ключ. Возвращает True, если ключ был удален этим
+        вызовом."""
+        raise NotImplementedError
+
+    def incr(self, key, ttl):
+        """Атомарно увеличивает счетчик и возвращает новое значение."""
+        raise NotImplementedError
+
+    def code_key(self, phone):
+        return f'{self.code_prefix}:{phone}'
+
+    def attempts_key(self, phone):
+        return f'{self.attempts_prefix}:{phone}'
+
+    def lock_key(self, phone):
+        return f'{self.lock_prefix}:{phone}'
+
+    def is_locked(self, phone):
+        return self.get(self.lock_key(phone)) is not None
+
+    def issue(self, phone, code=None, ttl=None):
+        """Создает код верификации для телефона и возвращает его.
+        Предыдущий код сбрасывается. Для заблокированного телефона
+        код не создается и возвращается None."""
+        if self.is_locked(phone):
+            return None
+        if code is None:
+            code = generate_sequense(4, digits_only=True)
+        if ttl is None:
+            ttl = settings.VERIF_TIME
+        self.set(self.code_key(phone), code, ttl)
+        return code
+
+    def check(self, phone, code):
+        """Проверяет код. Попытка учитывается до сравнения кода одним
+        атомарным incr, поэтому параллельные запросы не могут сделать
+        больше VERIF_MAX_ATTEMPTS сравнений. Верный код удаляется из
+        хранилища и сбрасывает счетчик. Стоимость проверки не зависит
+        от числа попыток: несколько операций с хранилищем и ни одного
+        запроса к БД."""
+        code_key = self.code_key(phone)
+        stored_code = self.get(code_key)
+        if stored_code is None or self.is_locked(phone):
+            return False
+        attempts = self.incr(self.attempts_key(phone),
+                             settings.VERIF_LOCKOUT_TIME)
+        if attempts > settings.VERIF_MAX_ATTEMPTS or str(code) != stored_code:
+            if attempts >= settings.VERIF_MAX_ATTEMPTS:
+                self.set(self.lock_key(phone), 1,
+                         settings.VERIF_LOCKOUT_TIME)
+                self.delete(code_key)
+            return False
+        self.delete(self.attempts_key(phone))
+        return self.delete(code_key)
+
+
+class InMemoryCodeStore(BaseCodeStore):
+    """Хранилище кодов в памяти процесса. Подходит для тестов
+    и запуска в одном процессе."""
+
+    def __init__(self):
+        self._data = {}
+        self._lock = threading.Lock()
+
+    def _get_alive(self, key):
+        item = self._data.get(key)
+        if item is None:
+            return None
+        value, expires = item
+        if expires <= time.monotonic():
+            del self._data[key]
+            return None
+        return value
+
+    def get(self, key):
+        with self._lock:
+            return self._get_alive(key)
+
+    def set(self, key, value, ttl):
+        with self._lock:
+            self._data[key] = (value, time.monotonic() + ttl)
+
+    def delete(self, key):
+        with self._lock:
+            return self._data.pop(key, None) is not None
+
+    def incr(self, key, ttl):
+        with self._lock:
+            value = (self._get_alive(key) or 0) + 1
+            expires = self._data.get(key, (None, time.monotonic() + ttl))[1]
+            self._data[key] = (value, expires)
+            return value
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+
+class CacheCodeStore(BaseCodeStore):
+    """Хранилище кодов в кэше Django (VERIFICATION_CODE_CACHE).
+    В продакшене кэш должен быть общим для всех процессов, например
+    Redis."""
+
+    def __init__(self):
+        self.cache = caches[settings.VERIFICATION_CODE_CACHE]
+
+    def get(self, key):
+        return self.cache.get(key)
+
+    def set(self, key, value, ttl):
+        self.cache.set(key, value, ttl)
+
+    def delete(self, key):
+        return self.cache.delete(key)
+
+    def incr(self, key, ttl):
+        self.cache.add(key, 0, ttl)
+        try:
+            return self.cache.incr(key)
+        except ValueError:
+            # Ключ истек между add и incr.
+            self.cache.add(key, 1, ttl)
+            return 1
+
+
+@lru_cache(maxsize=None)
+def load_code_store(path):
+    return import_string(path)()
+
+
+def get_code_store():
+    """Возвращает хранилище кодов, заданное в VERIFICATION_CODE_STORE."""
+    return load_code_store(settings.VERIFICATION_CODE_STORE)